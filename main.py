@@ -2,11 +2,17 @@ import streamlit as st
 import pandas as pd
 import time
 from utils.validators import is_valid_url
-from utils.scraper import scrape_website_static, scrape_website_dynamic
-from utils.ai_helpers import ask_chatgpt, ask_groq, ask_gemini, analyze_scraped_data, GROQ_MODELS, OPENAI_MODELS, GEMINI_MODELS
+from utils.scraper import scrape_website_static, scrape_website_dynamic, scrape_structured_data, parse_attribute_list, iter_scrape_batches, expected_columns
+from utils.sinks import SINK_FORMATS, export_path, open_sink, stream_to_sink
+from utils.parallel import iter_scrape_parallel, default_workers
+from utils.ai_helpers import stream_chatgpt, stream_groq, stream_gemini, stream_analysis, stream_answer, build_question_prompt, map_reduce_analysis, analysis_token_report, ask_providers, ANALYSIS_WORKERS, PROVIDER_TIMEOUT, PROVIDER_NAMES, GROQ_MODELS, OPENAI_MODELS, GEMINI_MODELS
+from utils.response_cache import response_cache
+from utils.prompt_encoder import PROMPT_FORMATS
+from utils.telemetry import metrics_registry
 # Importaciones de los nuevos módulos (ahora se utilizarán)
 from utils.templates import get_all_templates, save_custom_template
-from utils.auto_detect import auto_detect_elements
+from utils.auto_detect import auto_detect_elements, structure_selectors, learn_domain_selectors
+from utils.selector_store import domain_key, load_domain_spec, delete_domain_spec
 from utils.project_manager import save_project, load_project, list_projects, delete_project, update_project
 
 # Configuración de la página con mejor soporte para móviles
@@ -128,6 +134,16 @@ if 'tag_filter' not in st.session_state:
     st.session_state.tag_filter = []
 if 'search_term' not in st.session_state:
     st.session_state.search_term = ""
+if 'profile_extraction' not in st.session_state:
+    st.session_state.profile_extraction = False
+# Datos estructurados (JSON-LD, microdatos, OpenGraph) de la plantilla activa
+if 'structured_data' not in st.session_state:
+    st.session_state.structured_data = None
+if 'prefer_structured_data' not in st.session_state:
+    # Opcional: los registros estructurados sustituyen a las filas del DOM
+    st.session_state.prefer_structured_data = False
+if 'use_response_cache' not in st.session_state:
+    st.session_state.use_response_cache = True
 
 # Función para cambiar el modo de visualización
 def change_view_mode():
@@ -138,6 +154,7 @@ def load_template(template_id, templates):
     if template_id in templates:
         template = templates[template_id]
         st.session_state.selected_tags = template["tags"].copy()
+        st.session_state.structured_data = template.get("structured_data")
         
         # Si la plantilla incluye configuraciones de Selenium
         if "use_selenium" in template:
@@ -145,6 +162,11 @@ def load_template(template_id, templates):
         if "wait_time" in template:
             st.session_state.wait_time = template["wait_time"]
 
+# Informe de tokens del análisis; se recalcula solo si cambian los datos, el modelo o el formato
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_analysis_token_report(data, model, model_name, output_format):
+    return analysis_token_report(data, model, model_name, output_format)
+
 # Cargar API Keys desde secrets o inicializarlas
 def load_api_keys():
     try:
@@ -230,6 +252,7 @@ with st.sidebar:
                     if project_data:
                         st.session_state.last_url = project_data["url"]
                         st.session_state.selected_tags = project_data["tags_info"]
+                        st.session_state.structured_data = None
                         st.session_state.use_selenium = project_data.get("use_selenium", False)
                         st.session_state.wait_time = project_data.get("wait_time", 3)
                         st.session_state.current_project_id = selected_project
@@ -335,6 +358,21 @@ with st.sidebar:
                                                        help="Para contenido dinámico con JavaScript")
             st.session_state.wait_time = st.slider("Tiempo espera (s)", 1, 10, 
                                                   st.session_state.wait_time)
+            st.session_state.prefer_structured_data = st.checkbox("Priorizar datos estructurados",
+                                                                  value=st.session_state.prefer_structured_data,
+                                                                  help="Usa JSON-LD, microdatos u OpenGraph cuando la plantilla los admite, sin recorrer el DOM ni usar Selenium. Los resultados son los registros estructurados de la página (en un listado puede haber menos que elementos)")
+            st.session_state.profile_extraction = st.checkbox("Perfilar extracción",
+                                                              value=st.session_state.profile_extraction,
+                                                              help="Mide tiempos y coincidencias de cada selector")
+            st.session_state.use_response_cache = st.checkbox("Usar caché de respuestas de IA",
+                                                              value=st.session_state.use_response_cache,
+                                                              help="Repite al instante las preguntas y análisis ya hechos con el mismo modelo; desactívalo para pedir siempre una respuesta nueva")
+            if st.button("🗑️ Vaciar caché de IA"):
+                success, message = response_cache.clear()
+                if success:
+                    st.success(message)
+                else:
+                    st.error(message)
 
 # Título de la app con ícono y descripción compacta
 col1, col2 = st.columns([1, 6])
@@ -374,19 +412,89 @@ with tab1:
                     else:
                         st.session_state.auto_detected_elements = detection_result
                         st.session_state.selected_tags = detection_result["suggested_selectors"]
+                        st.session_state.structured_data = None
                         st.success(f"Detectado tipo de página: {detection_result['page_type']}")
                         st.rerun()
         with col2:
             templates = st.session_state.templates
             template_options = list(templates.keys())
+            # Tras la autodetección se preselecciona la plantilla que mejor encaja en la página
+            detected = st.session_state.auto_detected_elements
+            template_scores = {item["template_id"]: item["score"]
+                               for item in (detected or {}).get("template_ranking", [])}
+            best_template = max(template_scores, key=template_scores.get) if template_scores else None
+            template_index = template_options.index(best_template) \
+                if best_template in template_options and template_scores[best_template] > 0 else 0
             selected = st.selectbox("📋 Plantillas", 
                                    options=template_options,
-                                   format_func=lambda x: templates[x].get("name", x))
+                                   index=template_index,
+                                   format_func=lambda x: f"{templates[x].get('name', x)} ({template_scores[x]:.0%})"
+                                   if x in template_scores else templates[x].get("name", x))
             if st.button("Aplicar plantilla", key="apply_template_btn", use_container_width=True):
                 load_template(selected, templates)
                 st.success(f"Plantilla '{templates[selected].get('name')}' aplicada")
                 st.rerun()
-                
+
+        # Aprender selectores estables analizando varias páginas del mismo sitio
+        with st.expander("📚 Aprendizaje por dominio"):
+            domain = domain_key(url)
+            learned_spec = load_domain_spec(domain)
+            if learned_spec:
+                st.caption(f"{domain}: selectores aprendidos de {len(learned_spec.get('pages', []))} páginas "
+                           f"({learned_spec.get('learned_at', '')[:16]}). La autodetección los usa directamente.")
+            learn_pages = st.number_input("Páginas a analizar", min_value=2, max_value=20, value=5, key="learn_pages")
+            learn_col, forget_col = st.columns(2)
+            with learn_col:
+                if st.button("Aprender selectores del sitio", key="learn_domain_btn", use_container_width=True):
+                    with st.spinner(f"Analizando {learn_pages} páginas de {domain}..."):
+                        learned = learn_domain_selectors(url, sample_size=int(learn_pages))
+                    if "error" in learned:
+                        st.error(f"Error: {learned['error']}")
+                    else:
+                        st.session_state.auto_detected_elements = auto_detect_elements(url)
+                        st.session_state.selected_tags = learned["suggested_selectors"]
+                        st.session_state.structured_data = None
+                        st.rerun()
+            with forget_col:
+                if learned_spec and st.button("Olvidar selectores", key="forget_domain_btn", use_container_width=True):
+                    success, message = delete_domain_spec(domain)
+                    if success:
+                        st.session_state.auto_detected_elements = None
+                        st.rerun()
+                    else:
+                        st.error(message)
+
+        # Listados repetidos encontrados por la autodetección
+        detected = st.session_state.auto_detected_elements
+        structures = detected.get("repeated_structures", []) if detected else []
+        if detected and "confidence" in detected:
+            sample_note = " · página grande: se analizó una muestra" if detected.get("sampled") else ""
+            if detected.get("learned"):
+                sample_note = " · selectores aprendidos del dominio"
+            elif detected.get("cached"):
+                sample_note += " · diseño ya analizado en este dominio"
+            st.caption(f"Tipo detectado: {detected['page_type']} · confianza {detected['confidence']:.0%}{sample_note}")
+        selector_report = detected.get("selector_report", []) if detected else []
+        if selector_report:
+            discarded = sum(1 for row in selector_report if row["estado"] != "ok")
+            with st.expander(f"✅ Validación de selectores ({discarded} descartados)"):
+                st.dataframe(pd.DataFrame(selector_report), use_container_width=True, hide_index=True)
+        if structures:
+            with st.expander(f"🧩 Estructuras repetidas ({len(structures)})"):
+                st.dataframe(pd.DataFrame([{
+                    "Contenedor": s["container"],
+                    "Elementos": s["items"],
+                    "Cobertura": f"{s['coverage']:.0%}",
+                    "Campos": ", ".join(f.split()[-1] for f in s["fields"])
+                } for s in structures]), use_container_width=True, hide_index=True)
+                structure_idx = st.selectbox("Estructura", options=range(len(structures)),
+                                             format_func=lambda i: structures[i]["container"],
+                                             key="structure_select")
+                if st.button("Usar estructura", key="apply_structure_btn"):
+                    st.session_state.selected_tags = structure_selectors(structures[structure_idx])
+                    st.session_state.structured_data = None
+                    st.rerun()
+
     # Versión compacta para dispositivos pequeños
     tag_select_container = st.container()
     
@@ -475,87 +583,32 @@ with tab1:
                         }
         else:
             # Modo expandido: usar el diseño con pestañas
-            tag_categories = st.tabs(["Estructura", "Contenido", "Tablas/Listas", "Media", "Interactivos"])
-            
-            # 1. Etiquetas de estructura
-            with tag_categories[0]:
-                struct_tags = ["div", "main", "article", "section", "aside", "header", "footer", "nav"]
-                col1, col2 = st.columns(2)
-                for i, tag in enumerate(struct_tags):
-                    with col1 if i % 2 == 0 else col2:
-                        if st.checkbox(f"{tag}", key=f"tag_{tag}"):
-                            class_name = st.text_input(f"Clase CSS", key=f"class_{tag}")
-                            id_name = st.text_input(f"ID", key=f"id_{tag}")
-                            css_selector = st.text_input(f"Selector CSS", key=f"selector_{tag}")
-                            st.session_state.selected_tags[tag] = {
-                                "class": class_name, "id": id_name, "selector": css_selector
-                            }
-                        elif tag in st.session_state.selected_tags:
-                            del st.session_state.selected_tags[tag]
-            
-            # 2. Etiquetas de contenido
-            with tag_categories[1]:
-                content_tags = ["p", "span", "h1", "h2", "h3", "h4", "strong", "em", "time"]
-                col1, col2 = st.columns(2)
-                for i, tag in enumerate(content_tags):
-                    with col1 if i % 2 == 0 else col2:
-                        if st.checkbox(f"{tag}", key=f"tag_{tag}"):
-                            class_name = st.text_input(f"Clase CSS", key=f"class_{tag}")
-                            id_name = st.text_input(f"ID", key=f"id_{tag}")
-                            css_selector = st.text_input(f"Selector CSS", key=f"selector_{tag}")
-                            st.session_state.selected_tags[tag] = {
-                                "class": class_name, "id": id_name, "selector": css_selector
-                            }
-                        elif tag in st.session_state.selected_tags:
-                            del st.session_state.selected_tags[tag]
-            
-            # 3. Tablas y listas
-            with tag_categories[2]:
-                list_tags = ["ul", "ol", "li", "table", "tr", "td", "th"]
-                col1, col2 = st.columns(2)
-                for i, tag in enumerate(list_tags):
-                    with col1 if i % 2 == 0 else col2:
-                        if st.checkbox(f"{tag}", key=f"tag_{tag}"):
-                            class_name = st.text_input(f"Clase CSS", key=f"class_{tag}")
-                            id_name = st.text_input(f"ID", key=f"id_{tag}")
-                            css_selector = st.text_input(f"Selector CSS", key=f"selector_{tag}")
-                            st.session_state.selected_tags[tag] = {
-                                "class": class_name, "id": id_name, "selector": css_selector
-                            }
-                        elif tag in st.session_state.selected_tags:
-                            del st.session_state.selected_tags[tag]
-            
-            # 4. Media
-            with tag_categories[3]:
-                media_tags = ["img", "video", "audio", "source", "picture", "figure", "figcaption"]
-                col1, col2 = st.columns(2)
-                for i, tag in enumerate(media_tags):
-                    with col1 if i % 2 == 0 else col2:
-                        if st.checkbox(f"{tag}", key=f"tag_{tag}"):
-                            class_name = st.text_input(f"Clase CSS", key=f"class_{tag}")
-                            id_name = st.text_input(f"ID", key=f"id_{tag}")
-                            css_selector = st.text_input(f"Selector CSS", key=f"selector_{tag}")
-                            st.session_state.selected_tags[tag] = {
-                                "class": class_name, "id": id_name, "selector": css_selector
-                            }
-                        elif tag in st.session_state.selected_tags:
-                            del st.session_state.selected_tags[tag]
-            
-            # 5. Interactivos
-            with tag_categories[4]:
-                interact_tags = ["a", "button", "form", "input", "select", "option", "label", "iframe"]
-                col1, col2 = st.columns(2)
-                for i, tag in enumerate(interact_tags):
-                    with col1 if i % 2 == 0 else col2:
-                        if st.checkbox(f"{tag}", key=f"tag_{tag}"):
-                            class_name = st.text_input(f"Clase CSS", key=f"class_{tag}")
-                            id_name = st.text_input(f"ID", key=f"id_{tag}")
-                            css_selector = st.text_input(f"Selector CSS", key=f"selector_{tag}")
-                            st.session_state.selected_tags[tag] = {
-                                "class": class_name, "id": id_name, "selector": css_selector
-                            }
-                        elif tag in st.session_state.selected_tags:
-                            del st.session_state.selected_tags[tag]
+            # Etiquetas por categoría: estructura, contenido, tablas/listas, media e interactivos
+            tag_groups = {
+                "Estructura": ["div", "main", "article", "section", "aside", "header", "footer", "nav"],
+                "Contenido": ["p", "span", "h1", "h2", "h3", "h4", "strong", "em", "time"],
+                "Tablas/Listas": ["ul", "ol", "li", "table", "tr", "td", "th"],
+                "Media": ["img", "video", "audio", "source", "picture", "figure", "figcaption"],
+                "Interactivos": ["a", "button", "form", "input", "select", "option", "label", "iframe"]
+            }
+            for tab, group_tags in zip(st.tabs(list(tag_groups)), tag_groups.values()):
+                with tab:
+                    col1, col2 = st.columns(2)
+                    for i, tag in enumerate(group_tags):
+                        with col1 if i % 2 == 0 else col2:
+                            if st.checkbox(f"{tag}", key=f"tag_{tag}"):
+                                class_name = st.text_input(f"Clase CSS", key=f"class_{tag}")
+                                id_name = st.text_input(f"ID", key=f"id_{tag}")
+                                css_selector = st.text_input(f"Selector CSS", key=f"selector_{tag}")
+                                extra_attrs = st.text_input(f"Atributos extra", key=f"attrs_{tag}",
+                                                            placeholder="data-price, title")
+                                st.session_state.selected_tags[tag] = {
+                                    "class": class_name, "id": id_name, "selector": css_selector
+                                }
+                                if extra_attrs:
+                                    st.session_state.selected_tags[tag]["fields"] = {"attrs": parse_attribute_list(extra_attrs)}
+                            elif tag in st.session_state.selected_tags:
+                                del st.session_state.selected_tags[tag]
     
     # Mostrar elementos seleccionados de manera más compacta
     if st.session_state.selected_tags:
@@ -566,6 +619,8 @@ with tab1:
                     st.code(f"Selector: {attrs['selector']}")
                 else:
                     st.code(f"<{tag}> clase='{attrs['class']}' id='{attrs['id']}'")
+                if attrs.get('fields'):
+                    st.caption(f"Campos: {attrs['fields']}")
     else:
         st.info("Selecciona al menos un elemento")
     
@@ -577,10 +632,21 @@ with tab1:
                 type="primary"):
         with st.spinner("⏱️ Extrayendo datos..."):
             try:
-                if st.session_state.use_selenium:  # Usar la variable del estado de sesión
-                    results = scrape_website_dynamic(url, st.session_state.selected_tags, st.session_state.wait_time)
+                structured_data = st.session_state.structured_data if st.session_state.prefer_structured_data else None
+                
+                if structured_data and st.session_state.use_selenium:
+                    # Vía rápida sin navegador; si no cubre los campos se usa Selenium
+                    results = scrape_structured_data(url, structured_data)
+                    if results is None:
+                        results = scrape_website_dynamic(url, st.session_state.selected_tags, st.session_state.wait_time,
+                                                         profile=st.session_state.profile_extraction)
+                elif st.session_state.use_selenium:  # Usar la variable del estado de sesión
+                    results = scrape_website_dynamic(url, st.session_state.selected_tags, st.session_state.wait_time,
+                                                     profile=st.session_state.profile_extraction)
                 else:
-                    results = scrape_website_static(url, st.session_state.selected_tags)
+                    results = scrape_website_static(url, st.session_state.selected_tags,
+                                                    profile=st.session_state.profile_extraction,
+                                                    structured_data=structured_data)
                 
                 if isinstance(results, pd.DataFrame):
                     st.session_state.scraping_results = results
@@ -592,6 +658,53 @@ with tab1:
             except Exception as e:
                 st.error(f"❌ Error: {str(e)}")
 
+    # Extracción por lotes de varias URLs con escritura incremental en disco
+    with st.expander("📦 Extracción por lotes (varias URLs)"):
+        batch_urls_text = st.text_area("URLs (una por línea):", key="batch_urls",
+                                       placeholder="https://ejemplo.com/pagina/1\nhttps://ejemplo.com/pagina/2")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            batch_format = st.selectbox("Formato:", options=list(SINK_FORMATS.keys()), key="batch_format")
+        with col2:
+            batch_size = st.number_input("Filas por lote:", min_value=50, max_value=10000, value=500, step=50)
+        with col3:
+            batch_workers = st.number_input("Procesos:", min_value=1, max_value=max(1, default_workers() * 2),
+                                            value=1, help="Más de 1 reparte el parseo entre procesos (no disponible con Selenium)")
+        
+        batch_urls = [u.strip() for u in batch_urls_text.splitlines() if u.strip()]
+        invalid_urls = [u for u in batch_urls if not is_valid_url(u)]
+        if invalid_urls:
+            st.error(f"❌ URLs inválidas: {', '.join(invalid_urls)}")
+        
+        if st.button("📦 Extraer y guardar en disco",
+                     disabled=not (batch_urls and not invalid_urls and st.session_state.selected_tags),
+                     use_container_width=True):
+            output_path = export_path("lote", batch_format)
+            batch_errors = []
+            progress_text = st.empty()
+            try:
+                if batch_workers > 1 and not st.session_state.use_selenium:
+                    batches = iter_scrape_parallel(batch_urls, st.session_state.selected_tags,
+                                                   workers=batch_workers,
+                                                   batch_size=batch_size,
+                                                   errors=batch_errors)
+                else:
+                    batches = iter_scrape_batches(batch_urls, st.session_state.selected_tags,
+                                                  batch_size=batch_size,
+                                                  use_selenium=st.session_state.use_selenium,
+                                                  wait_time=st.session_state.wait_time,
+                                                  errors=batch_errors)
+                sink = open_sink(output_path, batch_format,
+                                 columns=expected_columns(st.session_state.selected_tags, include_url=True),
+                                 buffer_size=batch_size)
+                total_rows = stream_to_sink(batches, sink,
+                                            progress_callback=lambda n: progress_text.write(f"⏱️ {n} filas procesadas..."))
+                st.success(f"✅ {total_rows} filas guardadas en {output_path}")
+                for failed_url, error in batch_errors:
+                    st.warning(f"⚠️ {failed_url}: {error}")
+            except Exception as e:
+                st.error(f"❌ Error: {str(e)}")
+
 # Tab 2: Resultados más responsivos
 with tab2:
     if st.session_state.scraping_results is not None and not st.session_state.scraping_results.empty:
@@ -641,6 +754,15 @@ with tab2:
         for col in ['href', 'src', 'alt', 'texto_enlace']:
             if col in available_cols:
                 extra_cols.append(col)
+        
+        # Columnas de atributos personalizados definidos en los campos de cada etiqueta
+        for attrs in st.session_state.selected_tags.values():
+            custom_attrs = attrs.get('fields', {}).get('attrs', [])
+            if isinstance(custom_attrs, str):
+                custom_attrs = parse_attribute_list(custom_attrs)
+            for col in (custom_attrs.keys() if isinstance(custom_attrs, dict) else custom_attrs):
+                if col in available_cols and col not in extra_cols:
+                    extra_cols.append(col)
                 
         if st.session_state.view_mode == "expanded":
             columns_to_display.extend(extra_cols)
@@ -649,11 +771,32 @@ with tab2:
         st.dataframe(filtered_results[columns_to_display], 
                      use_container_width=True)
         
+        # Perfil de extracción por selector (solo si se activó en las opciones avanzadas)
+        profile = results.attrs.get("profile")
+        if profile:
+            with st.expander("⏱️ Perfil de extracción"):
+                stage_cols = st.columns(4)
+                stage_cols[0].metric("Descarga", f"{profile.get('fetch_s', 0) * 1000:.0f} ms")
+                stage_cols[1].metric("Parseo", f"{profile.get('parse_s', 0) * 1000:.0f} ms")
+                stage_cols[2].metric("Extracción", f"{profile.get('extract_s', 0) * 1000:.0f} ms")
+                stage_cols[3].metric("DataFrame", f"{profile.get('dataframe_s', 0) * 1000:.0f} ms")
+                if "driver_s" in profile:
+                    st.caption(f"Inicio del navegador: {profile['driver_s']:.2f} s")
+                
+                selector_profile = pd.DataFrame(profile.get("selectors", []))
+                if not selector_profile.empty:
+                    selector_profile["total_ms"] = (selector_profile["seleccion_s"] + selector_profile["extraccion_s"]) * 1000
+                    selector_profile["seleccion_ms"] = selector_profile["seleccion_s"] * 1000
+                    selector_profile["extraccion_ms"] = selector_profile["extraccion_s"] * 1000
+                    selector_profile = selector_profile.drop(columns=["seleccion_s", "extraccion_s"])
+                    st.dataframe(selector_profile.sort_values("total_ms", ascending=False).round(2),
+                                 use_container_width=True)
+        
         # Botón para ver detalles del HTML
         if st.button("Ver detalles HTML", use_container_width=True):
             for i, row in filtered_results.iterrows():
                 with st.expander(f"{row['Etiqueta']}: {row['Contenido'][:50]}..."):
-                    st.code(row['HTML'], language="html")
+                    st.code(row.get('HTML', ''), language="html")
         
         # Exportar - versión compacta
         col1, col2 = st.columns(2)
@@ -697,7 +840,7 @@ with tab2:
 
 # Tab 3: Asistente de IA más compacto
 with tab3:
-    ai_tabs = st.tabs(["🤖 Preguntar", "📊 Analizar"])
+    ai_tabs = st.tabs(["🤖 Preguntar", "📊 Analizar", "📈 Métricas"])
     
     # Tab para hacer preguntas - más responsivo
     with ai_tabs[0]:
@@ -707,30 +850,33 @@ with tab3:
         if st.session_state.view_mode == "compact":
             if st.button("Preguntar a ChatGPT", use_container_width=True, disabled=not query):
                 with st.spinner(f"Consultando a ChatGPT (modelo: {OPENAI_MODELS.get(st.session_state.selected_openai_model)})..."):
-                    response = ask_chatgpt(
+                    st.write("### ChatGPT")
+                    response = st.write_stream(stream_chatgpt(
                         query, 
                         st.session_state.get('chatgpt_api_key', ''),
-                        st.session_state.selected_openai_model
-                    )
-                    st.write(response)
+                        st.session_state.selected_openai_model,
+                        use_cache=st.session_state.use_response_cache
+                    ))
                     
             if st.button("Preguntar a Groq", use_container_width=True, disabled=not query):
                 with st.spinner(f"Consultando a Groq (modelo: {GROQ_MODELS.get(st.session_state.selected_groq_model)})..."):
-                    response = ask_groq(
+                    st.write("### Groq")
+                    response = st.write_stream(stream_groq(
                         query, 
                         st.session_state.get('groq_api_key', ''),
-                        st.session_state.selected_groq_model
-                    )
-                    st.write(response)
+                        st.session_state.selected_groq_model,
+                        use_cache=st.session_state.use_response_cache
+                    ))
                     
             if st.button("Preguntar a Gemini", use_container_width=True, disabled=not query):
                 with st.spinner(f"Consultando a Gemini (modelo: {GEMINI_MODELS.get(st.session_state.selected_gemini_model)})..."):
-                    response = ask_gemini(
+                    st.write("### Gemini")
+                    response = st.write_stream(stream_gemini(
                         query, 
                         st.session_state.get('gemini_api_key', ''),
-                        st.session_state.selected_gemini_model
-                    )
-                    st.write(response)
+                        st.session_state.selected_gemini_model,
+                        use_cache=st.session_state.use_response_cache
+                    ))
         else:
             # En modo expandido, botones en horizontal
             col1, col2, col3 = st.columns(3)
@@ -738,35 +884,81 @@ with tab3:
             with col1:
                 if st.button("Preguntar a ChatGPT", use_container_width=True, disabled=not query):
                     with st.spinner(f"Consultando a ChatGPT (modelo: {OPENAI_MODELS.get(st.session_state.selected_openai_model)})..."):
-                        response = ask_chatgpt(
+                        st.write("### ChatGPT")
+                        response = st.write_stream(stream_chatgpt(
                             query, 
                             st.session_state.get('chatgpt_api_key', ''),
-                            st.session_state.selected_openai_model
-                        )
-                        st.write("### ChatGPT")
-                        st.write(response)
+                            st.session_state.selected_openai_model,
+                            use_cache=st.session_state.use_response_cache
+                        ))
             
             with col2:
                 if st.button("Preguntar a Groq", use_container_width=True, disabled=not query):
                     with st.spinner(f"Consultando a Groq (modelo: {GROQ_MODELS.get(st.session_state.selected_groq_model)})..."):
-                        response = ask_groq(
+                        st.write("### Groq")
+                        response = st.write_stream(stream_groq(
                             query, 
                             st.session_state.get('groq_api_key', ''),
-                            st.session_state.selected_groq_model
-                        )
-                        st.write("### Groq")
-                        st.write(response)
+                            st.session_state.selected_groq_model,
+                            use_cache=st.session_state.use_response_cache
+                        ))
             
             with col3:
                 if st.button("Preguntar a Gemini", use_container_width=True, disabled=not query):
                     with st.spinner(f"Consultando a Gemini (modelo: {GEMINI_MODELS.get(st.session_state.selected_gemini_model)})..."):
-                        response = ask_gemini(
+                        st.write("### Gemini")
+                        response = st.write_stream(stream_gemini(
                             query, 
                             st.session_state.get('gemini_api_key', ''),
-                            st.session_state.selected_gemini_model
-                        )
-                        st.write("### Gemini")
-                        st.write(response)
+                            st.session_state.selected_gemini_model,
+                            use_cache=st.session_state.use_response_cache
+                        ))
+        
+        # Consulta simultánea a varios proveedores
+        with st.expander("⚖️ Comparar proveedores"):
+            fanout_providers = st.multiselect(
+                "Proveedores:",
+                ["ChatGPT", "Groq", "Gemini"],
+                default=["ChatGPT", "Groq", "Gemini"]
+            )
+            fanout_mode = st.radio(
+                "Respuestas:",
+                ["Todas", "Primera válida"],
+                horizontal=True,
+                help="Con 'Primera válida' se muestra la primera respuesta correcta y se descartan las demás"
+            )
+            fanout_timeout = st.slider("Tiempo máximo por proveedor (s)", 5, 120, int(PROVIDER_TIMEOUT))
+            
+            if st.button("Preguntar a los seleccionados", use_container_width=True,
+                         disabled=not query or not fanout_providers):
+                providers = {}
+                if "ChatGPT" in fanout_providers:
+                    providers["chatgpt"] = (st.session_state.get('chatgpt_api_key', ''), st.session_state.selected_openai_model)
+                if "Groq" in fanout_providers:
+                    providers["groq"] = (st.session_state.get('groq_api_key', ''), st.session_state.selected_groq_model)
+                if "Gemini" in fanout_providers:
+                    providers["gemini"] = (st.session_state.get('gemini_api_key', ''), st.session_state.selected_gemini_model)
+                
+                with st.spinner(f"Consultando a {', '.join(fanout_providers)}..."):
+                    fanout_results = ask_providers(
+                        query,
+                        providers,
+                        mode="first" if fanout_mode == "Primera válida" else "all",
+                        timeout=fanout_timeout,
+                        use_cache=st.session_state.use_response_cache
+                    )
+                
+                shown_results = [(provider, result) for provider, result in fanout_results.items()
+                                 if result["estado"] != "cancelado"]
+                if st.session_state.view_mode == "compact":
+                    result_columns = [st.container() for _ in shown_results]
+                else:
+                    result_columns = st.columns(max(1, len(shown_results)))
+                for column, (provider, result) in zip(result_columns, shown_results):
+                    with column:
+                        st.write(f"### {PROVIDER_NAMES[provider]}")
+                        st.caption(f"{result['modelo']} · {result['segundos']:.1f} s")
+                        st.write(result["respuesta"])
     
     # Tab para analizar datos - simplificado
     with ai_tabs[1]:
@@ -819,41 +1011,111 @@ with tab3:
                 )
                 selected_model = analysis_model
             
-            # Mostrar cantidad estimada de tokens
+            analysis_format = st.radio(
+                "Formato de los datos:",
+                options=list(PROMPT_FORMATS.keys()),
+                format_func=lambda x: PROMPT_FORMATS[x],
+                horizontal=True,
+                help="Los datos se envían sin HTML ni espacios de relleno para que quepan más filas en cada consulta"
+            )
+            model_type = {"ChatGPT": "chatgpt", "Groq": "groq", "Gemini": "gemini"}[ai_model]
+            
+            # Mostrar cantidad estimada de tokens y el ahorro frente a la tabla completa
             if analysis_data is not None:
-                from utils.ai_helpers import estimate_tokens
-                sample_data = analysis_data.head(15) if len(analysis_data) > 15 else analysis_data
-                data_str = sample_data.to_string()
-                estimated_tokens = estimate_tokens(data_str)
-                st.write(f"Tokens estimados para análisis: ~{estimated_tokens}")
+                token_report = cached_analysis_token_report(analysis_data, model_type, selected_model, analysis_format)
+                st.write(f"Tokens estimados para análisis: ~{token_report['tokens']} "
+                         f"({token_report['filas']} de {token_report['filas_totales']} filas)")
+                if token_report["tokens_tabla"]:
+                    st.caption(f"Como tabla ocuparían ~{token_report['tokens_tabla']} tokens: "
+                               f"{token_report['ahorro']:.0%} de ahorro")
+            
+            data_question = st.text_input(
+                "Pregunta sobre los datos (opcional):",
+                placeholder="¿Qué productos cuestan menos de 20 €?",
+                help="Se envían al modelo las filas más relevantes para la pregunta en lugar de las primeras"
+            )
+            
+            analyze_all = st.checkbox(
+                "Analizar todos los registros",
+                value=False,
+                help="Divide los datos en fragmentos que caben en el modelo, los resume en paralelo y combina los resúmenes. Hace varias consultas a la API."
+            )
+            if analyze_all:
+                analysis_workers = st.slider("Consultas simultáneas", 1, 8, ANALYSIS_WORKERS)
             
             if st.button("Analizar datos", use_container_width=True):
                 with st.spinner(f"Analizando con {ai_model}..."):
                     api_key = ""
-                    model_type = ""
                     
                     if ai_model == "ChatGPT":
                         api_key = st.session_state.get('chatgpt_api_key', '')
-                        model_type = "chatgpt"
                     elif ai_model == "Groq":
                         api_key = st.session_state.get('groq_api_key', '')
-                        model_type = "groq"
                     else:
                         api_key = st.session_state.get('gemini_api_key', '')
-                        model_type = "gemini"
-                        
-                    analysis = analyze_scraped_data(
-                        analysis_data,  # Usamos los datos seleccionados (filtrados o completos)
-                        api_key,
-                        model_type,
-                        selected_model
-                    )
                         
-                    st.write("### Análisis")
-                    st.write(analysis)
+                    if data_question.strip():
+                        question_prompt, question_rows = build_question_prompt(
+                            analysis_data, data_question, model_type, selected_model, analysis_format
+                        )
+                        st.write("### Respuesta")
+                        if question_rows < len(analysis_data):
+                            st.caption(f"Basada en las {question_rows} filas más relevantes de {len(analysis_data)}")
+                        else:
+                            st.caption("Incluye todas las filas, ordenadas por relevancia")
+                        analysis = st.write_stream(stream_answer(
+                            model_type,
+                            question_prompt,
+                            api_key,
+                            selected_model,
+                            use_cache=st.session_state.use_response_cache
+                        ))
+                    elif analyze_all:
+                        progress_bar = st.progress(0.0, text="Resumiendo fragmentos...")
+                        analysis = map_reduce_analysis(
+                            analysis_data,
+                            api_key,
+                            model_type,
+                            selected_model,
+                            workers=analysis_workers,
+                            use_cache=st.session_state.use_response_cache,
+                            progress=lambda done, total: progress_bar.progress(
+                                min(done / total, 1.0), text=f"Consultas completadas: {done}/{total}"),
+                            output_format=analysis_format
+                        )
+                        progress_bar.empty()
+                        st.write("### Análisis")
+                        st.write(analysis)
+                    else:
+                        st.write("### Análisis")
+                        analysis = st.write_stream(stream_analysis(
+                            analysis_data,  # Usamos los datos seleccionados (filtrados o completos)
+                            api_key,
+                            model_type,
+                            selected_model,
+                            use_cache=st.session_state.use_response_cache,
+                            output_format=analysis_format
+                        ))
         else:
             st.info("Sin datos para analizar. Ejecuta el scraping primero.")
 
+    # Pestaña de métricas de las llamadas a los modelos
+    with ai_tabs[2]:
+        st.caption("Latencia, tokens, truncados y reintentos de cada consulta a los modelos en esta sesión del servidor")
+        metrics_summary = metrics_registry.summary()
+        if metrics_summary.empty:
+            st.info("Aún no se ha consultado ningún modelo.")
+        else:
+            st.write("### Resumen por modelo")
+            st.dataframe(metrics_summary, use_container_width=True, hide_index=True)
+            with st.expander("Últimas llamadas"):
+                calls_df = pd.DataFrame(metrics_registry.records()[::-1])
+                calls_df["inicio"] = pd.to_datetime(calls_df["inicio"], unit="s")
+                st.dataframe(calls_df, use_container_width=True, hide_index=True)
+            if st.button("🗑️ Borrar métricas"):
+                metrics_registry.clear()
+                st.rerun()
+
 # Footer más compacto
 st.divider()
 st.markdown("<div style='text-align: center; opacity: 0.7'>Smart Scraper IA | Desarrollado con ❤️</div>", unsafe_allow_html=True)
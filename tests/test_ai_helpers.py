@@ -0,0 +1,318 @@
+import time
+
+import pandas as pd
+import pytest
+
+from utils import ai_helpers
+from utils.ai_helpers import (ask_providers, chunk_dataframe, estimate_tokens, get_cached_validation, is_auth_error,
+                              map_reduce_analysis, prompt_token_budget, stream_chatgpt, stream_local, truncate_content,
+                              validate_api_key)
+from utils.mock_llm_server import MockLLMServer, fake_answer
+from utils.response_cache import ResponseCache
+from utils.telemetry import metrics_registry
+
+class StatusError(Exception):
+    """Error con código HTTP, como los de los SDK de los proveedores"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+@pytest.fixture
+def validation_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai_helpers, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(ai_helpers, "VALIDATION_CACHE_FILE", tmp_path / "api_keys.json")
+    monkeypatch.setattr(ai_helpers, "_validation_cache", {})
+    return tmp_path / "api_keys.json"
+
+@pytest.mark.parametrize("message", [
+    "This model's maximum context length is 8192 tokens. However, your messages resulted in 24010 tokens",
+    "Request too large for model: Limit 6000, Requested 14017",
+    "Rate limit reached for tokens per min: Limit 6000, Used 4012, Requested 2401",
+])
+def test_token_counts_are_not_auth_errors(message):
+    assert not is_auth_error(Exception(message))
+    assert not is_auth_error(StatusError(message, 400))
+
+@pytest.mark.parametrize("error", [
+    StatusError("No autorizado", 401),
+    StatusError("Sin permisos", 403),
+    Exception("Error code: 401 - {'error': {'message': 'Incorrect API key provided'}}"),
+    Exception("400 API key not valid. Please pass a valid API key. [reason: API_KEY_INVALID]"),
+])
+def test_auth_errors(error):
+    assert is_auth_error(error)
+
+def test_validations_are_cached_with_a_ttl_per_result(validation_file, monkeypatch):
+    calls = []
+
+    class Models:
+        def list(self):
+            calls.append(1)
+            raise StatusError("Incorrect API key provided", 401)
+
+    class Client:
+        models = Models()
+
+    monkeypatch.setattr(ai_helpers, "get_client", lambda provider, api_key: Client())
+    valid, message = validate_api_key("openai", "sk-mala")
+    assert not valid and message.startswith("API key inválida")
+    # La segunda validación sale de la caché, sin llamadas
+    assert validate_api_key("openai", "sk-mala") == (valid, message)
+    assert len(calls) == 1
+    # Otro proceso la lee del archivo compartido, que no guarda la key
+    assert "sk-mala" not in validation_file.read_text(encoding="utf-8")
+    ai_helpers._validation_cache.clear()
+    assert get_cached_validation("openai", "sk-mala") == (valid, message)
+
+    # Las keys inválidas caducan antes que las válidas
+    ai_helpers._store_validation("groq", "gsk-buena", True, "API key válida")
+    now = ai_helpers.time.time()
+    monkeypatch.setattr(ai_helpers.time, "time", lambda: now + ai_helpers.INVALID_KEY_TTL + 1)
+    assert get_cached_validation("openai", "sk-mala") is None
+    assert get_cached_validation("groq", "gsk-buena") == (True, "API key válida")
+    monkeypatch.setattr(ai_helpers.time, "time", lambda: now + ai_helpers.VALID_KEY_TTL + 1)
+    assert get_cached_validation("groq", "gsk-buena") is None
+
+def test_transient_errors_are_not_cached(validation_file, monkeypatch):
+    class Models:
+        def list(self):
+            raise StatusError("Rate limit reached: Used 4012, Requested 2401", 429)
+
+    class Client:
+        models = Models()
+
+    monkeypatch.setattr(ai_helpers, "get_client", lambda provider, api_key: Client())
+    valid, message = validate_api_key("groq", "gsk-x")
+    assert not valid and message.startswith("Error validando API key")
+    assert get_cached_validation("groq", "gsk-x") is None
+
+class CharEncoding:
+    """Codificación de prueba con un token por carácter"""
+    name = "caracteres"
+
+    def encode(self, text, disallowed_special=()):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens):
+        return "".join(chr(token) for token in tokens)
+
+@pytest.fixture
+def exact_tokens(monkeypatch):
+    monkeypatch.setattr(ai_helpers, "_tokenizer_for", lambda model_name: CharEncoding())
+    monkeypatch.setattr(ai_helpers, "_token_counts", ai_helpers.OrderedDict())
+
+@pytest.fixture
+def approximate_tokens(monkeypatch):
+    monkeypatch.setattr(ai_helpers, "_tokenizer_for", lambda model_name: None)
+
+def test_exact_counts_have_no_margin(exact_tokens):
+    assert estimate_tokens("hola", "llama-3.3-70b-versatile") == 4
+    assert estimate_tokens("hola", "gpt-4o") == 4
+    assert estimate_tokens("") == 0
+
+def test_approximate_counts_add_the_margin(approximate_tokens):
+    assert estimate_tokens("x" * 350, "llama-3.3-70b-versatile") == int(100 * ai_helpers.APPROXIMATE_TOKEN_MARGIN)
+
+@pytest.mark.parametrize("counting", ["exact_tokens", "approximate_tokens"])
+def test_truncation_keeps_start_and_end_within_budget(counting, request):
+    request.getfixturevalue(counting)
+    content = "inicio " + "relleno " * 2000 + "final"
+    assert truncate_content("corto", 100) == "corto"
+    truncated = truncate_content(content, 300, "llama-3.1-8b-instant")
+    assert truncated.startswith("inicio ") and truncated.endswith("final")
+    assert "[...CONTENIDO TRUNCADO...]" in truncated
+    assert 250 <= estimate_tokens(truncated, "llama-3.1-8b-instant") <= 300
+
+def test_prompt_budget_is_the_context_window_minus_the_response():
+    overhead = ai_helpers.MESSAGE_TOKEN_OVERHEAD
+    assert prompt_token_budget("llama-3.3-70b-versatile", 8192, 4000) == 131072 - 4000 - overhead
+    assert prompt_token_budget("gpt-4", 4096) == 8192 - ai_helpers.OUTPUT_TOKEN_RESERVE - overhead
+    # Modelos desconocidos: límite por defecto del proveedor
+    assert prompt_token_budget("modelo-nuevo", 8192) == 8192 - ai_helpers.OUTPUT_TOKEN_RESERVE - overhead
+
+def scraped(rows=60):
+    return pd.DataFrame({"Etiqueta": ["p"] * rows, "Contenido": [f"Producto número {i} con precio {i},99 €" for i in range(rows)]})
+
+def test_chunks_fit_the_budget_and_cover_every_row(approximate_tokens):
+    chunks = chunk_dataframe(scraped(), 120)
+    assert len(chunks) > 1
+    assert sum(rows for rows, _ in chunks) == 60
+    assert all(estimate_tokens(text) <= 120 for _, text in chunks)
+    # Una fila que no cabe sola se recorta
+    long_row = pd.DataFrame({"Etiqueta": ["p"], "Contenido": ["texto " * 500]})
+    [(rows, text)] = chunk_dataframe(long_row, 50)
+    assert rows == 1 and estimate_tokens(text) <= 50
+
+@pytest.fixture
+def fake_provider(approximate_tokens, monkeypatch):
+    """Proveedor sin red: los resúmenes parciales son largos para forzar la combinación por grupos"""
+    prompts = []
+
+    def ask(prompt, api_key, model_name, use_cache=True):
+        prompts.append(prompt)
+        if prompt.startswith("Resume el fragmento 2 "):
+            return "Error de prueba"
+        if prompt.startswith("Resume el fragmento"):
+            return "resumen parcial con cifras " * 12
+        if prompt.startswith("Combina"):
+            return "resumen combinado"
+        return "análisis final"
+
+    monkeypatch.setattr(ai_helpers, "_ask_function", lambda model: ask)
+    monkeypatch.setattr(ai_helpers, "analysis_token_budget", lambda model, model_name: 400)
+    return prompts
+
+def test_map_reduce_combines_summaries_until_they_fit(fake_provider):
+    progress = []
+    analysis = map_reduce_analysis(scraped(200), "key", "groq", "llama-3.1-8b-instant", workers=2,
+                                   progress=lambda done, total: progress.append((done, total)))
+    maps = [p for p in fake_provider if p.startswith("Resume el fragmento")]
+    combines = [p for p in fake_provider if p.startswith("Combina")]
+    assert len(maps) > 2 and combines
+    assert fake_provider[-1].startswith("Estos son los resúmenes")
+    assert all(estimate_tokens(p) <= 400 for p in fake_provider)
+    # El fragmento fallido se avisa y no se cuenta como cubierto
+    assert analysis.startswith(f"⚠️ 1 de {len(maps)} fragmentos no se pudieron analizar")
+    assert analysis.endswith("análisis final")
+    assert progress[-1][0] == progress[-1][1] == len(fake_provider)
+
+@pytest.fixture
+def llm_servers(tmp_path, monkeypatch, validation_file):
+    """Servidor local rápido ("local") y otro lento para ChatGPT y Groq, con caché y métricas aisladas"""
+    fast = MockLLMServer(port=0, latency=0.05, tokens_per_second=0)
+    slow = MockLLMServer(port=0, latency=2.0, tokens_per_second=0)
+    fast.start()
+    slow.start()
+    monkeypatch.setattr(ai_helpers, "LOCAL_LLM_URL", fast.url)
+    monkeypatch.setenv("OPENAI_BASE_URL", slow.url)
+    monkeypatch.setenv("GROQ_BASE_URL", slow.url.rsplit("/v1", 1)[0])
+    monkeypatch.setattr(ai_helpers, "response_cache", ResponseCache(tmp_path / "respuestas.sqlite3"))
+    ai_helpers.close_clients()
+    metrics_registry.clear()
+    yield fast, slow
+    ai_helpers.close_clients()
+    metrics_registry.clear()
+    fast.stop()
+    slow.stop()
+
+PROVIDERS_UNDER_TEST = {"local": ("", "mock-llm"), "chatgpt": ("sk-prueba", "gpt-4o-mini"),
+                        "groq": ("gsk-prueba", "llama-3.1-8b-instant")}
+
+def test_first_mode_cancels_the_slower_providers(llm_servers):
+    start = time.perf_counter()
+    results = ask_providers("hola", PROVIDERS_UNDER_TEST, mode="first")
+    assert time.perf_counter() - start < 1.5
+    assert list(results) == list(PROVIDERS_UNDER_TEST)
+    assert {name: result["estado"] for name, result in results.items()} == \
+        {"local": "ok", "chatgpt": "cancelado", "groq": "cancelado"}
+    assert results["chatgpt"]["respuesta"] is None
+    # Las consultas canceladas no dejan respuesta en la caché y quedan en las métricas
+    assert ai_helpers.cached_response("openai", "gpt-4o-mini", "hola", {"system": ai_helpers.CHATGPT_SYSTEM_PROMPT})[1] is None
+    states = {(r["proveedor"], r["estado"]) for r in metrics_registry.records()}
+    assert {("local", "ok"), ("openai", "cancelado"), ("groq", "cancelado")} <= states
+
+def test_all_mode_applies_the_timeout_per_provider(llm_servers):
+    providers = {**PROVIDERS_UNDER_TEST, "groq": ("gsk-prueba", "llama-3.1-8b-instant", 5.0)}
+    results = ask_providers("hola", providers, mode="all", timeout=0.5)
+    assert {name: result["estado"] for name, result in results.items()} == \
+        {"local": "ok", "chatgpt": "tiempo agotado", "groq": "ok"}
+    assert results["chatgpt"]["respuesta"].startswith("Error")
+    # La respuesta completa se guarda: la siguiente consulta sale de la caché
+    start = time.perf_counter()
+    again = ask_providers("hola", {"groq": providers["groq"]})
+    assert again["groq"]["respuesta"] == results["groq"]["respuesta"]
+    assert time.perf_counter() - start < 0.5
+
+@pytest.fixture
+def stream_server(tmp_path, monkeypatch, validation_file):
+    """Servidor simulado sin latencia para ChatGPT y el proveedor local"""
+    server = MockLLMServer(port=0, latency=0, tokens_per_second=0)
+    server.start()
+    monkeypatch.setattr(ai_helpers, "LOCAL_LLM_URL", server.url)
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+    monkeypatch.setattr(ai_helpers, "response_cache", ResponseCache(tmp_path / "respuestas.sqlite3"))
+    ai_helpers.close_clients()
+    metrics_registry.clear()
+    yield server
+    ai_helpers.close_clients()
+    metrics_registry.clear()
+    server.stop()
+
+def test_stream_records_usage_and_caches_the_answer(stream_server):
+    chunks = list(stream_chatgpt("hola", "sk-prueba", "gpt-4o-mini"))
+    assert len(chunks) == 60
+    assert "".join(chunks) == fake_answer(f"{ai_helpers.CHATGPT_SYSTEM_PROMPT}\nhola", 60)
+    record = metrics_registry.records()[-1]
+    # El consumo real llega en el último fragmento (stream_options.include_usage)
+    assert (record["operacion"], record["estado"], record["tokens_respuesta"]) == ("streaming", "ok", 60)
+    assert record["ttfb_s"] is not None
+    # La segunda vez se sirve de la caché en un solo fragmento
+    assert list(stream_chatgpt("hola", "sk-prueba", "gpt-4o-mini")) == ["".join(chunks)]
+    assert stream_server.stats["solicitudes"] == 1
+
+def test_interrupted_streams_are_not_cached(stream_server):
+    stream = stream_local("hola")
+    next(stream)
+    stream.close()
+    assert metrics_registry.records()[-1]["estado"] == "interrumpido"
+    assert ai_helpers.cached_response("local", "mock-llm", "hola", {"url": stream_server.url})[1] is None
+    assert "".join(stream_local("hola")) == fake_answer("hola", 60)
+    assert stream_server.stats["solicitudes"] == 2
+
+def test_stream_retries_with_a_shorter_prompt_when_the_context_is_exceeded(stream_server, approximate_tokens):
+    stream_server.config["context_limit"] = 4500
+    answer = "".join(stream_local("dato " * 3800))
+    assert not answer.startswith("Error") and len(answer.split()) == 60
+    assert stream_server.stats["errores_400"] == 1 and stream_server.stats["respuestas"] == 1
+
+def test_registered_providers_keep_the_default_context_windows():
+    assert {name: ai_helpers.PROVIDERS[name]["limite_tokens"] for name in ("chatgpt", "groq", "gemini")} == \
+        {"chatgpt": 4096, "groq": 8192, "gemini": 32768}
+    assert ai_helpers.analysis_token_budget("chatgpt", "modelo-nuevo") == \
+        4096 - ai_helpers.OUTPUT_TOKEN_RESERVE - ai_helpers.MESSAGE_TOKEN_OVERHEAD
+
+def test_map_reduce_without_key_lets_each_provider_answer(stream_server):
+    data = scraped(5)
+    # El servidor local no necesita key: el análisis llega con los datos, no con un prompt vacío
+    analysis = map_reduce_analysis(data, "", "local", "mock-llm")
+    assert not ai_helpers.is_error_response(analysis)
+    assert stream_server.stats["tokens_prompt"] > estimate_tokens(data["Contenido"].str.cat()) // 2
+    assert map_reduce_analysis(data, "", "chatgpt", "gpt-4o-mini").startswith("Por favor, ingresa tu ChatGPT API Key")
+    assert stream_server.stats["solicitudes"] == 1
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Registro de proveedores aislado para añadir proveedores de prueba"""
+    for name in ("PROVIDERS", "PROVIDER_NAMES", "DEFAULT_TOKEN_LIMITS"):
+        monkeypatch.setattr(ai_helpers, name, dict(getattr(ai_helpers, name)))
+    return ai_helpers.PROVIDERS
+
+def test_register_provider_adds_it_everywhere(registry):
+    def ask(prompt, api_key, model_name, use_cache=True):
+        return f"eco: {prompt}"
+
+    def stream(prompt, api_key, model_name, use_cache=True):
+        yield from ask(prompt, api_key, model_name).split(" ")
+
+    ai_helpers.register_provider("eco", "Eco", ask, stream, 2048)
+    assert registry["eco"] == {"nombre": "Eco", "consulta": ask, "streaming": stream, "consulta_async": None,
+                               "limite_tokens": 2048}
+    assert ai_helpers.PROVIDER_NAMES["eco"] == "Eco"
+    assert ai_helpers.analysis_token_budget("eco", "m") == 2048 - ai_helpers.OUTPUT_TOKEN_RESERVE - ai_helpers.MESSAGE_TOKEN_OVERHEAD
+    assert list(ai_helpers.stream_answer("eco", "hola", "", "m")) == ["eco:", "hola"]
+    assert list(ai_helpers.stream_answer("desconocido", "hola", "", "m")) == ["Modelo de IA no reconocido."]
+
+def test_fan_out_runs_providers_without_ask_async_in_threads(registry):
+    def slow_ask(prompt, api_key, model_name, use_cache=True):
+        time.sleep(1)
+        return "tarde"
+
+    ai_helpers.register_provider("eco", "Eco", lambda prompt, api_key, model_name, use_cache=True: f"eco: {prompt}",
+                                 None, 2048)
+    ai_helpers.register_provider("lento", "Lento", slow_ask, None, 2048)
+    results = ask_providers("hola", {"eco": ("", "m"), "lento": ("", "m"), "desconocido": ("", "m")}, mode="first")
+    assert {name: result["estado"] for name, result in results.items()} == {"eco": "ok", "lento": "cancelado"}
+    assert results["eco"]["respuesta"] == "eco: hola"
+    results = ask_providers("hola", {"eco": ("", "m"), "lento": ("", "m", 0.2)})
+    assert (results["eco"]["estado"], results["lento"]["estado"]) == ("ok", "tiempo agotado")
@@ -0,0 +1,139 @@
+from time import perf_counter
+
+from bs4 import BeautifulSoup, NavigableString
+import pytest
+
+from utils import auto_detect
+from utils.auto_detect import (collect_document_stats, detect_page_type, detection_confidence, find_repeated_structures,
+                               match_selectors, rank_templates, sample_document, structure_selectors,
+                               validate_selectors)
+
+def listing(items=12):
+    """Página de tienda con un listado de productos y algo de texto alrededor"""
+    products = "".join(
+        f'<li class="product item-{i}"><h3 class="title">Producto {i}</h3>'
+        f'<span class="price">{i},99 €</span><a href="/p/{i}">Ver</a></li>'
+        for i in range(items)
+    )
+    return (f'<html><head><title>Tienda</title></head><body><nav><a href="/">Inicio</a></nav>'
+            f'<ul class="products">{products}</ul><!-- comentario --><footer><p>Contacto</p></footer></body></html>')
+
+@pytest.fixture
+def soup():
+    return BeautifulSoup(listing(), "lxml")
+
+def test_stats_come_from_one_traversal(soup):
+    stats = collect_document_stats(soup)
+    assert stats.node_count == len(soup.find_all(True))
+    assert stats.tag_counts["li"] == 12 and stats.tag_counts["span"] == 12
+    assert stats.class_counts["li.product"] == 12 and stats.class_counts["span.price"] == 12
+    # Solo texto visible: los comentarios no cuentan
+    expected_text = sum(len(s.strip()) for s in soup.find_all(string=True) if type(s) is NavigableString)
+    assert stats.text_length == expected_text
+    assert len(stats.class_hits["product"]) >= 12
+    assert stats.indicator_counts["ecommerce"] > stats.indicator_counts["news"]
+    assert not stats.truncated
+    assert detect_page_type(soup, stats) == detect_page_type(soup) == "ecommerce"
+
+def test_repeated_structures_find_the_listing_and_its_fields(soup):
+    structures = find_repeated_structures(collect_document_stats(soup))
+    listing_structure = structures[0]
+    # Las clases con números (item-3) no forman parte del selector
+    assert listing_structure["container"] == "li.product"
+    assert listing_structure["items"] == 12
+    assert listing_structure["fields"] == ["li.product h3.title", "li.product span.price", "li.product a"]
+    # Las celdas de cada producto no se proponen como otro listado
+    assert all(not s["container"].startswith(("h3", "span")) for s in structures)
+
+def test_structure_selectors_turn_a_structure_into_tags(soup):
+    structure = find_repeated_structures(collect_document_stats(soup))[0]
+    assert structure_selectors(structure) == {
+        "li": {"class": "", "id": "", "selector": "li.product"},
+        "h3": {"class": "", "id": "", "selector": "li.product h3.title"},
+        "span": {"class": "", "id": "", "selector": "li.product span.price"},
+        "a": {"class": "", "id": "", "selector": "li.product a"},
+    }
+
+def test_pages_without_repetition_have_no_structures():
+    soup = BeautifulSoup("<html><body><h1>Hola</h1><p>Un párrafo</p></body></html>", "lxml")
+    assert find_repeated_structures(collect_document_stats(soup)) == []
+
+def test_node_budget_and_deadline_truncate_the_traversal(soup):
+    stats = collect_document_stats(soup, max_nodes=10)
+    assert stats.truncated and stats.node_count == 10
+    # El reloj se consulta cada 1024 nodos
+    big = BeautifulSoup(listing(400), "lxml")
+    stats = collect_document_stats(big, deadline=perf_counter() - 1)
+    assert stats.truncated and stats.node_count == 1024
+
+def test_confidence_is_scaled_by_coverage(soup):
+    stats = collect_document_stats(soup)
+    assert 0 < detection_confidence(stats) <= 1
+    assert detection_confidence(stats, coverage=0.5) == pytest.approx(detection_confidence(stats) / 2, abs=0.01)
+
+def test_sample_document_keeps_head_middle_and_tail():
+    small = listing().encode("utf-8")
+    assert sample_document(small, len(small)) == (small, False)
+
+    big = listing(2000).encode("utf-8")
+    sample, sampled = sample_document(big, 30_000)
+    assert sampled and len(sample) <= 30_000 + 2
+    assert sample.startswith(b"<html><head><title>Tienda</title>")
+    assert sample.endswith(b"</html>")
+    # Los cortes caen en límites de etiqueta
+    head, middle, tail = sample.split(b"\n")
+    assert middle.startswith(b"<") and tail.startswith(b"<") and not head.endswith(b"<")
+    assert b"Producto 1000" in middle
+
+def test_validate_selectors_keeps_the_best_non_redundant_set():
+    soup = BeautifulSoup(listing(150).replace("<footer>", '<div class="spacer"></div>' * 3 + "<footer>"), "lxml")
+    suggested = {
+        "li": {"class": "", "id": "", "selector": "li.product, li"},
+        "span": {"class": "", "id": "", "selector": "span.price, span.no-existe"},
+        "div": {"class": "", "id": "", "selector": "div.spacer"},
+        "p": {"class": "", "id": "", "selector": "p:::no-valido"},
+        "todo": {"class": "", "id": "", "selector": "*"},
+        "h1": {"class": "", "id": "", "selector": ""},
+    }
+    validated, report = validate_selectors(soup, suggested, collect_document_stats(soup))
+    states = {row["selector"]: row["estado"] for row in report}
+    assert states == {
+        "li.product": "ok", "li": "redundante", "span.price": "ok", "span.no-existe": "vacío",
+        "div.spacer": "sin contenido", "p:::no-valido": "inválido", "*": "excesivo",
+    }
+    assert validated == {
+        "li": {"class": "", "id": "", "selector": "li.product"},
+        "span": {"class": "", "id": "", "selector": "span.price"},
+        # Las selecciones sin selector (por etiqueta) se conservan tal cual
+        "h1": {"class": "", "id": "", "selector": ""},
+    }
+    assert report[0]["puntuacion"] > 0 and report[-1]["puntuacion"] == 0
+    assert {row["coincidencias"] for row in report if row["estado"] == "ok"} == {150}
+
+def test_match_selectors_counts_each_node_once():
+    soup = BeautifulSoup('<p class="a b">uno</p><p class="b">dos</p>', "lxml")
+    matches, visited, truncated = match_selectors(soup, [".b", "p.a", ".b", "p:::x"])
+    assert [len(matches[".b"]), len(matches["p.a"])] == [2, 1]
+    assert matches["p:::x"] is None and not truncated and visited == 4
+
+TEMPLATES = {
+    "tienda": {"name": "Tienda", "tags": {"li": {"class": "product", "id": "", "selector": ""},
+                                          "span": {"class": "", "id": "", "selector": ".price, .precio"}}},
+    "generica": {"name": "Genérica", "tags": {"li": {"class": "", "id": "", "selector": ""},
+                                             "table": {"class": "", "id": "", "selector": "table"}}},
+    "vacia": {"tags": {}},
+}
+
+def test_rank_templates_prefers_specific_matching_selectors(soup):
+    ranking = rank_templates(soup, TEMPLATES)
+    assert [item["template_id"] for item in ranking] == ["tienda", "generica", "vacia"]
+    shop, generic, empty = ranking
+    assert (shop["score"], shop["matched"], shop["total"]) == (1.0, 2, 2)
+    assert shop["matches"] == {"li": 12, "span": 12}
+    # Una etiqueta sola pesa BARE_SELECTOR_WEIGHT y la tabla no aparece
+    assert generic["score"] == auto_detect.BARE_SELECTOR_WEIGHT / 2 and generic["matched"] == 1
+    assert (empty["name"], empty["score"]) == ("vacia", 0.0)
+
+def test_rank_templates_uses_all_templates_by_default(soup, monkeypatch):
+    monkeypatch.setattr(auto_detect, "get_all_templates", lambda: TEMPLATES)
+    assert rank_templates(soup)[0]["name"] == "Tienda"
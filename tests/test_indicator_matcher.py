@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from utils.auto_detect import IndicatorMatcher, PAGE_TYPE_INDICATORS, _page_type_matcher
+
+# Indicadores que se solapan entre sí y consigo mismos, los casos difíciles del recorrido único
+OVERLAPPING = ["ana", "banana", "nan", "a", "statistics", "stat", "tics", "ss", "sss", "abab", "bab"]
+
+def split_randomly(text, rng, max_size=7):
+    """Trocea el texto en fragmentos de tamaño aleatorio (incluidos fragmentos vacíos)"""
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(0, max_size)
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+def expected_counts(indicators, text):
+    return {ind: text.count(ind) for ind in indicators}
+
+def matcher_counts(matcher, chunks):
+    counts = matcher.count(chunks)
+    return {ind: counts[ind] for ind in matcher.indicators}
+
+@pytest.mark.parametrize("seed", range(20))
+def test_counts_match_str_count_on_random_text(seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice(["a", "b", "n", "s", "t", "i", "c", "banana", "statistics", " "])
+                   for _ in range(400))
+    matcher = IndicatorMatcher(OVERLAPPING)
+    assert matcher_counts(matcher, split_randomly(text, rng)) == expected_counts(OVERLAPPING, text)
+
+@pytest.mark.parametrize("text", ["", "banana", "bananana", "ssssss", "abababab", "statisticstatistics"])
+def test_counts_match_str_count_on_edge_cases(text):
+    matcher = IndicatorMatcher(OVERLAPPING)
+    assert matcher_counts(matcher, [text]) == expected_counts(OVERLAPPING, text)
+    # Un carácter por fragmento: todas las coincidencias cruzan el borde de un fragmento
+    assert matcher_counts(matcher, list(text)) == expected_counts(OVERLAPPING, text)
+
+def test_duplicate_indicators_are_counted_once():
+    matcher = IndicatorMatcher(["precio", "precio", "oferta"])
+    assert matcher.indicators == ["precio", "oferta"]
+    assert matcher.count(["precio oferta precio"])["precio"] == 2
+
+def test_scanner_feeds_incrementally():
+    matcher = IndicatorMatcher(["abc", "bc"])
+    scan = matcher.scanner()
+    for chunk in ["xa", "b", "cab", "c"]:
+        scan.feed(chunk)
+    assert scan.finish() == {"abc": 2, "bc": 2}
+
+def test_page_type_matcher_matches_str_count():
+    indicators = [ind for group in PAGE_TYPE_INDICATORS.values() for ind in group]
+    rng = random.Random(7)
+    text = " ".join(rng.choice(indicators) + rng.choice(["", "s", " ", "-"]) for _ in range(300)).lower()
+    counts = _page_type_matcher.count(split_randomly(text, rng, max_size=50))
+    assert {ind: counts[ind] for ind in set(indicators)} == expected_counts(set(indicators), text)
@@ -0,0 +1,66 @@
+from utils.layout_cache import DEFAULT_THRESHOLD, LayoutCache, hamming_distance, layout_fingerprint
+
+def listing(items, item_class="item", text="Producto"):
+    rows = "".join(f'<li class="{item_class} item-{i}"><a href="/p/{i}">{text} {i}</a>'
+                   f'<span class="price">{i}.99</span></li>' for i in range(items))
+    return f'<html><body><div class="header"><nav class="menu"></nav></div><ul class="results">{rows}</ul></body></html>'
+
+def article():
+    paragraphs = "".join(f"<p>Párrafo {i}</p>" for i in range(20))
+    return ('<html><body><header><h1 class="title">Nota</h1></header><article><section class="body">'
+            f'{paragraphs}</section><aside><form><input><button></button></form></aside></article>'
+            '<footer><table><tr><td></td></tr></table></footer></body></html>')
+
+def test_hamming_distance():
+    assert hamming_distance(0b1011, 0b1011) == 0
+    assert hamming_distance(0b1011, 0b0010) == 2
+
+def test_fingerprint_ignores_text_and_volatile_classes():
+    base = layout_fingerprint(listing(30))
+    # Mismo diseño con otro texto y otras clases numeradas (item-3, item-7...)
+    assert layout_fingerprint(listing(30, text="Otro")) == base
+    assert layout_fingerprint(listing(30).replace("item-", "item-1")) == base
+
+def test_fingerprint_accepts_text_and_bytes():
+    assert layout_fingerprint(listing(5)) == layout_fingerprint(listing(5).encode("utf-8"))
+
+def test_different_layouts_are_far_apart():
+    assert hamming_distance(layout_fingerprint(listing(30)), layout_fingerprint(article())) > DEFAULT_THRESHOLD
+
+def test_cache_returns_nearest_entry_of_the_same_domain():
+    cache = LayoutCache(threshold=2)
+    cache.put("a.test", 0b0000, {"selectores": ["li.item"]})
+    cache.put("a.test", 0b1111, {"selectores": ["article"]})
+    assert cache.get("a.test", 0b0001) == {"selectores": ["li.item"]}
+    assert cache.get("a.test", 0b0111) == {"selectores": ["article"]}
+    assert cache.get("a.test", 0b0111 << 8) is None
+    assert cache.get("b.test", 0b0000) is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+def test_cache_hands_out_copies():
+    cache = LayoutCache()
+    value = {"selectores": ["li.item"]}
+    cache.put("a.test", 1, value)
+    value["selectores"].append("modificado")
+    cache.get("a.test", 1)["selectores"].append("modificado")
+    assert cache.get("a.test", 1) == {"selectores": ["li.item"]}
+
+def test_cache_evicts_least_recently_used():
+    cache = LayoutCache(capacity=2, threshold=0)
+    cache.put("a.test", 1, "uno")
+    cache.put("a.test", 2, "dos")
+    cache.get("a.test", 1)
+    cache.put("a.test", 3, "tres")
+    assert len(cache) == 2
+    assert cache.get("a.test", 2) is None
+    assert cache.get("a.test", 1) == "uno"
+
+def test_clear_by_domain():
+    cache = LayoutCache()
+    cache.put("a.test", 1, "a")
+    cache.put("b.test", 1, "b")
+    cache.clear("a.test")
+    assert cache.get("a.test", 1) is None
+    assert cache.get("b.test", 1) == "b"
+    cache.clear()
+    assert len(cache) == 0
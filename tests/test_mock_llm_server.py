@@ -0,0 +1,65 @@
+import json
+
+import pytest
+import requests
+
+from utils.mock_llm_server import MockLLMServer, count_tokens, fake_answer
+
+AUTH = {"Authorization": "Bearer sk-prueba"}
+
+@pytest.fixture
+def server():
+    with MockLLMServer(port=0, latency=0, tokens_per_second=0, response_tokens=5) as mock:
+        yield mock
+
+def chat(server, prompt, **options):
+    return requests.post(f"{server.url}/chat/completions", headers=options.pop("headers", AUTH), timeout=5,
+                         json={"model": "mock-llm", "messages": [{"role": "user", "content": prompt}], **options})
+
+def test_unknown_options_are_rejected():
+    with pytest.raises(ValueError):
+        MockLLMServer(latencia=1)
+
+def test_models_and_chat_completion(server):
+    models = requests.get(f"{server.url}/models", timeout=5).json()
+    assert [model["id"] for model in models["data"]] == ["mock-llm"]
+    body = chat(server, "hola").json()
+    assert body["choices"][0]["message"]["content"] == fake_answer("hola", 5)
+    assert body["usage"] == {"prompt_tokens": count_tokens("hola"), "completion_tokens": 5,
+                             "total_tokens": count_tokens("hola") + 5}
+    # max_tokens acorta la respuesta
+    assert len(chat(server, "hola", max_tokens=2).json()["choices"][0]["message"]["content"].split()) == 2
+    assert server.stats["respuestas"] == 2
+
+def test_missing_key_and_unknown_routes(server):
+    assert chat(server, "hola", headers={}).status_code == 401
+    assert requests.get(f"{server.url}/otra", timeout=5).status_code == 404
+
+def test_rate_limit_answers_429_with_retry_after(server):
+    server.config["requests_per_minute"] = 1
+    assert chat(server, "uno").status_code == 200
+    response = chat(server, "dos")
+    assert response.status_code == 429
+    assert 0 < float(response.headers["Retry-After"]) <= 60
+    assert "try again in" in response.json()["error"]["message"]
+    # El límite es por API key
+    assert chat(server, "tres", headers={"Authorization": "Bearer otra"}).status_code == 200
+    assert server.stats["errores_429"] == 1
+
+def test_context_limit_answers_400(server):
+    server.config["context_limit"] = 10
+    response = chat(server, "palabra " * 20)
+    assert response.status_code == 400
+    assert response.json()["error"]["code"] == "context_length_exceeded"
+    assert server.stats["errores_400"] == 1
+
+def test_streaming_sends_chunks_and_usage(server):
+    response = chat(server, "hola", stream=True, stream_options={"include_usage": True})
+    # SSE siempre va en UTF-8
+    events = [line[len("data: "):] for line in response.content.decode("utf-8").splitlines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks if chunk["choices"])
+    assert text == fake_answer("hola", 5)
+    assert chunks[-1]["usage"]["completion_tokens"] == 5
+    assert requests.get(f"http://{server.host}:{server.port}/stats", timeout=5).json()["respuestas"] == 1
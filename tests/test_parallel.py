@@ -0,0 +1,98 @@
+import os
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+from utils import parallel
+from utils.parallel import arrow_ipc_to_rows, concat_tables, rows_to_arrow_ipc, rows_to_table
+from utils.scraper import expected_columns
+from utils.sinks import SINK_FORMATS, open_sink, stream_to_sink
+
+def test_round_trip_keeps_types_and_missing_values():
+    rows = [
+        {"Etiqueta": "td", "Contenido": "10", "columna_num": 1.5, "fila": 1},
+        {"Etiqueta": "td", "Contenido": "20", "columna_num": None, "fila": 2, "URL": "https://a.test"},
+    ]
+    assert arrow_ipc_to_rows(rows_to_arrow_ipc(rows)) == [
+        {"Etiqueta": "td", "Contenido": "10", "columna_num": 1.5, "fila": 1, "URL": None},
+        {"Etiqueta": "td", "Contenido": "20", "columna_num": None, "fila": 2, "URL": "https://a.test"},
+    ]
+
+def test_mixed_columns_fall_back_to_text():
+    rows = [{"valor": 1}, {"valor": "uno"}, {"valor": None}]
+    assert arrow_ipc_to_rows(rows_to_arrow_ipc(rows)) == [{"valor": "1"}, {"valor": "uno"}, {"valor": None}]
+
+def test_concat_tables_aligns_columns_and_types():
+    tables = [rows_to_table([{"a": 1, "b": "x"}]), rows_to_table([{"a": "uno", "c": 2.5}]), rows_to_table([{"a": None}])]
+    assert concat_tables(tables).to_pylist() == [
+        {"a": "1", "b": "x", "c": None},
+        {"a": "uno", "b": None, "c": 2.5},
+        {"a": None, "b": None, "c": None},
+    ]
+
+PAGES = {f"/p{i}": f"<h2>Página {i}</h2><p>uno</p><p>dos</p>".encode("utf-8") for i in range(4)}
+TAGS = {"h2": {"class": "", "id": "", "selector": ""}, "p": {"class": "", "id": "", "selector": ""}}
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in PAGES:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.end_headers()
+        self.wfile.write(PAGES[self.path])
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    parallel.shutdown_process_pool()
+
+def test_iter_scrape_parallel_yields_arrow_batches(site):
+    urls = [site + path for path in PAGES] + [site + "/no-existe"]
+    errors = []
+    batches = list(parallel.iter_scrape_parallel(urls, TAGS, workers=2, batch_size=5, errors=errors))
+    assert all(isinstance(batch, pa.Table) for batch in batches)
+    assert [batch.num_rows for batch in batches] == [5, 5, 2]
+    rows = [row for batch in batches for row in batch.to_pylist()]
+    assert sorted(row["Contenido"] for row in rows if row["Etiqueta"] == "h2") == [f"Página {i}" for i in range(4)]
+    assert {row["URL"] for row in rows} == {site + path for path in PAGES}
+    assert [url for url, _ in errors] == [site + "/no-existe"]
+
+def crash_once(marker, url, content, encoding, tags_info):
+    """Tarea que mata a su worker la primera vez, para romper el pool"""
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    return parallel.parse_and_extract(url, content, encoding, tags_info)
+
+def test_broken_pool_is_replaced_and_pages_are_retried(site, tmp_path, monkeypatch):
+    broken = parallel.get_process_pool(1)
+    marker = tmp_path / "caido"
+    monkeypatch.setattr(parallel, "parse_and_extract", partial(crash_once, str(marker)))
+    errors = []
+    batches = list(parallel.iter_scrape_parallel([site + path for path in PAGES], TAGS, workers=1, errors=errors))
+    assert marker.exists() and errors == []
+    assert sum(batch.num_rows for batch in batches) == 3 * len(PAGES)
+    assert parallel.get_process_pool(1) is not broken
+
+def test_arrow_batches_stream_to_every_sink(site, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    urls = [site + path for path in PAGES]
+    for fmt in SINK_FORMATS:
+        path = tmp_path / f"lote{SINK_FORMATS[fmt]}"
+        sink = open_sink(path, fmt, columns=expected_columns(TAGS, include_url=True), buffer_size=4)
+        assert stream_to_sink(parallel.iter_scrape_parallel(urls, TAGS, workers=2, batch_size=5), sink) == 12
+    assert pq.read_table(str(tmp_path / "lote.parquet")).column_names == expected_columns(TAGS, include_url=True)
+    assert len((tmp_path / "lote.jsonl").read_text(encoding="utf-8").splitlines()) == 12
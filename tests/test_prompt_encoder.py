@@ -0,0 +1,47 @@
+import pandas as pd
+
+from utils.prompt_encoder import ALIAS_MIN_LENGTH, clean_cell, encode_dataframe, encode_rows, iter_clean_rows, prompt_columns
+
+def test_clean_cell():
+    assert clean_cell("  varias\n\tlíneas   aquí ") == "varias líneas aquí"
+    assert clean_cell(None) == ""
+    assert clean_cell(float("nan")) == ""
+    assert clean_cell(3) == "3"
+    assert clean_cell("x" * 20, max_chars=10) == "x" * 9 + "…"
+
+def test_constant_and_empty_columns():
+    columns = ["Etiqueta", "Contenido", "Vacía"]
+    rows = [["p", "uno", ""], ["p", "dos", ""]]
+    assert encode_rows(columns, rows) == "Etiqueta: p\nContenido\nuno\ndos"
+
+def test_repeated_rows_are_grouped():
+    columns = ["Etiqueta", "Contenido"]
+    rows = [["p", "a"], ["h2", "b"], ["p", "a"], ["p", "a"]]
+    assert encode_rows(columns, rows) == "Etiqueta\tContenido\tveces\np\ta\t3\nh2\tb\t1"
+
+def test_long_repeated_values_get_aliases():
+    url = "https://tienda.test/categoria/zapatillas"
+    assert len(url) >= ALIAS_MIN_LENGTH
+    rows = [[f"producto {i}", url] for i in range(3)] + [["otro", "https://tienda.test/x"]]
+    lines = encode_rows(["Contenido", "URL"], rows).splitlines()
+    assert lines[0] == f"@1 = {url}"
+    assert lines[2] == "producto 0\t@1"
+    assert lines[-1] == "otro\thttps://tienda.test/x"
+
+def test_key_value_format_skips_empty_cells():
+    rows = [["p", "uno"], ["h2", ""]]
+    assert encode_rows(["Etiqueta", "Contenido"], rows, "kv") == "Etiqueta=p | Contenido=uno\nEtiqueta=h2"
+
+def test_empty_rows():
+    assert encode_rows(["Contenido"], []) == ""
+
+def test_html_is_dropped_and_summarizes_rows_without_text():
+    data = pd.DataFrame({
+        "Etiqueta": ["div", "p"],
+        "Contenido": ["", "texto"],
+        "HTML": ["<div><b>Resumen</b> del <i>bloque</i></div>", "<p>texto</p>"],
+    })
+    columns = prompt_columns(data)
+    assert columns == ["Etiqueta", "Contenido"]
+    assert list(iter_clean_rows(data, columns)) == [["div", "Resumen del bloque"], ["p", "texto"]]
+    assert encode_dataframe(data) == "Etiqueta\tContenido\ndiv\tResumen del bloque\np\ttexto"
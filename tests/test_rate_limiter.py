@@ -0,0 +1,148 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from utils.rate_limiter import (RateLimiter, TokenBucket, backoff_delay, call_with_rate_limit,
+                                call_with_rate_limit_async, is_rate_limit_error, is_retryable_error,
+                                retry_after_seconds)
+
+class APIError(Exception):
+    def __init__(self, message, status_code=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+LIMITS = {"test": {"key": {"requests_per_minute": 600, "tokens_per_minute": 6000}}}
+
+def tokens_available(limiter, tokens=6000):
+    """Reserva y devuelve `tokens` de la key: True si estaban disponibles sin esperar"""
+    wait = limiter.reserve("test", "k", "m", tokens)
+    limiter.settle("test", "k", "m", tokens, 0)
+    return wait == 0
+
+def test_token_bucket_waits_for_missing_tokens():
+    bucket = TokenBucket(capacity=60, rate=1.0)
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(30) == pytest.approx(30, abs=0.1)
+
+def test_token_bucket_admits_oversized_requests_when_full():
+    bucket = TokenBucket(capacity=10, rate=1.0)
+    assert bucket.reserve(100) == 0
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.1)
+
+def test_token_bucket_release_and_drain():
+    bucket = TokenBucket(capacity=60, rate=1.0)
+    bucket.reserve(60)
+    bucket.release(60)
+    assert bucket.reserve(60) == 0
+    bucket.release(60)
+    bucket.drain()
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.1)
+
+def test_rejected_reservations_are_refunded():
+    limiter = RateLimiter(LIMITS)
+    assert limiter.reserve("test", "k", "m", 6000) == 0
+    first = limiter.reserve("test", "k", "m", 3000, max_wait=1)
+    # Las reservas rechazadas no se acumulan: la espera no crece
+    for _ in range(5):
+        assert limiter.reserve("test", "k", "m", 3000, max_wait=1) == pytest.approx(first, abs=0.1)
+
+def test_settle_returns_unused_tokens():
+    limiter = RateLimiter(LIMITS)
+    limiter.reserve("test", "k", "m", 6000)
+    limiter.settle("test", "k", "m", 6000, 0)
+    assert tokens_available(limiter)
+
+def test_block_applies_to_the_whole_key():
+    limiter = RateLimiter(LIMITS)
+    limiter.block("test", "k", "m", 5)
+    assert limiter.reserve("test", "k", "m", 1) == pytest.approx(5, abs=0.1)
+    assert limiter.reserve("test", "otra", "m", 1) == 0
+
+def test_backoff_delay():
+    for attempt in range(6):
+        assert 0 <= backoff_delay(attempt, base=1.0, cap=8.0) <= min(8.0, 2 ** attempt)
+    assert 3.0 <= backoff_delay(0, retry_after=3.0, base=1.0) <= 3.5
+    assert backoff_delay(0, retry_after=500, cap=60) <= 60.5
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(APIError("x", 429, {"retry-after": "2"})) == 2.0
+    assert retry_after_seconds(APIError("x", 429, {"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(APIError("Please try again in 1.5s")) == 1.5
+    assert retry_after_seconds(APIError("retry_delay { seconds: 12 }")) == 12.0
+    assert retry_after_seconds(APIError("sin indicación")) is None
+
+def test_error_classification():
+    assert is_rate_limit_error(APIError("x", 429))
+    assert is_rate_limit_error(APIError("Resource exhausted"))
+    assert not is_rate_limit_error(APIError("x", 400))
+    assert is_retryable_error(APIError("x", 503))
+    assert not is_retryable_error(APIError("x", 401))
+
+def test_call_retries_transient_errors_and_settles_usage():
+    limiter = RateLimiter(LIMITS)
+    responses = iter([APIError("Rate limit reached, try again in 0.01s", 429), APIError("x", 503), "respuesta"])
+
+    def request():
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    answer = call_with_rate_limit("test", "k", "m", 6000, request, usage_tokens=lambda response: 0,
+                                  limiter=limiter)
+    assert answer == "respuesta"
+    assert limiter.retries == 2
+    assert tokens_available(limiter)
+
+def test_call_raises_non_retryable_errors_and_refunds_tokens():
+    limiter = RateLimiter(LIMITS)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise APIError("clave inválida", 401)
+
+    with pytest.raises(APIError):
+        call_with_rate_limit("test", "k", "m", 6000, request, limiter=limiter)
+    assert len(calls) == 1
+    assert tokens_available(limiter)
+
+def test_call_gives_up_when_the_wait_is_too_long():
+    limiter = RateLimiter(LIMITS)
+    limiter.block("test", "k", "m", 30)
+    with pytest.raises(TimeoutError):
+        call_with_rate_limit("test", "k", "m", 10, lambda: "respuesta", max_wait=1, limiter=limiter)
+
+def test_async_call_retries_and_returns():
+    limiter = RateLimiter(LIMITS)
+    responses = iter([APIError("x", 502), "respuesta"])
+
+    async def request():
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr("utils.rate_limiter.backoff_delay", lambda attempt, retry_after=None: 0.01)
+        answer = asyncio.run(call_with_rate_limit_async("test", "k", "m", 100, request, limiter=limiter))
+    assert answer == "respuesta"
+    assert limiter.retries == 1
+
+def test_async_call_refunds_tokens_when_cancelled():
+    limiter = RateLimiter(LIMITS)
+
+    async def request():
+        await asyncio.sleep(10)
+
+    async def cancel_after_start():
+        task = asyncio.create_task(call_with_rate_limit_async("test", "k", "m", 6000, request, limiter=limiter))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_after_start())
+    assert tokens_available(limiter)
@@ -0,0 +1,44 @@
+import pandas as pd
+
+from utils.relevance import BM25Index, get_index, rank_rows, tokenize
+
+def test_tokenize_normalizes_terms():
+    assert tokenize("¿Cuáles son las Zapatillas más baratas?") == ["zapatilla", "barata"]
+    assert tokenize(None) == []
+    assert tokenize(42) == ["42"]
+
+def test_bm25_ranks_matching_documents_first():
+    index = BM25Index([
+        "Envío gratis en pedidos grandes",
+        "Zapatilla de running roja",
+        "Zapatillas zapatillas y más zapatillas en oferta",
+        "Camiseta de algodón",
+    ])
+    assert index.rank("zapatillas") == [2, 1, 0, 3]
+
+def test_rare_terms_weigh_more():
+    index = BM25Index(["precio oferta", "precio", "precio", "oferta especial"])
+    scores = index.scores("precio especial")
+    assert scores[3] > scores[1]
+
+def test_unmatched_rows_keep_their_order():
+    index = BM25Index(["uno", "dos", "tres"])
+    assert index.rank("nada") == [0, 1, 2]
+    assert BM25Index([]).rank("algo") == []
+
+def test_rank_rows_without_query_keeps_order():
+    data = pd.DataFrame({"Contenido": ["a", "b", "c"]})
+    assert rank_rows(data, "  ") == [0, 1, 2]
+    assert rank_rows(data.iloc[0:0], "a") == []
+
+def test_rank_rows_uses_all_columns_without_text_column():
+    data = pd.DataFrame({"Etiqueta": ["p", "h2"], "Clase": ["intro", "titular"]})
+    assert rank_rows(data, "titular", column="Contenido") == [1, 0]
+
+def test_index_is_reused_until_the_data_changes():
+    data = pd.DataFrame({"Contenido": ["precio bajo", "precio alto"]})
+    index = get_index(data)
+    assert get_index(data.copy()) is index
+    changed = data.copy()
+    changed.loc[1, "Contenido"] = "otro texto"
+    assert get_index(changed) is not index
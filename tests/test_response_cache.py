@@ -0,0 +1,57 @@
+import pytest
+
+from utils import response_cache as cache_module
+from utils.response_cache import ResponseCache, normalize_prompt, response_cache_key
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj controlado por el test para la caducidad y el orden de uso"""
+    now = [1_000_000.0]
+
+    def advance(seconds=1.0):
+        now[0] += seconds
+
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    return advance
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return ResponseCache(tmp_path / "respuestas.sqlite3", ttl=60, max_entries=3)
+
+def test_equivalent_prompts_share_a_key():
+    assert normalize_prompt("  Resume\r\nesto   por\t favor \n") == "Resume\nesto por favor"
+    key = response_cache_key("openai", "gpt-4o", "Resume  esto\r\n")
+    assert key == response_cache_key("openai", "gpt-4o", "Resume esto")
+    assert key != response_cache_key("groq", "gpt-4o", "Resume esto")
+    assert key != response_cache_key("openai", "gpt-4o", "Resume esto", {"system": "otro"})
+
+def test_get_and_put_persist_between_instances(cache, tmp_path):
+    assert cache.get("k") is None
+    cache.put("k", "openai", "gpt-4o", "respuesta")
+    assert cache.get("k") == "respuesta"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert ResponseCache(tmp_path / "respuestas.sqlite3").get("k") == "respuesta"
+
+def test_entries_expire_after_the_ttl(cache, clock):
+    cache.put("k", "openai", "gpt-4o", "respuesta")
+    clock(59)
+    assert cache.get("k") == "respuesta"
+    clock(2)
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+def test_least_recently_used_entries_are_evicted(cache, clock):
+    for key in ("a", "b", "c"):
+        cache.put(key, "groq", "m", key.upper())
+        clock()
+    # Usar "a" la convierte en la más reciente: al añadir "d" se descarta "b"
+    cache.get("a")
+    clock()
+    cache.put("d", "groq", "m", "D")
+    assert len(cache) == 3
+    assert [cache.get(key) for key in ("a", "b", "c", "d")] == ["A", None, "C", "D"]
+
+def test_clear(cache):
+    cache.put("k", "openai", "gpt-4o", "respuesta")
+    assert cache.clear()[0]
+    assert len(cache) == 0
@@ -0,0 +1,84 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from utils import scraper
+from utils.scraper import compile_field_extractor, expected_columns, parse_attribute_list, resolve_field_spec
+
+HTML = """
+<table><tr><th>Producto</th><td class="precio" data-price="9.99"> 9,99 € </td></tr></table>
+<a href="/oferta" class="destacado activo" title="Ver">  Oferta <b>hoy</b> </a>
+<p>Uno <span>dos</span></p>
+"""
+
+@pytest.fixture
+def soup():
+    return BeautifulSoup(HTML, "lxml")
+
+def test_parse_attribute_list():
+    assert parse_attribute_list(" data-price, title ,,") == ["data-price", "title"]
+    assert parse_attribute_list("") == []
+
+def test_resolve_field_spec_merges_defaults_and_user_fields():
+    spec = resolve_field_spec("a", {"attrs": "title, class", "html": False})
+    assert spec["attrs"] == {"href": "href", "title": "title", "class": "class"}
+    assert spec["text_columns"] == ["texto_enlace"]
+    assert spec["html"] is False
+    assert resolve_field_spec("td")["position"] == "column"
+    assert resolve_field_spec("p", {"attrs": {"precio": "data-price"}})["attrs"] == {"precio": "data-price"}
+
+def test_resolve_field_spec_rejects_unknown_text_mode():
+    with pytest.raises(ValueError):
+        resolve_field_spec("p", {"text": "mayúsculas"})
+
+def test_extractor_output(soup):
+    link = compile_field_extractor("a", {"attrs": ["title", "class"]})(soup.a)
+    assert link["Contenido"] == "Ofertahoy"
+    assert link["texto_enlace"] == link["Contenido"]
+    assert (link["href"], link["title"], link["class"]) == ("/oferta", "Ver", "destacado activo")
+    assert link["HTML"].startswith("<a ")
+
+    cell = compile_field_extractor("td", {"attrs": {"precio": "data-price"}, "text": "spaced"})(soup.td)
+    assert (cell["Contenido"], cell["precio"], cell["columna_num"]) == ("9,99 €", "9.99", 2)
+
+    paragraph = compile_field_extractor("p", {"html": False, "text": "none"})(soup.p)
+    assert paragraph == {"Contenido": ""}
+
+def test_extractors_are_shared_and_the_cache_is_bounded():
+    scraper._compile_extractor.cache_clear()
+    assert compile_field_extractor("a", {"attrs": ["title"]}) is compile_field_extractor("a", {"attrs": "title"})
+    for i in range(scraper.COMPILED_EXTRACTORS_CACHE_SIZE + 10):
+        compile_field_extractor("div", {"attrs": [f"data-campo-{i}"]})
+    assert scraper._compile_extractor.cache_info().currsize == scraper.COMPILED_EXTRACTORS_CACHE_SIZE
+
+def test_expected_columns():
+    tags_info = {"a": {"fields": {"attrs": ["title"]}}, "td": {}}
+    assert expected_columns(tags_info, include_url=True) == \
+        ["Etiqueta", "Contenido", "URL", "HTML", "href", "title", "texto_enlace", "columna_num"]
+
+TAGS = {
+    "td": {"class": "precio", "id": "", "selector": ""},
+    "enlaces": {"class": "", "id": "", "selector": "a.destacado"},
+    "roto": {"class": "", "id": "", "selector": "p:::no-valido"},
+}
+
+def test_profile_records_each_selector_without_changing_rows(soup):
+    profile = {}
+    profiled = list(scraper.iter_element_rows(soup, TAGS, profile))
+    assert profiled == list(scraper.iter_element_rows(soup, TAGS))
+    stats = {entry["etiqueta"]: entry for entry in profile["selectors"]}
+    assert stats["td"]["selector"] == "td.precio"
+    assert stats["td"]["coincidencias"] == 1
+    assert stats["enlaces"]["selector"] == "a.destacado"
+    assert stats["enlaces"]["bytes"] > 0
+    assert stats["td"]["seleccion_s"] >= 0 and stats["td"]["extraccion_s"] >= 0
+    # El error de un selector se registra y no detiene el resto
+    assert "error" in stats["roto"]
+
+def test_static_scrape_attaches_profile(monkeypatch):
+    monkeypatch.setattr(scraper, "fetch_static_html", lambda url: HTML)
+    df = scraper.scrape_website_static("https://tienda.test", TAGS, profile=True)
+    assert len(df) == 2
+    profile = df.attrs["profile"]
+    assert {"fetch_s", "parse_s", "extract_s", "dataframe_s", "html_bytes", "selectors"} <= set(profile)
+    assert profile["html_bytes"] == len(HTML.encode("utf-8"))
+    assert "profile" not in scraper.scrape_website_static("https://tienda.test", TAGS).attrs
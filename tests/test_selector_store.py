@@ -0,0 +1,38 @@
+import pytest
+
+from utils import selector_store
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(selector_store, "SELECTORS_DIR", tmp_path)
+    monkeypatch.setattr(selector_store, "_specs_cache", {})
+    return selector_store
+
+SPEC = {"page_type": "ecommerce", "suggested_selectors": {"price": [".price"]}, "pages": ["https://a.test/1"],
+        "stability": {".price": 1.0}}
+
+def test_domain_key():
+    assert selector_store.domain_key("https://WWW.Tienda.test/p?id=1") == "tienda.test"
+
+def test_save_and_load(store):
+    ok, _ = store.save_domain_spec("tienda.test", SPEC)
+    assert ok
+    spec = store.load_domain_spec("tienda.test")
+    assert spec["suggested_selectors"] == {"price": [".price"]}
+    assert [s["domain"] for s in store.list_domain_specs()] == ["tienda.test"]
+    # Sin la caché en memoria se lee del archivo
+    store._specs_cache.clear()
+    assert store.load_domain_spec("tienda.test")["pages"] == ["https://a.test/1"]
+
+def test_loaded_specs_are_copies(store):
+    spec = {**SPEC, "suggested_selectors": {"price": [".price"]}}
+    store.save_domain_spec("tienda.test", spec)
+    spec["suggested_selectors"]["price"].append(".cambiado")
+    store.load_domain_spec("tienda.test")["suggested_selectors"]["price"].append(".cambiado")
+    assert store.load_domain_spec("tienda.test")["suggested_selectors"] == {"price": [".price"]}
+
+def test_delete(store):
+    store.save_domain_spec("tienda.test", SPEC)
+    assert store.delete_domain_spec("tienda.test")[0]
+    assert store.load_domain_spec("tienda.test") is None
+    assert not store.delete_domain_spec("tienda.test")[0]
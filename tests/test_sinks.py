@@ -0,0 +1,85 @@
+import csv
+import json
+
+import pytest
+
+from utils.sinks import BaseSink, CSVSink, JSONLSink, ParquetSink, open_sink, stream_to_sink
+
+ROWS = [
+    {"Etiqueta": "h2", "Contenido": "Título", "URL": "https://a.test"},
+    {"Etiqueta": "p", "Contenido": "Texto, con coma", "URL": "https://a.test", "Clase": "intro"},
+    {"Contenido": "Sin etiqueta", "Etiqueta": "span", "URL": "https://b.test"},
+]
+
+def test_base_sink_is_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        BaseSink(tmp_path / "x")
+
+def test_buffer_is_flushed_when_full(tmp_path):
+    sink = CSVSink(tmp_path / "out.csv", buffer_size=2)
+    sink.write_rows(ROWS[:1])
+    assert (sink.rows_written, sink.pending_rows) == (0, 1)
+    sink.write_rows(ROWS[1:])
+    assert (sink.rows_written, sink.pending_rows) == (2, 1)
+    sink.close()
+    assert (sink.rows_written, sink.pending_rows) == (3, 0)
+    # Cerrar dos veces no falla
+    sink.close()
+
+def test_csv_infers_columns_from_first_batch_and_ignores_later_ones(tmp_path):
+    path = tmp_path / "out.csv"
+    with CSVSink(path, buffer_size=2) as sink:
+        sink.write_rows(ROWS[:1] + [ROWS[2]])
+        sink.write_rows([{**ROWS[0], "Nueva": "x"}])
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == ["Etiqueta", "Contenido", "URL"]
+    assert [row["Contenido"] for row in rows] == ["Título", "Sin etiqueta", "Título"]
+
+def test_jsonl_keeps_every_column(tmp_path):
+    path = tmp_path / "out.jsonl"
+    with JSONLSink(path, buffer_size=2) as sink:
+        sink.write_rows(ROWS)
+    assert [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()] == ROWS
+
+def test_parquet_writes_one_row_group_per_batch(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "out.parquet"
+    with ParquetSink(path, columns=["Etiqueta", "Contenido", "Clase"], buffer_size=2) as sink:
+        sink.write_rows(ROWS)
+    parquet = pq.ParquetFile(str(path))
+    assert parquet.metadata.num_row_groups == 2
+    table = parquet.read()
+    assert table.column_names == ["Etiqueta", "Contenido", "Clase"]
+    assert table.column("Clase").to_pylist() == [None, "intro", None]
+
+def test_open_sink_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        open_sink(tmp_path / "out.xml", fmt="xml")
+
+def test_stream_to_sink_reports_progress_and_closes(tmp_path):
+    progress = []
+    sink = open_sink(tmp_path / "out.jsonl", fmt="jsonl", buffer_size=10)
+    total = stream_to_sink(iter([ROWS[:2], ROWS[2:]]), sink, progress.append)
+    assert total == 3
+    # El progreso cuenta también las filas que siguen en el búfer
+    assert progress == [2, 3]
+    assert sink.pending_rows == 0
+    assert len((tmp_path / "out.jsonl").read_text(encoding="utf-8").splitlines()) == 3
+
+def test_arrow_tables_keep_the_text_of_the_row_path(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pa.table({"Etiqueta": ["td", "td"], "columna_num": [1, None], "precio": [9.0, 9.5], "Extra": ["x", "y"]})
+    columns = ["Etiqueta", "Contenido", "columna_num", "precio"]
+    for sink_class, name in ((ParquetSink, "out.parquet"), (JSONLSink, "out.jsonl")):
+        with sink_class(tmp_path / name, columns=columns, buffer_size=1) as sink:
+            sink.write_rows([{"Etiqueta": "h1", "Contenido": "Antes"}])
+            sink.write_table(table)
+        assert sink.rows_written == 3
+    written = pq.read_table(str(tmp_path / "out.parquet")).to_pylist()
+    assert written[0]["Contenido"] == "Antes"
+    assert [(row["columna_num"], row["precio"], row["Contenido"]) for row in written[1:]] == \
+        [("1", "9.0", None), (None, "9.5", None)]
+    lines = (tmp_path / "out.jsonl").read_text(encoding="utf-8").splitlines()
+    assert json.loads(lines[-1]) == {"Etiqueta": "td", "columna_num": None, "precio": 9.5, "Extra": "y"}
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from utils.structured_data import (_number, extract_json_ld, extract_meta_properties, extract_microdata,
+                                   extract_structured_records, records_cover_fields)
+
+def page(head="", body=""):
+    return f"<html><head>{head}</head><body>{body}</body></html>"
+
+def json_ld(data):
+    return f'<script type="application/ld+json">{json.dumps(data)}</script>'
+
+PRODUCT = {
+    "@context": "https://schema.org", "@type": "Product", "name": "Zapatilla", "sku": "Z-1",
+    "brand": {"@type": "Brand", "name": "Marca"}, "image": ["https://tienda.test/z.jpg"],
+    "offers": {"@type": "Offer", "price": "1,299", "priceCurrency": "MXN",
+               "availability": "https://schema.org/InStock", "url": "https://tienda.test/z"},
+    "aggregateRating": {"@type": "AggregateRating", "ratingValue": "4,5"}
+}
+
+@pytest.mark.parametrize("value, expected", [
+    ("1,299", 1299.0),
+    ("1,299,000", 1299000.0),
+    ("12,5", 12.5),
+    ("9,99", 9.99),
+    ("-3,5", -3.5),
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("$ 19.99", 19.99),
+    ("€ 1.299,00", 1299.0),
+    ("1.299", 1299.0),
+    ("1.234.567", 1234567.0),
+    ("0.299", 0.299),
+    (42, 42.0),
+    (["3"], 3.0),
+    (None, None),
+    ("1,2,3", None),
+    ("1,23.4", None),
+    ("gratis", None),
+])
+def test_number(value, expected):
+    assert _number(value) == expected
+
+def test_json_ld_product_record():
+    records = extract_structured_records(page(json_ld(PRODUCT)))
+    assert records == [{
+        "tipo": "Product", "fuente": "json-ld", "name": "Zapatilla", "price": 1299.0, "currency": "MXN",
+        "availability": "https://schema.org/InStock", "image": "https://tienda.test/z.jpg",
+        "url": "https://tienda.test/z", "description": None, "sku": "Z-1", "brand": "Marca", "rating": 4.5
+    }]
+
+def test_json_ld_graph_and_invalid_blocks():
+    html = page('<script type="application/ld+json">{no es json</script>' +
+                json_ld({"@graph": [{"@type": "WebSite", "name": "Sitio"},
+                                    {"@type": "https://schema.org/NewsArticle", "headline": "Titular",
+                                     "author": {"@type": "Person", "name": "Ana"}}]}))
+    assert [item["@type"] for item in extract_json_ld(html)] == ["WebSite", "https://schema.org/NewsArticle"]
+    records = extract_structured_records(html)
+    assert len(records) == 1
+    assert records[0]["tipo"] == "Article"
+    assert records[0]["headline"] == "Titular"
+    assert records[0]["author"] == "Ana"
+
+def test_microdata_product():
+    html = page(body="""
+        <div itemscope itemtype="https://schema.org/Product">
+          <span itemprop="name">Mochila</span>
+          <div itemprop="offers" itemscope itemtype="https://schema.org/Offer">
+            <meta itemprop="price" content="49.90"><meta itemprop="priceCurrency" content="EUR">
+          </div>
+        </div>""")
+    assert len(extract_microdata(html)) == 1
+    record, = extract_structured_records(html)
+    assert (record["fuente"], record["name"], record["price"], record["currency"]) == \
+        ("microdata", "Mochila", 49.9, "EUR")
+
+def test_microdata_is_skipped_without_itemscope():
+    assert extract_microdata(page(body="<p>sin datos</p>")) == []
+
+def test_opengraph_is_only_a_fallback():
+    og = ('<meta property="og:type" content="product"><meta property="og:title" content="Gorra">'
+          '<meta property="product:price:amount" content="15,5"><meta property="og:url" content="https://t.test/g">')
+    record, = extract_structured_records(page(og))
+    assert (record["fuente"], record["name"], record["price"]) == ("opengraph", "Gorra", 15.5)
+    # Con un producto en JSON-LD, OpenGraph no añade otro registro del mismo tipo
+    records = extract_structured_records(page(og + json_ld(PRODUCT)))
+    assert [r["fuente"] for r in records] == ["json-ld"]
+
+def test_meta_properties_keep_first_value_and_unescape():
+    html = page('<meta property="og:title" content="A &amp; B"><meta property="og:title" content="otro">')
+    assert extract_meta_properties(html) == {"og:title": "A & B"}
+
+def test_record_types_filter_and_deduplication():
+    html = page(json_ld(PRODUCT) + json_ld(PRODUCT) + json_ld({"@type": "Article", "headline": "Nota"}))
+    assert [r["tipo"] for r in extract_structured_records(html)] == ["Product", "Article"]
+    assert [r["tipo"] for r in extract_structured_records(html, record_types={"Article"})] == ["Article"]
+
+def test_records_cover_fields():
+    records = [{"name": "A", "price": None}, {"name": "B", "price": 3.0}]
+    assert records_cover_fields(records, ["name", "price"])
+    assert not records_cover_fields(records[:1], ["name", "price"])
+    assert not records_cover_fields([], ["name"])
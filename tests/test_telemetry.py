@@ -0,0 +1,84 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.telemetry import annotate, bind_current_call, instrumented, metrics_registry
+
+def is_error(answer):
+    return answer.startswith("Error")
+
+@instrumented("consulta", "local", is_error)
+def ask(prompt, model_name="m", tokens=10, retries=0):
+    if prompt == "largo" and retries > 0:
+        return ask("corto", model_name, tokens, retries - 1)
+    annotate(tokens_prompt=1, tokens_respuesta=tokens)
+    return "Error: falló" if prompt == "fallo" else "respuesta"
+
+@instrumented("streaming", "local", is_error)
+def stream(prompt, model_name="m"):
+    yield "uno"
+    yield "dos"
+
+@instrumented("análisis")
+def analyze(prompts, model="chatgpt", model_name="m"):
+    with ThreadPoolExecutor(2) as pool:
+        return list(pool.map(bind_current_call(ask), prompts))
+
+@instrumented("consulta", "local", is_error)
+async def ask_async(prompt, model_name="m"):
+    await asyncio.sleep(prompt)
+    annotate(tokens_respuesta=5)
+    return "respuesta"
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    metrics_registry.clear()
+    yield
+    metrics_registry.clear()
+
+def test_records_calls_errors_and_retries():
+    ask("hola")
+    ask("fallo")
+    ask("largo", retries=1)
+    records = metrics_registry.records()
+    assert [r["estado"] for r in records] == ["ok", "error", "ok"]
+    assert records[2]["reintentos"] == 1 and records[2]["truncado"]
+    # Sin streaming no hay tiempo hasta el primer byte
+    assert all(r["ttfb_s"] is None for r in records)
+
+def test_generators_record_time_to_first_chunk_and_interruptions():
+    assert list(stream("hola")) == ["uno", "dos"]
+    next(stream("hola"))
+    complete, interrupted = metrics_registry.records()
+    assert complete["estado"] == "ok" and complete["ttfb_s"] is not None
+    assert interrupted["estado"] == "interrumpido"
+
+def test_calls_in_worker_threads_add_to_the_caller():
+    assert analyze(["a", "b", "c"]) == ["respuesta"] * 3
+    analysis = metrics_registry.records()[-1]
+    assert (analysis["operacion"], analysis["proveedor"]) == ("análisis", "openai")
+    assert (analysis["tokens_prompt"], analysis["tokens_respuesta"]) == (3, 30)
+
+def test_cancelled_coroutines_are_recorded_as_cancelled():
+    async def race():
+        fast = asyncio.create_task(ask_async(0.01))
+        slow = asyncio.create_task(ask_async(5))
+        await fast
+        slow.cancel()
+        await asyncio.gather(slow, return_exceptions=True)
+
+    asyncio.run(race())
+    states = sorted((r["estado"], r["tokens_respuesta"]) for r in metrics_registry.records())
+    assert states == [("cancelado", None), ("ok", 5)]
+
+def test_summary():
+    ask("hola", tokens=10)
+    ask("fallo")
+    list(stream("hola"))
+    summary = metrics_registry.summary().set_index("operacion")
+    assert summary.loc["consulta", "llamadas"] == 2
+    assert summary.loc["consulta", "errores"] == 1
+    assert summary.loc["consulta", "tokens_respuesta"] == 20
+    assert summary.loc["consulta", "tokens_por_s"] > 0
+    assert summary.loc["streaming", "ttfb_medio_s"] >= 0
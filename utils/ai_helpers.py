@@ -1,11 +1,26 @@
+import asyncio
+import json
 import logging
+import os
+import re
 import pandas as pd
 import openai
+import groq
 from groq import Groq
 import google.generativeai as genai
-import re
 import time
-from functools import lru_cache
+import hashlib
+import threading
+import httpx
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+from utils.response_cache import response_cache, response_cache_key
+from utils.rate_limiter import call_with_rate_limit, call_with_rate_limit_async, error_status, is_rate_limit_error
+from utils.prompt_encoder import DEFAULT_FORMAT, prompt_columns, iter_clean_rows, encode_rows
+from utils.relevance import rank_rows
+from utils.telemetry import instrumented, annotate, bind_current_call
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -40,98 +55,421 @@ GEMINI_MODELS = {
     "gemini-pro-vision": "Gemini Pro Vision"
 }
 
-# Diccionario con límites de tokens aproximados por modelo
+# Servidor local compatible con la API de chat de OpenAI: utils/mock_llm_server.py para pruebas
+# sin conexión, o un servidor propio (Ollama, vLLM, llama.cpp...) indicando su URL en LOCAL_LLM_URL
+LOCAL_LLM_URL = os.environ.get("LOCAL_LLM_URL", "http://127.0.0.1:8900/v1")
+LOCAL_MODELS = {
+    "mock-llm": "Servidor local de pruebas"
+}
+
+# Ventana de contexto documentada de cada modelo (prompt más respuesta);
+# prompt_token_budget descuenta la respuesta reservada y el formato de los mensajes
 TOKEN_LIMITS = {
     # OpenAI
-    "gpt-3.5-turbo": 16000,
+    "gpt-3.5-turbo": 16385,
     "gpt-4o": 128000,
     "gpt-4-turbo": 128000,
-    "gpt-4": 8000,
-    "gpt-3.5-turbo-instruct": 4000,
-    # Groq - Reduciendo límites para mayor seguridad
-    "llama-3.3-70b-versatile": 25000,  # Más conservador que los 32K teóricos
-    "llama-3.1-8b-instant": 7000,      # Más conservador que los 8K teóricos
-    "llama3-70b-8192": 7000,
-    "llama3-8b-8192": 7000,
-    "gemma2-9b-it": 7000,
-    "mixtral-8x7b-32768": 28000,       # Más conservador que los 32K teóricos
-    "llama-guard-3-8b": 7000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-instruct": 4096,
+    # Groq
+    "llama-3.3-70b-versatile": 131072,
+    "llama-3.1-8b-instant": 131072,
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "gemma2-9b-it": 8192,
+    "mixtral-8x7b-32768": 32768,
+    "llama-guard-3-8b": 8192,
     # Gemini
-    "gemini-2.0-flash": 32000,
-    "gemini-1.5-pro": 100000,  
-    "gemini-1.5-flash": 32000,
-    "gemini-pro": 32000,
-    "gemini-pro-vision": 16000
+    "gemini-2.0-flash": 1048576,
+    "gemini-1.5-pro": 2097152,
+    "gemini-1.5-flash": 1048576,
+    "gemini-pro": 32760,
+    "gemini-pro-vision": 16384
 }
 
-def estimate_tokens(text):
+# Ventana de contexto por proveedor para modelos que no aparecen en TOKEN_LIMITS (register_provider añade el resto)
+DEFAULT_TOKEN_LIMITS = {"chatgpt": 4096, "groq": 8192, "gemini": 32768}
+
+# Análisis map-reduce: consultas simultáneas y prompts de cada fase
+ANALYSIS_WORKERS = 4
+MAP_PROMPT = ("Resume el fragmento {part} de {total} de unos datos extraídos de una página web. "
+              "Indica de forma concisa los valores, cifras y patrones relevantes:\n\n{data}")
+COMBINE_PROMPT = ("Combina estos resúmenes parciales de datos extraídos de una página web en uno solo, "
+                  "conservando las cifras y patrones relevantes:\n\n{summaries}")
+REDUCE_PROMPT = ("Estos son los resúmenes de {total} fragmentos que cubren {rows} registros extraídos de una página web. "
+                 "Combínalos en un único análisis: proporciona un resumen útil e identifica patrones:\n\n{summaries}")
+# Preguntas sobre los datos extraídos: se envían las filas más relevantes para la pregunta
+QUESTION_PROMPT = ("Responde a la pregunta usando estos datos extraídos de una página web, ordenados de más "
+                   "a menos relevantes. Si los datos no bastan para responder, indícalo.\n\nPregunta: {question}")
+
+# Consultas simultáneas a varios proveedores: tiempo máximo de espera por proveedor (segundos)
+PROVIDER_TIMEOUT = 60.0
+PROVIDER_NAMES = {"chatgpt": "ChatGPT", "groq": "Groq", "gemini": "Gemini"}
+
+# Inicio de los mensajes de error que devuelven las funciones ask_*
+ERROR_RESPONSE_PREFIXES = ("Error", "Por favor, ingresa", "No se obtuvo", "No se pudo", "Modelo de IA no reconocido")
+
+# Mensaje de sistema de las consultas a ChatGPT
+CHATGPT_SYSTEM_PROMPT = "Eres un experto en web scraping."
+
+# Tiempos de espera de los clientes de IA (segundos): conexión y respuesta completa
+CONNECT_TIMEOUT = 10.0
+REQUEST_TIMEOUT = 120.0
+
+# Validaciones de API keys compartidas entre procesos (solo se guarda el hash de cada key)
+CACHE_DIR = Path(__file__).parent.parent / "cache"
+VALIDATION_CACHE_FILE = CACHE_DIR / "api_keys.json"
+VALID_KEY_TTL = 24 * 3600
+INVALID_KEY_TTL = 10 * 60
+# Códigos HTTP de key inválida o sin permisos, y su forma en los mensajes sin código ("Error code: 401")
+AUTH_STATUS = (401, 403)
+AUTH_STATUS_PATTERN = re.compile(r'\b(?:error code|status(?: code)?|http)\W{0,3}(?:401|403)\b')
+
+# Registro de clientes compartido entre sesiones y hilos: {(proveedor, hash de la key): cliente}
+_clients = {}
+_clients_lock = threading.Lock()
+# Clave de Gemini configurada globalmente (solo si no se pudo usar un cliente por key)
+_gemini_configured_key = None
+# Versiones de google-generativeai en las que se comprobó el uso de un cliente por key
+GEMINI_PER_KEY_SDK_VERSIONS = ("0.8.",)
+
+def key_fingerprint(api_key):
+    """Hash corto de una API key para usarla como clave sin guardarla en claro"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def gemini_per_key_supported():
+    """
+    Indica si las consultas a Gemini pueden usar un cliente propio de cada key.
+    genai.configure es global al proceso y GenerativeModel no admite un cliente en su API pública,
+    así que el cliente por key se asigna a su atributo interno _client. Solo se hace en las
+    versiones del SDK en las que se ha comprobado (GEMINI_PER_KEY_SDK_VERSIONS); en el resto se usa
+    genai.configure con la key de la consulta.
+    """
+    return getattr(genai, "__version__", "").startswith(GEMINI_PER_KEY_SDK_VERSIONS)
+
+def _make_gemini_client(api_key, service="generative"):
+    """
+    Cliente de Gemini propio de una key con la API de bajo nivel (google.ai.generativelanguage):
+    "generative" para consultas o "model" para listar modelos
+    """
+    from google.ai import generativelanguage as glm
+    client_class = {"generative": glm.GenerativeServiceClient, "model": glm.ModelServiceClient}[service]
+    return client_class(client_options={"api_key": api_key})
+
+def _configure_gemini(api_key):
+    """Configuración global de Gemini; solo se rehace si cambia la key"""
+    global _gemini_configured_key
+    with _clients_lock:
+        fingerprint = key_fingerprint(api_key)
+        if _gemini_configured_key != fingerprint:
+            genai.configure(api_key=api_key)
+            _gemini_configured_key = fingerprint
+
+def get_client(provider, api_key):
+    """
+    Devuelve un cliente de larga duración para el proveedor ("openai", "groq", "gemini" o "local") y la key.
+    Los clientes de OpenAI y Groq mantienen su pool de conexiones HTTP entre preguntas,
+    así que solo la primera petición paga la conexión y el handshake TLS.
+    """
+    key = (provider, key_fingerprint(api_key))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+        
+        timeout = httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+        if provider == "openai":
+            # Los reintentos los gestiona utils.rate_limiter, que respeta los límites compartidos
+            client = openai.OpenAI(api_key=api_key, timeout=timeout, max_retries=0)
+        elif provider == "groq":
+            client = Groq(api_key=api_key, timeout=timeout, max_retries=0)
+        elif provider == "local":
+            client = openai.OpenAI(api_key=api_key, base_url=LOCAL_LLM_URL, timeout=timeout, max_retries=0)
+        elif provider in ("gemini", "gemini_models"):
+            try:
+                client = _make_gemini_client(api_key, "model" if provider == "gemini_models" else "generative")
+            except Exception as e:
+                # Sin cliente propio se usa la configuración global, que solo se rehace si cambia la key
+                logger.warning(f"No se pudo crear un cliente de Gemini por key ({e}); se usará genai.configure")
+                client = None
+        else:
+            raise ValueError(f"Proveedor no soportado: {provider}")
+        
+        if client is not None:
+            _clients[key] = client
+        return client
+
+def gemini_request_options():
+    """Tiempo de espera de Gemini; los reintentos los gestiona utils.rate_limiter"""
+    return {"timeout": REQUEST_TIMEOUT, "retry": None}
+
+def get_gemini_model(api_key, model_name):
+    """Modelo de Gemini que usa el cliente registrado para la key"""
+    client = get_client("gemini", api_key) if gemini_per_key_supported() else None
+    model = genai.GenerativeModel(model_name)
+    if client is not None and hasattr(model, "_client"):
+        model._client = client
+    else:
+        _configure_gemini(api_key)
+    return model
+
+def close_clients():
+    """Cierra y olvida todos los clientes registrados"""
+    with _clients_lock:
+        for client in _clients.values():
+            close = getattr(client, "close", None)
+            if close:
+                try:
+                    close()
+                except Exception:
+                    pass
+        _clients.clear()
+
+# Tokenizadores de tiktoken por familia de modelos. Llama, Mixtral, Gemma y Gemini no tienen
+# tokenizador en tiktoken: se cuentan con cl100k_base, que se ajusta bien en español
+OPENAI_ENCODINGS = {"gpt-4o": "o200k_base"}
+DEFAULT_ENCODING = "cl100k_base"
+# Estimación por caracteres cuando tiktoken no está disponible (sin paquete o sin descargar la codificación),
+# con un margen porque el texto con números, URLs o acentos tiene menos caracteres por token
+CHARS_PER_TOKEN = 3.5
+APPROXIMATE_TOKEN_MARGIN = 1.1
+# Tokens reservados para la respuesta y para el formato de los mensajes del chat
+OUTPUT_TOKEN_RESERVE = 1024
+MESSAGE_TOKEN_OVERHEAD = 16
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+_token_counts = OrderedDict()
+_token_counts_lock = threading.Lock()
+TOKEN_COUNT_CACHE_SIZE = 1024
+
+def _get_encoding(name):
+    """Codificación de tiktoken memorizada; None si no se puede cargar (se intenta una sola vez)"""
+    with _encodings_lock:
+        if name not in _encodings:
+            try:
+                import tiktoken
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                logger.warning(f"Tokenizador {name} no disponible ({e}); se estimarán los tokens por caracteres")
+                _encodings[name] = None
+        return _encodings[name]
+
+def _tokenizer_for(model_name):
+    """Codificación de tiktoken del modelo, o None si no se puede cargar"""
+    if model_name and model_name.startswith("gpt"):
+        encoding_name = next((enc for prefix, enc in OPENAI_ENCODINGS.items() if model_name.startswith(prefix)),
+                             DEFAULT_ENCODING)
+        return _get_encoding(encoding_name)
+    return _get_encoding(DEFAULT_ENCODING)
+
+def estimate_tokens(text, model_name=None):
     """
-    Estima aproximadamente la cantidad de tokens en un texto.
-    Esta es una estimación aproximada basada en el número de caracteres.
-    Se usa un factor de seguridad para evitar subestimaciones.
+    Cuenta los tokens de un texto con el tokenizador de la familia del modelo.
+    Los conteos se memorizan por hash del texto; sin tiktoken se estima por caracteres
+    con APPROXIMATE_TOKEN_MARGIN.
     """
-    # Un token es aproximadamente 4 caracteres en inglés/español
-    # Aplicamos un factor de seguridad de 1.2 para evitar subestimaciones
-    return int(len(text) // 3.5)  # Más conservador que 4 caracteres por token
+    if not text:
+        return 0
+    encoding = _tokenizer_for(model_name)
+    if encoding is None:
+        return int(len(text) / CHARS_PER_TOKEN * APPROXIMATE_TOKEN_MARGIN)
+    
+    key = (encoding.name, len(text), hash(text))
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+    if count is None:
+        count = len(encoding.encode(text, disallowed_special=()))
+        with _token_counts_lock:
+            _token_counts[key] = count
+            if len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+                _token_counts.popitem(last=False)
+    return count
+
+def groq_output_tokens(model_name):
+    """Tokens de respuesta que se piden a Groq (llama-3.3-70b-versatile los limita explícitamente)"""
+    return 4000 if model_name == "llama-3.3-70b-versatile" else OUTPUT_TOKEN_RESERVE
+
+def prompt_token_budget(model_name, default_limit, output_tokens=OUTPUT_TOKEN_RESERVE):
+    """Tokens disponibles para el prompt: el límite del modelo menos la respuesta y el formato de mensajes"""
+    limit = TOKEN_LIMITS.get(model_name, default_limit)
+    return max(256, limit - output_tokens - MESSAGE_TOKEN_OVERHEAD)
+
+def request_tokens(prompt, model_name, output_tokens=OUTPUT_TOKEN_RESERVE):
+    """Tokens que se reservan en el límite por minuto para una consulta: prompt más respuesta esperada"""
+    return estimate_tokens(prompt, model_name) + output_tokens
+
+def _openai_usage(response):
+    """Tokens consumidos según la respuesta de OpenAI o Groq"""
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+def _gemini_usage(response):
+    """Tokens consumidos según la respuesta de Gemini"""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) or None
+
+def rate_limit_message(provider_label):
+    """Mensaje cuando se agotan los reintentos por límite de velocidad"""
+    return f"Error: Has alcanzado el límite de solicitudes de {provider_label}. Espera unos minutos antes de intentar nuevamente."
 
-@lru_cache(maxsize=8)  # Caché para evitar múltiples verificaciones
-def validate_api_key(api_type, api_key):
+def record_usage(response):
+    """Anota en las métricas de la llamada en curso los tokens reales que informa el proveedor"""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        annotate(tokens_prompt=getattr(usage, "prompt_tokens", None),
+                 tokens_respuesta=getattr(usage, "completion_tokens", None))
+        return
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and getattr(usage, "prompt_token_count", None):
+        annotate(tokens_prompt=usage.prompt_token_count,
+                 tokens_respuesta=getattr(usage, "candidates_token_count", None))
+
+def llm_call(operation, provider=None):
+    """Registra las métricas de cada llamada en utils.telemetry; los mensajes de error cuentan como errores"""
+    return instrumented(operation, provider, is_error=lambda answer: is_error_response(answer))
+
+_validation_cache = {}
+_validation_lock = threading.Lock()
+
+def _validation_key(api_type, api_key):
+    return f"{api_type}:{key_fingerprint(api_key)}"
+
+def _is_fresh(entry, now=None):
+    """Indica si una validación guardada sigue vigente según su resultado"""
+    ttl = VALID_KEY_TTL if entry.get("valid") else INVALID_KEY_TTL
+    return (now or time.time()) - entry.get("checked_at", 0) < ttl
+
+def _read_validation_file():
+    try:
+        with open(VALIDATION_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def get_cached_validation(api_type, api_key):
     """
-    Valida si una API key es válida haciendo una solicitud mínima.
+    Resultado vigente de una validación anterior, (válido, mensaje), o None.
+    Si no está en memoria se consulta el archivo compartido con los demás procesos.
+    """
+    key = _validation_key(api_type, api_key)
+    with _validation_lock:
+        entry = _validation_cache.get(key)
+        if entry is None or not _is_fresh(entry):
+            entry = _read_validation_file().get(key)
+            if entry is None or not _is_fresh(entry):
+                return None
+            _validation_cache[key] = entry
+    return entry["valid"], entry["message"]
+
+def _store_validation(api_type, api_key, valid, message):
+    """Guarda una validación en memoria y en el archivo compartido (escritura atómica)"""
+    key = _validation_key(api_type, api_key)
+    entry = {"valid": valid, "message": message, "checked_at": time.time()}
+    with _validation_lock:
+        _validation_cache[key] = entry
+        try:
+            CACHE_DIR.mkdir(exist_ok=True)
+            now = time.time()
+            entries = {k: v for k, v in _read_validation_file().items() if _is_fresh(v, now)}
+            entries[key] = entry
+            tmp_path = VALIDATION_CACHE_FILE.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, VALIDATION_CACHE_FILE)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la validación de la API key: {e}")
+
+def is_auth_error(error):
+    """Indica si una excepción de un proveedor se debe a una API key inválida o sin permisos"""
+    if isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError,
+                          groq.AuthenticationError, groq.PermissionDeniedError)):
+        return True
+    if error_status(error) in AUTH_STATUS:
+        return True
+    # Los números sueltos no bastan: "Requested 2401 tokens" no es un error de autenticación
+    error_msg = str(error).lower()
+    return (
+        ("api key" in error_msg and any(word in error_msg for word in ("invalid", "incorrect", "not valid", "expired")))
+        or "api_key_invalid" in error_msg
+        or "unauthenticated" in error_msg
+        or AUTH_STATUS_PATTERN.search(error_msg) is not None
+    )
+
+def validate_api_key(api_type, api_key, force=False):
+    """
+    Valida una API key con la llamada más barata de cada proveedor (listar modelos, sin coste).
+    Los resultados se guardan con caducidad (VALID_KEY_TTL / INVALID_KEY_TTL) por hash de la key,
+    en memoria y en un archivo compartido entre procesos; con force=True se ignora lo guardado.
+    Los errores transitorios (red, límites) no se guardan.
     Retorna (válido, mensaje)
     """
     if not api_key:
         return False, "No se proporcionó API key"
     
+    if not force:
+        cached = get_cached_validation(api_type, api_key)
+        if cached is not None:
+            return cached
+    
     try:
         if api_type == "openai":
-            client = openai.OpenAI(api_key=api_key)
-            # Usamos una solicitud pequeña para validar
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": "test"}],
-                max_tokens=5
-            )
-            return True, "API key válida"
-            
+            get_client("openai", api_key).models.list()
         elif api_type == "groq":
-            client = Groq(api_key=api_key)
-            response = client.chat.completions.create(
-                messages=[{"role": "user", "content": "test"}],
-                model="llama-3.1-8b-instant",
-                max_tokens=5
-            )
-            return True, "API key válida"
-            
+            get_client("groq", api_key).models.list()
+        elif api_type == "local":
+            get_client("local", api_key).models.list()
         elif api_type == "gemini":
-            genai.configure(api_key=api_key)
-            # Cambiar a gemini-2.0-flash que es el modelo recomendado
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            response = model.generate_content("test", generation_config={"max_output_tokens": 5})
-            return True, "API key válida"
+            # Basta con pedir la primera página del listado de modelos
+            client = get_client("gemini_models", api_key)
+            if client is None:
+                _configure_gemini(api_key)
+            next(iter(genai.list_models(page_size=1, client=client, request_options=gemini_request_options())), None)
+        else:
+            return False, f"Proveedor no soportado: {api_type}"
+        
+        _store_validation(api_type, api_key, True, "API key válida")
+        return True, "API key válida"
             
     except Exception as e:
         error_msg = str(e).lower()
         
         # Detectar errores específicos de API key
-        if "api key" in error_msg and ("invalid" in error_msg or "incorrect" in error_msg):
-            return False, f"API key inválida: {e}"
-        elif "auth" in error_msg or "authent" in error_msg:
-            return False, f"Error de autenticación: {e}"
-        # Añadir caso específico para modelo no encontrado de Gemini
-        elif "not found" in error_msg and "model" in error_msg:
-            return False, f"Error: modelo no encontrado o no compatible con tu API key. {str(e)}"
-        else:
-            return False, f"Error validando API key: {e}"
-    
-    return True, "API key válida"
+        if is_auth_error(e):
+            if "api key" in error_msg and ("invalid" in error_msg or "incorrect" in error_msg):
+                message = f"API key inválida: {e}"
+            else:
+                message = f"Error de autenticación: {e}"
+            _store_validation(api_type, api_key, False, message)
+            return False, message
+        return False, f"Error validando API key: {e}"
 
-def truncate_content(content, max_tokens):
+def known_invalid_key(api_type, api_key):
+    """Mensaje de error si la key ya se validó como inválida (sin llamadas de red), o None"""
+    cached = get_cached_validation(api_type, api_key)
+    if cached is not None and not cached[0]:
+        return f"Error de API: {cached[1]}"
+    return None
+
+def auth_failure_message(api_type, api_key, error):
+    """Tras un error de autenticación, valida la key para dar un mensaje preciso y recordarlo"""
+    is_valid, message = validate_api_key(api_type, api_key, force=True)
+    if not is_valid:
+        return f"Error de API: {message}"
+    return f"Error de autenticación con la API: {error}"
+
+def truncate_content(content, max_tokens, model_name=None):
     """
     Trunca el contenido para que esté dentro del límite de tokens.
-    Preserva el principio y final del contenido.
+    Preserva el principio y final del contenido y corta en límites de token.
     """
-    estimated_tokens = estimate_tokens(content)
+    estimated_tokens = estimate_tokens(content, model_name)
     
     # Si está dentro del límite, devolver tal cual
     if estimated_tokens <= max_tokens:
@@ -139,51 +477,90 @@ def truncate_content(content, max_tokens):
     
     # Reservar tokens para el mensaje de truncado
     truncation_msg = "\n[...CONTENIDO TRUNCADO...]\n"
-    truncation_tokens = estimate_tokens(truncation_msg)
+    truncation_tokens = estimate_tokens(truncation_msg, model_name)
     
     # Calcular cuánto texto conservar del principio y del final
+    encoding = _tokenizer_for(model_name)
     available_tokens = max_tokens - truncation_tokens
     start_tokens = available_tokens * 2 // 3  # 2/3 del contenido al principio
     end_tokens = available_tokens - start_tokens  # 1/3 del contenido al final
     
-    # Convertir tokens a caracteres aproximados
-    start_chars = start_tokens * 4
-    end_chars = end_tokens * 4
+    if encoding is not None:
+        tokens = encoding.encode(content, disallowed_special=())
+        return encoding.decode(tokens[:start_tokens]) + truncation_msg + \
+            (encoding.decode(tokens[-end_tokens:]) if end_tokens > 0 else "")
+    
+    # Sin tokenizador: convertir tokens a caracteres con la misma proporción que estimate_tokens
+    chars_per_token = CHARS_PER_TOKEN / APPROXIMATE_TOKEN_MARGIN
+    start_chars = int(start_tokens * chars_per_token)
+    end_chars = int(end_tokens * chars_per_token)
     
     # Truncar preservando inicio y fin
-    truncated = content[:start_chars] + truncation_msg + content[-end_chars:]
+    truncated = content[:start_chars] + truncation_msg + (content[-end_chars:] if end_chars > 0 else "")
     
     return truncated
 
-def ask_chatgpt(prompt, api_key, model_name="gpt-3.5-turbo", retries=1):
+def cached_response(provider, model_name, prompt, params=None, use_cache=True):
+    """
+    Busca una respuesta ya obtenida para la misma consulta.
+    Retorna (clave, respuesta); la respuesta es None si no hay entrada vigente o use_cache es False.
+    """
+    key = response_cache_key(provider, model_name, prompt, params)
+    if not use_cache:
+        return key, None
+    answer = response_cache.get(key)
+    if answer is not None:
+        logger.info(f"Respuesta de {provider} ({model_name}) servida desde la caché")
+        annotate(estado="caché")
+    return key, answer
+
+@llm_call("consulta", "openai")
+def ask_chatgpt(prompt, api_key, model_name="gpt-3.5-turbo", retries=1, use_cache=True):
     """Ask a question to ChatGPT API with selected model"""
     if not api_key:
         return "Por favor, ingresa tu ChatGPT API Key en la configuración."
     
-    # Validar API key primero
-    is_valid, message = validate_api_key("openai", api_key)
-    if not is_valid:
-        return f"Error de API: {message}"
+    # Las keys ya conocidas como inválidas fallan sin llamar a la API; el resto se valida solo si falla la autenticación
+    invalid_message = known_invalid_key("openai", api_key)
+    if invalid_message:
+        return invalid_message
+    
+    cache_key, cached = cached_response("openai", model_name, prompt, {"system": CHATGPT_SYSTEM_PROMPT}, use_cache)
+    if cached is not None:
+        return cached
     
     try:
         # Verificar límite de tokens y truncar si es necesario
-        max_tokens = TOKEN_LIMITS.get(model_name, 4000)
-        estimated_tokens = estimate_tokens(prompt)
+        max_tokens = prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS["chatgpt"])
+        estimated_tokens = estimate_tokens(prompt, model_name)
+        annotate(tokens_estimados=estimated_tokens)
         
-        if estimated_tokens > max_tokens * 0.9:  # Usar 90% como límite seguro
+        if estimated_tokens > max_tokens:
             logger.warning(f"Prompt demasiado largo: ~{estimated_tokens} tokens. Truncando...")
-            prompt = truncate_content(prompt, int(max_tokens * 0.9))
-            logger.info(f"Prompt truncado a ~{estimate_tokens(prompt)} tokens")
+            prompt = truncate_content(prompt, max_tokens, model_name)
+            logger.info(f"Prompt truncado a ~{estimate_tokens(prompt, model_name)} tokens")
+            annotate(truncado=True)
         
-        client = openai.OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": "Eres un experto en web scraping."},
-                {"role": "user", "content": prompt}
-            ]
+        client = get_client("openai", api_key)
+        response = call_with_rate_limit(
+            "openai", key_fingerprint(api_key), model_name, request_tokens(prompt, model_name),
+            lambda: client.chat.completions.create(
+                model=model_name,
+                messages=[
+                    {"role": "system", "content": CHATGPT_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ]
+            ),
+            usage_tokens=_openai_usage
         )
-        return response.choices[0].message.content
+        record_usage(response)
+        answer = response.choices[0].message.content
+        if use_cache and answer:
+            response_cache.put(cache_key, "openai", model_name, answer)
+        return answer
+        
+    except (openai.AuthenticationError, openai.PermissionDeniedError) as e:
+        return auth_failure_message("openai", api_key, e)
         
     except openai.BadRequestError as e:
         error_msg = str(e).lower()
@@ -193,8 +570,8 @@ def ask_chatgpt(prompt, api_key, model_name="gpt-3.5-turbo", retries=1):
             if retries > 0:
                 logger.warning(f"Error de límite de tokens: {e}. Reintentando con un prompt más pequeño...")
                 # Reducir aún más el tamaño del prompt
-                shortened_prompt = truncate_content(prompt, int(max_tokens * 0.7))
-                return ask_chatgpt(shortened_prompt, api_key, model_name, retries-1)
+                shortened_prompt = truncate_content(prompt, int(max_tokens * 0.7), model_name)
+                return ask_chatgpt(shortened_prompt, api_key, model_name, retries-1, use_cache)
             else:
                 return f"Error: El contenido es demasiado largo para el modelo {model_name}. Por favor, reduce la cantidad de datos o usa un modelo con mayor capacidad."
         
@@ -203,67 +580,89 @@ def ask_chatgpt(prompt, api_key, model_name="gpt-3.5-turbo", retries=1):
         
     except Exception as e:
         logger.error(f"Error en ChatGPT API con modelo {model_name}: {e}")
+        if is_rate_limit_error(e) or isinstance(e, TimeoutError):
+            return rate_limit_message("OpenAI")
         return f"Error con la API de ChatGPT (modelo {model_name}): {str(e)}"
 
-def ask_groq(prompt, api_key, model_name="llama-3.3-70b-versatile", retries=1):
+@llm_call("consulta", "groq")
+def ask_groq(prompt, api_key, model_name="llama-3.3-70b-versatile", retries=1, use_cache=True):
     """Ask a question to Groq API with selected model"""
     if not api_key:
         return "Por favor, ingresa tu Groq API Key en la configuración."
     
-    # Validar API key primero
-    is_valid, message = validate_api_key("groq", api_key)
-    if not is_valid:
-        return f"Error de API: {message}"
+    # Las keys ya conocidas como inválidas fallan sin llamar a la API; el resto se valida solo si falla la autenticación
+    invalid_message = known_invalid_key("groq", api_key)
+    if invalid_message:
+        return invalid_message
+    
+    cache_key, cached = cached_response("groq", model_name, prompt, {"max_tokens": groq_output_tokens(model_name)}, use_cache)
+    if cached is not None:
+        return cached
     
     try:
         # Verificar límite de tokens y truncar si es necesario
-        max_tokens = TOKEN_LIMITS.get(model_name, 8000)
-        estimated_tokens = estimate_tokens(prompt)
+        # llama-3.3-70b-versatile reserva 4000 tokens para la respuesta (ver max_tokens más abajo)
+        max_tokens = prompt_token_budget(model_name, 8000, groq_output_tokens(model_name))
+        estimated_tokens = estimate_tokens(prompt, model_name)
         
         logger.info(f"Estimación de tokens para solicitud a Groq ({model_name}): {estimated_tokens} tokens (límite: {max_tokens})")
+        annotate(tokens_estimados=estimated_tokens)
         
-        # Factor de seguridad especial para llama-3.3-70b-versatile
-        safety_factor = 0.65 if model_name == "llama-3.3-70b-versatile" else 0.85
-        
-        if estimated_tokens > max_tokens * safety_factor:
+        if estimated_tokens > max_tokens:
             logger.warning(f"Prompt demasiado largo: ~{estimated_tokens} tokens. Truncando para {model_name}...")
-            prompt = truncate_content(prompt, int(max_tokens * safety_factor))
-            new_estimate = estimate_tokens(prompt)
+            prompt = truncate_content(prompt, max_tokens, model_name)
+            new_estimate = estimate_tokens(prompt, model_name)
             logger.info(f"Prompt truncado a ~{new_estimate} tokens")
+            annotate(truncado=True)
             
         # Usar el modelo seleccionado
-        client = Groq(api_key=api_key)
+        client = get_client("groq", api_key)
         
         # Para llama-3.3-70b-versatile, intentemos limitar explícitamente los tokens de salida
         if model_name == "llama-3.3-70b-versatile":
-            chat_completion = client.chat.completions.create(
+            request = lambda: client.chat.completions.create(
                 messages=[{"role": "user", "content": prompt}],
                 model=model_name,
-                max_tokens=4000  # Limitar explícitamente la respuesta
+                max_tokens=groq_output_tokens(model_name)  # Limitar explícitamente la respuesta
             )
         else:
-            chat_completion = client.chat.completions.create(
+            request = lambda: client.chat.completions.create(
                 messages=[{"role": "user", "content": prompt}],
                 model=model_name,
             )
-            
-        return chat_completion.choices[0].message.content
+        chat_completion = call_with_rate_limit(
+            "groq", key_fingerprint(api_key), model_name,
+            request_tokens(prompt, model_name, groq_output_tokens(model_name)), request,
+            usage_tokens=_openai_usage
+        )
+        record_usage(chat_completion)
+        
+        answer = chat_completion.choices[0].message.content
+        if use_cache and answer:
+            response_cache.put(cache_key, "groq", model_name, answer)
+        return answer
         
     except Exception as e:
         error_msg = str(e).lower()
         logger.error(f"Error en Groq API con modelo {model_name}: {e}")
         
+        if is_auth_error(e):
+            return auth_failure_message("groq", api_key, e)
+        
+        if is_rate_limit_error(e) or isinstance(e, TimeoutError):
+            return rate_limit_message("Groq")
+        
         # Si es un error de límite de tokens y podemos reintentar
         if ("token" in error_msg and ("exceed" in error_msg or "limit" in error_msg)) and retries > 0:
             logger.warning(f"Error de límite de tokens: {e}. Reintentando con un prompt más pequeño...")
             
             # Reducción más agresiva específicamente para llama-3.3-70b-versatile
             reduction_factor = 0.5 if model_name == "llama-3.3-70b-versatile" else 0.7
-            max_tokens = TOKEN_LIMITS.get(model_name, 8000)
-            shortened_prompt = truncate_content(prompt, int(max_tokens * reduction_factor))
+            max_tokens = prompt_token_budget(model_name, 8000, groq_output_tokens(model_name))
+            shortened_prompt = truncate_content(prompt, int(max_tokens * reduction_factor), model_name)
             
             logger.info(f"Intentando nuevamente con prompt reducido al {int(reduction_factor*100)}% del límite")
-            return ask_groq(shortened_prompt, api_key, model_name, retries-1)
+            return ask_groq(shortened_prompt, api_key, model_name, retries-1, use_cache)
         
         # Mensajes de error más específicos
         if "token" in error_msg and ("exceed" in error_msg or "limit" in error_msg):
@@ -279,37 +678,62 @@ def ask_groq(prompt, api_key, model_name="llama-3.3-70b-versatile", retries=1):
         else:
             return f"Error con la API de Groq (modelo {model_name}): {str(e)}"
 
-def ask_gemini(prompt, api_key, model_name="gemini-2.0-flash", retries=1):
+def _gemini_fallback_answer(prompt, api_key, error):
+    """Respuesta del modelo de respaldo gemini-pro cuando falla el modelo solicitado"""
+    try:
+        logger.info("Intentando con modelo de respaldo gemini-pro")
+        model = get_gemini_model(api_key, "gemini-pro")
+        response = model.generate_content(prompt, request_options=gemini_request_options())
+        
+        if response and hasattr(response, 'text'):
+            return "⚠️ Modelo solicitado no disponible. Respuesta generada con el modelo de respaldo gemini-pro:\n\n" + response.text
+        else:
+            return "No se pudo obtener respuesta de ningún modelo de Gemini."
+    except Exception as backup_error:
+        return f"Error con todos los modelos de Gemini. Error: {str(error)}. Error de respaldo: {str(backup_error)}"
+
+@llm_call("consulta", "gemini")
+def ask_gemini(prompt, api_key, model_name="gemini-2.0-flash", retries=1, use_cache=True):
     """Ask a question to Gemini API using selected model"""
     if not api_key:
         return "Por favor, ingresa tu Gemini API Key en la configuración."
     
-    # Validar API key primero
-    is_valid, message = validate_api_key("gemini", api_key)
-    if not is_valid:
-        return f"Error de API: {message}"
+    # Las keys ya conocidas como inválidas fallan sin llamar a la API; el resto se valida solo si falla la autenticación
+    invalid_message = known_invalid_key("gemini", api_key)
+    if invalid_message:
+        return invalid_message
+    
+    cache_key, cached = cached_response("gemini", model_name, prompt, None, use_cache)
+    if cached is not None:
+        return cached
     
     try:
         # Verificar límite de tokens y truncar si es necesario
-        max_tokens = TOKEN_LIMITS.get(model_name, 32000)
-        estimated_tokens = estimate_tokens(prompt)
+        max_tokens = prompt_token_budget(model_name, 32000)
+        estimated_tokens = estimate_tokens(prompt, model_name)
+        annotate(tokens_estimados=estimated_tokens)
         
-        if estimated_tokens > max_tokens * 0.9:  # Usar 90% como límite seguro
+        if estimated_tokens > max_tokens:
             logger.warning(f"Prompt demasiado largo: ~{estimated_tokens} tokens. Truncando...")
-            prompt = truncate_content(prompt, int(max_tokens * 0.9))
-            logger.info(f"Prompt truncado a ~{estimate_tokens(prompt)} tokens")
-        
-        # Configuración básica de Gemini
-        genai.configure(api_key=api_key)
+            prompt = truncate_content(prompt, max_tokens, model_name)
+            logger.info(f"Prompt truncado a ~{estimate_tokens(prompt, model_name)} tokens")
+            annotate(truncado=True)
         
         try:
             logger.info(f"Usando modelo Gemini: {model_name}")
-            model = genai.GenerativeModel(model_name)
+            model = get_gemini_model(api_key, model_name)
             
             # Usar configuración básica
-            response = model.generate_content(prompt)
+            response = call_with_rate_limit(
+                "gemini", key_fingerprint(api_key), model_name, request_tokens(prompt, model_name),
+                lambda: model.generate_content(prompt, request_options=gemini_request_options()),
+                usage_tokens=_gemini_usage
+            )
+            record_usage(response)
             
             if response and hasattr(response, 'text'):
+                if use_cache and response.text:
+                    response_cache.put(cache_key, "gemini", model_name, response.text)
                 return response.text
             else:
                 return "No se obtuvo respuesta del modelo. Intenta con otro modelo."
@@ -317,28 +741,24 @@ def ask_gemini(prompt, api_key, model_name="gemini-2.0-flash", retries=1):
         except Exception as e:
             error_msg = str(e).lower()
             
+            if is_auth_error(e):
+                return auth_failure_message("gemini", api_key, e)
+            
+            if is_rate_limit_error(e) or isinstance(e, TimeoutError):
+                return rate_limit_message("Gemini")
+            
             # Si es un error de límite de tokens y podemos reintentar
             if ("token" in error_msg or "content too long" in error_msg) and retries > 0:
                 logger.warning(f"Error de Gemini - Contenido demasiado largo: {e}. Reintentando...")
                 # Reducir el tamaño del prompt
-                shortened_prompt = truncate_content(prompt, int(max_tokens * 0.7))
-                return ask_gemini(shortened_prompt, api_key, model_name, retries-1)
+                shortened_prompt = truncate_content(prompt, int(max_tokens * 0.7), model_name)
+                return ask_gemini(shortened_prompt, api_key, model_name, retries-1, use_cache)
             
             logger.error(f"Error con el modelo {model_name}: {e}")
             
             # Intentar con modelo de respaldo
             if retries > 0:
-                try:
-                    logger.info("Intentando con modelo de respaldo gemini-pro")
-                    model = genai.GenerativeModel("gemini-pro")
-                    response = model.generate_content(prompt)
-                    
-                    if response and hasattr(response, 'text'):
-                        return "⚠️ Modelo solicitado no disponible. Respuesta generada con el modelo de respaldo gemini-pro:\n\n" + response.text
-                    else:
-                        return "No se pudo obtener respuesta de ningún modelo de Gemini."
-                except Exception as backup_error:
-                    return f"Error con todos los modelos de Gemini. Error: {str(e)}. Error de respaldo: {str(backup_error)}"
+                return _gemini_fallback_answer(prompt, api_key, e)
             else:
                 if "token" in error_msg:
                     return f"Error: El contenido es demasiado largo para el modelo {model_name}. Por favor, reduce la cantidad de datos o usa un modelo con mayor capacidad como gemini-1.5-pro."
@@ -349,63 +769,701 @@ def ask_gemini(prompt, api_key, model_name="gemini-2.0-flash", retries=1):
         logger.error(f"Error general con Gemini API: {e}")
         return f"Error de conexión con Gemini: {str(e)}"
 
-def analyze_scraped_data(data, api_key, model="groq", model_name="llama-3.3-70b-versatile"):
-    """Analyze scraped data using AI with selected model"""
-    if isinstance(data, pd.DataFrame) and data.empty:
-        return "No hay datos para analizar."
+def _fit_prompt(prompt, model_name, max_tokens):
+    """Trunca el prompt si supera el presupuesto de tokens, igual que las funciones ask_*"""
+    estimated_tokens = estimate_tokens(prompt, model_name)
+    annotate(tokens_estimados=estimated_tokens)
+    if estimated_tokens > max_tokens:
+        logger.warning(f"Prompt demasiado largo: ~{estimated_tokens} tokens. Truncando para {model_name}...")
+        prompt = truncate_content(prompt, max_tokens, model_name)
+        logger.info(f"Prompt truncado a ~{estimate_tokens(prompt, model_name)} tokens")
+        annotate(truncado=True)
+    return prompt
+
+def _is_token_limit_error(error):
+    """Indica si el proveedor rechazó la consulta por exceder el límite de tokens"""
+    error_msg = str(error).lower()
+    return ("token" in error_msg and ("exceed" in error_msg or "limit" in error_msg)) or "content too long" in error_msg
+
+def _stream_openai_compatible(provider, client, prompt, api_key, model_name, messages_for, max_tokens,
+                              request_kwargs, retries, use_cache, cache_key, provider_label):
+    """
+    Genera el texto de una respuesta de ChatGPT o Groq a medida que llega.
+    Un error antes del primer fragmento se gestiona como en ask_*: se reintenta con un prompt
+    más corto si se excedió el límite de tokens o se devuelve el mensaje de error.
+    """
+    received = []
+    try:
+        output_tokens = request_kwargs.get("max_tokens", OUTPUT_TOKEN_RESERVE)
+        stream = call_with_rate_limit(
+            provider, key_fingerprint(api_key), model_name, request_tokens(prompt, model_name, output_tokens),
+            lambda: client.chat.completions.create(
+                model=model_name,
+                messages=messages_for(prompt),
+                stream=True,
+                **request_kwargs
+            )
+        )
+        for chunk in stream:
+            # El consumo real llega en el último fragmento (usage en OpenAI, x_groq.usage en Groq)
+            record_usage(chunk)
+            record_usage(getattr(chunk, "x_groq", None))
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                received.append(text)
+                yield text
+    except Exception as e:
+        logger.error(f"Error en streaming de {provider_label} con modelo {model_name}: {e}")
+        if received:
+            yield f"\n\n⚠️ La respuesta se interrumpió: {str(e)}"
+            return
+        if is_auth_error(e):
+            yield auth_failure_message(provider, api_key, e)
+        elif is_rate_limit_error(e) or isinstance(e, TimeoutError):
+            yield rate_limit_message(provider_label)
+        elif _is_token_limit_error(e) and retries > 0:
+            shortened_prompt = truncate_content(prompt, int(max_tokens * 0.7), model_name)
+            yield from _stream_openai_compatible(provider, client, shortened_prompt, api_key, model_name, messages_for,
+                                                 max_tokens, request_kwargs, retries - 1, use_cache, cache_key,
+                                                 provider_label)
+        else:
+            yield f"Error con la API de {provider_label} (modelo {model_name}): {str(e)}"
+        return
+
+    answer = "".join(received)
+    if use_cache and answer:
+        response_cache.put(cache_key, provider, model_name, answer)
+
+@llm_call("streaming", "openai")
+def stream_chatgpt(prompt, api_key, model_name="gpt-3.5-turbo", retries=1, use_cache=True):
+    """Versión de ask_chatgpt que genera la respuesta por fragmentos a medida que llega"""
+    if not api_key:
+        yield "Por favor, ingresa tu ChatGPT API Key en la configuración."
+        return
+    invalid_message = known_invalid_key("openai", api_key)
+    if invalid_message:
+        yield invalid_message
+        return
+    
+    cache_key, cached = cached_response("openai", model_name, prompt, {"system": CHATGPT_SYSTEM_PROMPT}, use_cache)
+    if cached is not None:
+        yield cached
+        return
     
-    # Para modelo llama-3.3-70b-versatile, limitar aún más las filas
-    row_limit = 10 if (model == "groq" and model_name == "llama-3.3-70b-versatile") else 15
+    max_tokens = prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS["chatgpt"])
+    yield from _stream_openai_compatible(
+        "openai", get_client("openai", api_key), _fit_prompt(prompt, model_name, max_tokens), api_key, model_name,
+        lambda text: [{"role": "system", "content": CHATGPT_SYSTEM_PROMPT}, {"role": "user", "content": text}],
+        max_tokens, {"stream_options": {"include_usage": True}}, retries, use_cache, cache_key, "ChatGPT"
+    )
+
+@llm_call("streaming", "groq")
+def stream_groq(prompt, api_key, model_name="llama-3.3-70b-versatile", retries=1, use_cache=True):
+    """Versión de ask_groq que genera la respuesta por fragmentos a medida que llega"""
+    if not api_key:
+        yield "Por favor, ingresa tu Groq API Key en la configuración."
+        return
+    invalid_message = known_invalid_key("groq", api_key)
+    if invalid_message:
+        yield invalid_message
+        return
     
-    # Convertir los datos a un formato más legible
-    data_str = ""
+    cache_key, cached = cached_response("groq", model_name, prompt, {"max_tokens": groq_output_tokens(model_name)}, use_cache)
+    if cached is not None:
+        yield cached
+        return
+    
+    max_tokens = prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS["groq"], groq_output_tokens(model_name))
+    request_kwargs = {"max_tokens": groq_output_tokens(model_name)} if model_name == "llama-3.3-70b-versatile" else {}
+    yield from _stream_openai_compatible(
+        "groq", get_client("groq", api_key), _fit_prompt(prompt, model_name, max_tokens), api_key, model_name,
+        lambda text: [{"role": "user", "content": text}],
+        max_tokens, request_kwargs, retries, use_cache, cache_key, "Groq"
+    )
+
+@llm_call("streaming", "gemini")
+def stream_gemini(prompt, api_key, model_name="gemini-2.0-flash", retries=1, use_cache=True):
+    """Versión de ask_gemini que genera la respuesta por fragmentos a medida que llega"""
+    if not api_key:
+        yield "Por favor, ingresa tu Gemini API Key en la configuración."
+        return
+    invalid_message = known_invalid_key("gemini", api_key)
+    if invalid_message:
+        yield invalid_message
+        return
+    
+    cache_key, cached = cached_response("gemini", model_name, prompt, None, use_cache)
+    if cached is not None:
+        yield cached
+        return
+    
+    max_tokens = prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS["gemini"])
+    prompt = _fit_prompt(prompt, model_name, max_tokens)
+    received = []
     try:
-        # Limitar la cantidad de datos para evitar exceder límites de tokens
-        sample_data = data.head(row_limit) if len(data) > row_limit else data
-        data_str = sample_data.to_string()
-        
-        # Registrar el tamaño estimado para diagnóstico
-        estimated_tokens = estimate_tokens(data_str)
-        logger.info(f"Tamaño estimado de los datos a analizar: ~{estimated_tokens} tokens")
-        
-    except:
-        data_str = str(data)
+        logger.info(f"Usando modelo Gemini en streaming: {model_name}")
+        model = get_gemini_model(api_key, model_name)
+        stream = call_with_rate_limit(
+            "gemini", key_fingerprint(api_key), model_name, request_tokens(prompt, model_name),
+            lambda: model.generate_content(prompt, stream=True, request_options=gemini_request_options())
+        )
+        for chunk in stream:
+            record_usage(chunk)
+            # Los fragmentos bloqueados por seguridad no tienen texto
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                received.append(text)
+                yield text
+    except Exception as e:
+        logger.error(f"Error en streaming de Gemini con modelo {model_name}: {e}")
+        if received:
+            yield f"\n\n⚠️ La respuesta se interrumpió: {str(e)}"
+            return
+        if is_auth_error(e):
+            yield auth_failure_message("gemini", api_key, e)
+        elif is_rate_limit_error(e) or isinstance(e, TimeoutError):
+            yield rate_limit_message("Gemini")
+        elif _is_token_limit_error(e) and retries > 0:
+            yield from stream_gemini(truncate_content(prompt, int(max_tokens * 0.7), model_name),
+                                     api_key, model_name, retries - 1, use_cache)
+        elif retries > 0:
+            # Igual que ask_gemini: el modelo de respaldo responde sin streaming
+            yield _gemini_fallback_answer(prompt, api_key, e)
+        else:
+            yield f"Error con el modelo {model_name}: {str(e)}"
+        return
+
+    answer = "".join(received)
+    if use_cache and answer:
+        response_cache.put(cache_key, "gemini", model_name, answer)
+    if not answer:
+        yield "No se obtuvo respuesta del modelo. Intenta con otro modelo."
+
+@llm_call("consulta", "local")
+def ask_local(prompt, api_key="local", model_name="mock-llm", retries=1, use_cache=True):
+    """Consulta el servidor local compatible con OpenAI de LOCAL_LLM_URL (no necesita API key)"""
+    api_key = api_key or "local"
+    cache_key, cached = cached_response("local", model_name, prompt, {"url": LOCAL_LLM_URL}, use_cache)
+    if cached is not None:
+        return cached
     
-    # Instrucciones más claras y concisas para modelos grandes
-    if model == "groq" and model_name == "llama-3.3-70b-versatile":
-        prompt = f"Analiza brevemente estos datos extraídos de una página web:\n\n{data_str}"
+    max_tokens = prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS["local"])
+    prompt = _fit_prompt(prompt, model_name, max_tokens)
+    try:
+        client = get_client("local", api_key)
+        response = call_with_rate_limit(
+            "local", key_fingerprint(api_key), model_name, request_tokens(prompt, model_name),
+            lambda: client.chat.completions.create(model=model_name, messages=[{"role": "user", "content": prompt}]),
+            usage_tokens=_openai_usage
+        )
+        record_usage(response)
+        answer = response.choices[0].message.content
+        if use_cache and answer:
+            response_cache.put(cache_key, "local", model_name, answer)
+        return answer
+    except Exception as e:
+        logger.error(f"Error en el servidor local ({LOCAL_LLM_URL}) con modelo {model_name}: {e}")
+        if is_rate_limit_error(e) or isinstance(e, TimeoutError):
+            return rate_limit_message("servidor local")
+        if _is_token_limit_error(e) and retries > 0:
+            return ask_local(truncate_content(prompt, int(max_tokens * 0.7), model_name), api_key, model_name,
+                             retries - 1, use_cache)
+        return f"Error con el servidor local (modelo {model_name}): {str(e)}"
+
+@llm_call("streaming", "local")
+def stream_local(prompt, api_key="local", model_name="mock-llm", retries=1, use_cache=True):
+    """Versión de ask_local que genera la respuesta por fragmentos a medida que llega"""
+    api_key = api_key or "local"
+    cache_key, cached = cached_response("local", model_name, prompt, {"url": LOCAL_LLM_URL}, use_cache)
+    if cached is not None:
+        yield cached
+        return
+    
+    max_tokens = prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS["local"])
+    yield from _stream_openai_compatible(
+        "local", get_client("local", api_key), _fit_prompt(prompt, model_name, max_tokens), api_key, model_name,
+        lambda text: [{"role": "user", "content": text}],
+        max_tokens, {"stream_options": {"include_usage": True}}, retries, use_cache, cache_key, "servidor local"
+    )
+
+def _make_async_client(model, api_key):
+    """
+    Cliente asíncrono de ChatGPT, Groq o el servidor local para las consultas simultáneas.
+    Se crea en cada consulta porque su pool de conexiones pertenece al bucle de eventos
+    (ask_providers crea uno nuevo cada vez) y se cierra al terminar.
+    """
+    timeout = httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+    if model == "groq":
+        return groq.AsyncGroq(api_key=api_key, timeout=timeout, max_retries=0)
+    base_url = LOCAL_LLM_URL if model == "local" else None
+    return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+
+async def _ask_openai_compatible_async(model, prompt, api_key, model_name, output_tokens):
+    """Consulta de ChatGPT, Groq o el servidor local con los mismos mensajes que ask_chatgpt, ask_groq y ask_local"""
+    provider = "openai" if model == "chatgpt" else model
+    messages = [{"role": "user", "content": prompt}]
+    if model == "chatgpt":
+        messages.insert(0, {"role": "system", "content": CHATGPT_SYSTEM_PROMPT})
+    options = {"max_tokens": output_tokens} if model_name == "llama-3.3-70b-versatile" else {}
+    async with _make_async_client(model, api_key) as client:
+        response = await call_with_rate_limit_async(
+            provider, key_fingerprint(api_key), model_name, request_tokens(prompt, model_name, output_tokens),
+            lambda: client.chat.completions.create(model=model_name, messages=messages, **options),
+            usage_tokens=_openai_usage
+        )
+    record_usage(response)
+    return response.choices[0].message.content
+
+async def _ask_gemini_async(prompt, api_key, model_name):
+    """Consulta de Gemini con generate_content_async y un cliente asíncrono propio de la key"""
+    model = get_gemini_model(api_key, model_name)
+    key_id, tokens = key_fingerprint(api_key), request_tokens(prompt, model_name)
+    if not (gemini_per_key_supported() and hasattr(model, "_async_client")):
+        # Sin cliente asíncrono por key la consulta se hace en un hilo y no se puede abortar
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(_fanout_executor, bind_current_call(lambda: call_with_rate_limit(
+            "gemini", key_id, model_name, tokens,
+            lambda: model.generate_content(prompt, request_options=gemini_request_options()),
+            usage_tokens=_gemini_usage
+        )))
+    else:
+        from google.ai import generativelanguage as glm
+        # Como el cliente síncrono (ver gemini_per_key_supported), se asigna al atributo interno del modelo
+        async with glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key}) as client:
+            model._async_client = client
+            response = await call_with_rate_limit_async(
+                "gemini", key_id, model_name, tokens,
+                lambda: model.generate_content_async(prompt, request_options=gemini_request_options()),
+                usage_tokens=_gemini_usage
+            )
+    record_usage(response)
+    return response.text
+
+@llm_call("consulta")
+async def ask_async(model, prompt, api_key, model_name, retries=1, use_cache=True):
+    """
+    Versión asíncrona de ask_chatgpt, ask_groq, ask_gemini y ask_local para las consultas simultáneas.
+    Usa los clientes asíncronos de cada SDK: al cancelar la tarea se aborta la petición HTTP y
+    no se guarda nada en la caché. Comparte con ask_* la caché, los límites de velocidad y los
+    mensajes de error.
+    """
+    label = PROVIDER_NAMES.get(model, model)
+    provider = "openai" if model == "chatgpt" else model
+    if model == "local":
+        api_key = api_key or "local"
+    elif not api_key:
+        return f"Por favor, ingresa tu {label} API Key en la configuración."
     else:
-        prompt = f"Analiza estos datos extraídos de una página web y proporciona un resumen útil e identifica patrones:\n\n{data_str}"
+        invalid_message = known_invalid_key(provider, api_key)
+        if invalid_message:
+            return invalid_message
     
-    # Verificar longitud del prompt y estimar tokens
-    estimated_tokens = estimate_tokens(prompt)
-    max_tokens = 0
+    output_tokens = groq_output_tokens(model_name) if model == "groq" else OUTPUT_TOKEN_RESERVE
+    cache_params = {"chatgpt": {"system": CHATGPT_SYSTEM_PROMPT}, "groq": {"max_tokens": output_tokens},
+                    "local": {"url": LOCAL_LLM_URL}}.get(model)
+    cache_key, cached = cached_response(provider, model_name, prompt, cache_params, use_cache)
+    if cached is not None:
+        return cached
     
-    if model == "chatgpt":
-        max_tokens = TOKEN_LIMITS.get(model_name, 4000)
-    elif model == "groq":
-        max_tokens = TOKEN_LIMITS.get(model_name, 8000)
-    elif model == "gemini":
-        max_tokens = TOKEN_LIMITS.get(model_name, 32000)
+    max_tokens = prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS[model], output_tokens)
+    prompt = _fit_prompt(prompt, model_name, max_tokens)
+    try:
+        if model == "gemini":
+            answer = await _ask_gemini_async(prompt, api_key, model_name)
+        else:
+            answer = await _ask_openai_compatible_async(model, prompt, api_key, model_name, output_tokens)
+    except Exception as e:
+        logger.error(f"Error en {label} con modelo {model_name}: {e}")
+        if is_auth_error(e):
+            return await asyncio.to_thread(auth_failure_message, provider, api_key, e)
+        if is_rate_limit_error(e) or isinstance(e, TimeoutError):
+            return rate_limit_message(label)
+        if _is_token_limit_error(e):
+            if retries > 0:
+                return await ask_async(model, truncate_content(prompt, int(max_tokens * 0.7), model_name), api_key,
+                                       model_name, retries - 1, use_cache)
+            return f"Error: El contenido es demasiado largo para el modelo {model_name}. Por favor, reduce la cantidad de datos o usa un modelo con mayor capacidad."
+        return f"Error con la API de {label} (modelo {model_name}): {str(e)}"
     
-    # Factor de seguridad especial para llama-3.3-70b-versatile
-    safety_factor = 0.65 if (model == "groq" and model_name == "llama-3.3-70b-versatile") else 0.85
+    if not answer:
+        return "No se obtuvo respuesta del modelo. Intenta con otro modelo."
+    if use_cache:
+        response_cache.put(cache_key, provider, model_name, answer)
+    return answer
+
+# Proveedores disponibles: {nombre: {"nombre", "consulta", "streaming", "consulta_async", "limite_tokens"}}.
+# Las funciones siguen la firma de ask_*/stream_* (prompt, api_key, model_name, retries, use_cache)
+# y devuelven los errores como texto (ver ERROR_RESPONSE_PREFIXES)
+PROVIDERS = {}
+
+def register_provider(name, label, ask, stream, token_limit, ask_async=None):
+    """
+    Añade (o sustituye) un proveedor para el análisis, las preguntas y las consultas simultáneas.
+    token_limit es el límite de tokens de los modelos que no aparecen en TOKEN_LIMITS.
+    ask_async es la versión corrutina de ask para las consultas simultáneas; sin ella,
+    ask se ejecuta en un hilo y una consulta cancelada no se puede abortar.
+    """
+    PROVIDERS[name] = {"nombre": label, "consulta": ask, "streaming": stream, "consulta_async": ask_async,
+                       "limite_tokens": token_limit}
+    PROVIDER_NAMES[name] = label
+    DEFAULT_TOKEN_LIMITS[name] = token_limit
+
+register_provider("chatgpt", "ChatGPT", ask_chatgpt, stream_chatgpt, DEFAULT_TOKEN_LIMITS["chatgpt"], partial(ask_async, "chatgpt"))
+register_provider("groq", "Groq", ask_groq, stream_groq, DEFAULT_TOKEN_LIMITS["groq"], partial(ask_async, "groq"))
+register_provider("gemini", "Gemini", ask_gemini, stream_gemini, DEFAULT_TOKEN_LIMITS["gemini"], partial(ask_async, "gemini"))
+register_provider("local", "Servidor local", ask_local, stream_local, 8192, partial(ask_async, "local"))
+
+def stream_answer(model, prompt, api_key, model_name, use_cache=True):
+    """Generador de la respuesta del proveedor indicado ("chatgpt", "groq", "gemini" o "local")"""
+    provider = PROVIDERS.get(model)
+    if provider is None:
+        return iter(["Modelo de IA no reconocido."])
+    return provider["streaming"](prompt, api_key, model_name, use_cache=use_cache)
+
+def analysis_token_budget(model, model_name):
+    """Tokens de prompt disponibles para un análisis con el proveedor y modelo dados"""
+    if model == "groq":
+        return prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS["groq"], groq_output_tokens(model_name))
+    return prompt_token_budget(model_name, DEFAULT_TOKEN_LIMITS.get(model, DEFAULT_TOKEN_LIMITS["chatgpt"]))
+
+def _ask_function(model):
+    """Función de consulta de cada proveedor"""
+    provider = PROVIDERS.get(model)
+    return provider["consulta"] if provider else None
+
+def is_error_response(answer):
+    """Indica si el texto devuelto por ask_* es un mensaje de error en lugar de una respuesta"""
+    return not answer or answer.startswith(ERROR_RESPONSE_PREFIXES)
+
+# Hilos para las consultas simultáneas de los proveedores sin consulta asíncrona: asyncio.run
+# no espera a que terminen, así una consulta descartada o fuera de tiempo no retrasa la respuesta
+_fanout_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai-fanout")
+
+async def _ask_provider(provider, prompt, api_key, model_name, timeout, use_cache):
+    """Consulta un proveedor y devuelve (proveedor, resultado) sin lanzar excepciones"""
+    ask_async = PROVIDERS[provider]["consulta_async"]
+    start = time.perf_counter()
+    result = {"modelo": model_name}
+    try:
+        if ask_async is not None:
+            request = ask_async(prompt, api_key, model_name, use_cache=use_cache)
+        else:
+            ask = _ask_function(provider)
+            request = asyncio.get_running_loop().run_in_executor(
+                _fanout_executor, lambda: ask(prompt, api_key, model_name, use_cache=use_cache))
+        answer = await asyncio.wait_for(request, timeout)
+        result.update(respuesta=answer, estado="error" if is_error_response(answer) else "ok")
+    except asyncio.TimeoutError:
+        result.update(respuesta=f"Error: {PROVIDER_NAMES.get(provider, provider)} no respondió en {timeout:g} s",
+                      estado="tiempo agotado")
+    except Exception as e:
+        result.update(respuesta=f"Error: {str(e)}", estado="error")
+    result["segundos"] = time.perf_counter() - start
+    return provider, result
+
+async def ask_providers_async(prompt, providers, mode="all", timeout=PROVIDER_TIMEOUT, use_cache=True):
+    """
+    Consulta varios proveedores en paralelo.
+    providers: {proveedor: (api_key, modelo)} o {proveedor: (api_key, modelo, timeout)}
+    mode: "all" espera todas las respuestas; "first" devuelve en cuanto llega la primera
+    respuesta válida y cancela el resto (quedan con estado "cancelado").
+    Retorna {proveedor: {"modelo", "respuesta", "estado", "segundos"}} en el orden de providers.
+    """
+    tasks = {}
+    for provider, config in providers.items():
+        if _ask_function(provider) is None:
+            continue
+        api_key, model_name = config[0], config[1]
+        provider_timeout = config[2] if len(config) > 2 else timeout
+        tasks[asyncio.create_task(
+            _ask_provider(provider, prompt, api_key, model_name, provider_timeout, use_cache))] = provider
+
+    results = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider, result = task.result()
+                results[provider] = result
+                if mode == "first" and result["estado"] == "ok":
+                    for loser in pending:
+                        loser.cancel()
+                        results[tasks[loser]] = {"modelo": providers[tasks[loser]][1], "respuesta": None,
+                                                 "estado": "cancelado", "segundos": result["segundos"]}
+                    # Esperar a que las consultas canceladas aborten sus peticiones y cierren sus clientes
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    pending = set()
+                    break
+    finally:
+        for task in pending:
+            task.cancel()
+    return {provider: results[provider] for provider in providers if provider in results}
+
+def ask_providers(prompt, providers, mode="all", timeout=PROVIDER_TIMEOUT, use_cache=True):
+    """Versión síncrona de ask_providers_async para usar desde Streamlit"""
+    return asyncio.run(ask_providers_async(prompt, providers, mode, timeout, use_cache))
+
+def encode_rows_within_budget(data, token_budget, model_name=None, output_format=DEFAULT_FORMAT, row_limit=None,
+                              order=None):
+    """
+    Serializa en formato compacto las primeras filas del DataFrame (o las primeras según order,
+    una lista de posiciones) que caben en token_budget.
+    Retorna (texto, número de filas incluidas).
+    """
+    columns = prompt_columns(data)
+    source = data.iloc[order] if order is not None else data
+    if row_limit:
+        source = source.head(row_limit)
+    used = estimate_tokens("\t".join(columns), model_name) + 1
+    selected = []
+    for row in iter_clean_rows(source, columns):
+        tokens = estimate_tokens("\t".join(row), model_name) + 1
+        if selected and used + tokens > token_budget:
+            break
+        selected.append(row)
+        used += tokens
+    text = encode_rows(columns, selected, output_format)
+    if estimate_tokens(text, model_name) > token_budget:
+        text = truncate_content(text, token_budget, model_name)
+    return text, len(selected)
+
+def chunk_dataframe(data, token_budget, model_name=None, output_format=DEFAULT_FORMAT):
+    """
+    Divide un DataFrame en fragmentos cuya representación compacta cabe en token_budget.
+    Se agrupan filas según sus tokens estimados y cada fragmento se vuelve a dividir
+    si al serializarlo supera el presupuesto.
+    Retorna una lista de (número de filas, texto).
+    """
+    columns = prompt_columns(data)
+    rows = list(iter_clean_rows(data, columns))
+    row_tokens = [estimate_tokens("\t".join(row), model_name) + 1 for row in rows]
+    header_tokens = estimate_tokens("\t".join(columns), model_name) + 1
+
+    chunks = []
+
+    def add_chunk(start, end):
+        text = encode_rows(columns, rows[start:end], output_format)
+        if end - start > 1 and estimate_tokens(text, model_name) > token_budget:
+            middle = (start + end) // 2
+            add_chunk(start, middle)
+            add_chunk(middle, end)
+            return
+        if end - start == 1:
+            # Una fila que por sí sola no cabe se recorta
+            text = truncate_content(text, token_budget, model_name)
+        chunks.append((end - start, text))
+
+    start = 0
+    used = header_tokens
+    for i, tokens in enumerate(row_tokens):
+        if i > start and used + tokens > token_budget:
+            add_chunk(start, i)
+            start, used = i, header_tokens
+        used += tokens
+    if start < len(row_tokens):
+        add_chunk(start, len(row_tokens))
+    return chunks
+
+def _run_prompts(ask, prompts, api_key, model_name, workers, use_cache, progress=None):
+    """Ejecuta varias consultas con como máximo `workers` en vuelo y devuelve las respuestas en orden"""
+    answers = [None] * len(prompts)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # Las métricas de cada consulta se suman también al análisis en curso
+        ask = bind_current_call(ask)
+        futures = {executor.submit(ask, prompt, api_key, model_name, use_cache=use_cache): i
+                   for i, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                answers[i] = future.result()
+            except Exception as e:
+                answers[i] = f"Error: {str(e)}"
+            if progress:
+                progress()
+    return answers
+
+@llm_call("análisis")
+def map_reduce_analysis(data, api_key, model="groq", model_name="llama-3.3-70b-versatile",
+                        workers=ANALYSIS_WORKERS, use_cache=True, progress=None, output_format=DEFAULT_FORMAT):
+    """
+    Analiza todas las filas de un DataFrame: resume en paralelo fragmentos que caben en el límite
+    de tokens del modelo (map) y combina los resúmenes parciales en un único análisis (reduce).
+    Si los resúmenes no caben en una consulta se combinan por grupos hasta que quepan.
+    progress, si se indica, recibe (consultas terminadas, consultas previstas) tras cada consulta.
+    """
+    ask = _ask_function(model)
+    if ask is None:
+        return "Modelo de IA no reconocido."
+
+    # Sin API key cada ask_* devuelve su aviso sin llamar a la API (el servidor local no la necesita)
+    budget = analysis_token_budget(model, model_name)
+    map_budget = budget - estimate_tokens(MAP_PROMPT.format(part=0, total=0, data=""), model_name)
+    chunks = chunk_dataframe(data, map_budget, model_name, output_format)
+    # Una sola consulta basta: el análisis normal ya incluye todos los datos
+    # (sin su registro de métricas, que sería un segundo análisis dentro de este)
+    if len(chunks) == 1:
+        return analyze_scraped_data.__wrapped__(data, api_key, model, model_name, use_cache=use_cache, output_format=output_format)
+
+    logger.info(f"Análisis map-reduce: {len(data)} filas en {len(chunks)} fragmentos con {workers} consultas en paralelo")
+    state = {"done": 0, "total": len(chunks) + 1}
+
+    def step():
+        state["done"] += 1
+        if progress:
+            progress(state["done"], state["total"])
+
+    prompts = [MAP_PROMPT.format(part=i + 1, total=len(chunks), data=text) for i, (_, text) in enumerate(chunks)]
+    answers = _run_prompts(ask, prompts, api_key, model_name, workers, use_cache, step)
+
+    summaries = [answer for answer in answers if not is_error_response(answer)]
+    if not summaries:
+        return answers[0]
+    covered_rows = sum(rows for (rows, _), answer in zip(chunks, answers) if not is_error_response(answer))
+    failed = len(answers) - len(summaries)
+    if failed:
+        logger.warning(f"{failed} de {len(chunks)} fragmentos no se pudieron resumir")
+
+    reduce_budget = budget - estimate_tokens(REDUCE_PROMPT.format(total=0, rows=0, summaries=""), model_name)
+    while len(summaries) > 1 and estimate_tokens("\n\n".join(summaries), model_name) > reduce_budget:
+        # Agrupar los resúmenes en consultas que quepan y combinarlos en paralelo
+        groups, current, used = [], [], 0
+        for summary in summaries:
+            tokens = estimate_tokens(summary, model_name) + 2
+            if current and used + tokens > reduce_budget:
+                groups.append(current)
+                current, used = [], 0
+            current.append(summary)
+            used += tokens
+        groups.append(current)
+        if len(groups) == len(summaries):
+            break
+        state["total"] += len(groups)
+        combined = _run_prompts(ask, [COMBINE_PROMPT.format(summaries="\n\n".join(group)) for group in groups],
+                                api_key, model_name, workers, use_cache, step)
+        summaries = [answer if not is_error_response(answer) else "\n\n".join(group)
+                     for answer, group in zip(combined, groups)]
+
+    prompt = REDUCE_PROMPT.format(total=len(chunks), rows=covered_rows, summaries="\n\n".join(
+        f"Fragmento {i + 1}:\n{summary}" for i, summary in enumerate(summaries)))
+    prompt = truncate_content(prompt, budget, model_name)
+    analysis = ask(prompt, api_key, model_name, use_cache=use_cache)
+    step()
+
+    if failed and not is_error_response(analysis):
+        analysis = f"⚠️ {failed} de {len(chunks)} fragmentos no se pudieron analizar; el análisis cubre {covered_rows} de {len(data)} filas.\n\n" + analysis
+    return analysis
+
+def _analysis_instructions(model, model_name):
+    """Instrucciones del análisis: más claras y concisas para modelos grandes"""
+    if model == "groq" and model_name == "llama-3.3-70b-versatile":
+        return "Analiza brevemente estos datos extraídos de una página web:"
+    return "Analiza estos datos extraídos de una página web y proporciona un resumen útil e identifica patrones:"
+
+def build_analysis_prompt(data, model="groq", model_name="llama-3.3-70b-versatile", row_limit=None,
+                          output_format=DEFAULT_FORMAT):
+    """
+    Prompt de análisis con tantas filas como quepan en el límite de tokens del modelo.
+    Los datos se serializan en formato compacto (sin HTML ni relleno de columnas);
+    row_limit limita además el número de filas.
+    """
+    instructions = _analysis_instructions(model, model_name)
+    max_tokens = analysis_token_budget(model, model_name)
+    
+    try:
+        data_budget = max_tokens - estimate_tokens(instructions, model_name) - 2
+        data_str, rows = encode_rows_within_budget(data, data_budget, model_name, output_format, row_limit)
+        logger.info(f"Datos a analizar: {rows} de {len(data)} filas, ~{estimate_tokens(data_str, model_name)} tokens")
+        annotate(truncado=rows < len(data))
+    except Exception:
+        data_str = str(data)
+    
+    prompt = f"{instructions}\n\n{data_str}"
     
     # Advertir si el prompt es muy largo
-    if estimated_tokens > max_tokens * safety_factor:
+    estimated_tokens = estimate_tokens(prompt, model_name)
+    annotate(tokens_estimados=estimated_tokens)
+    if estimated_tokens > max_tokens:
         logger.warning(f"Datos para analizar demasiado grandes: ~{estimated_tokens} tokens. " +
                       f"Truncando para el modelo {model_name} (límite ~{max_tokens})...")
         
-        prompt = truncate_content(prompt, int(max_tokens * safety_factor))
-        new_estimate = estimate_tokens(prompt)
+        prompt = truncate_content(prompt, max_tokens, model_name)
+        new_estimate = estimate_tokens(prompt, model_name)
         logger.info(f"Prompt truncado a ~{new_estimate} tokens")
-        
+        annotate(truncado=True)
+    
+    return prompt
+
+def analysis_token_report(data, model="groq", model_name="llama-3.3-70b-versatile", output_format=DEFAULT_FORMAT):
+    """
+    Filas y tokens del prompt de análisis comparados con la tabla de pandas (to_string)
+    de las mismas filas, que era el formato anterior.
+    """
+    data_budget = analysis_token_budget(model, model_name) - estimate_tokens(_analysis_instructions(model, model_name), model_name) - 2
+    data_str, rows = encode_rows_within_budget(data, data_budget, model_name, output_format)
+    tokens = estimate_tokens(data_str, model_name)
+    table_tokens = estimate_tokens(data.head(rows).to_string(), model_name) if rows else 0
+    return {
+        "filas": rows,
+        "filas_totales": len(data),
+        "tokens": tokens,
+        "tokens_tabla": table_tokens,
+        "ahorro": 1 - tokens / table_tokens if table_tokens else 0.0
+    }
+
+@llm_call("análisis")
+def analyze_scraped_data(data, api_key, model="groq", model_name="llama-3.3-70b-versatile", use_cache=True,
+                         row_limit=None, output_format=DEFAULT_FORMAT):
+    """Analyze scraped data using AI with selected model"""
+    if isinstance(data, pd.DataFrame) and data.empty:
+        return "No hay datos para analizar."
+    
+    prompt = build_analysis_prompt(data, model, model_name, row_limit, output_format)
+    
     # Realizar el análisis con el modelo seleccionado
-    if model == "chatgpt":
-        return ask_chatgpt(prompt, api_key, model_name)
-    elif model == "groq":
-        return ask_groq(prompt, api_key, model_name)
-    elif model == "gemini":
-        return ask_gemini(prompt, api_key, model_name)
-    else:
+    ask = _ask_function(model)
+    if ask is None:
+        return "Modelo de IA no reconocido."
+    return ask(prompt, api_key, model_name, use_cache=use_cache)
+
+@llm_call("análisis")
+def stream_analysis(data, api_key, model="groq", model_name="llama-3.3-70b-versatile", use_cache=True, row_limit=None,
+                    output_format=DEFAULT_FORMAT):
+    """Versión de analyze_scraped_data que genera el análisis por fragmentos a medida que llega"""
+    if isinstance(data, pd.DataFrame) and data.empty:
+        yield "No hay datos para analizar."
+        return
+    yield from stream_answer(model, build_analysis_prompt(data, model, model_name, row_limit, output_format),
+                             api_key, model_name, use_cache)
+
+def build_question_prompt(data, question, model="groq", model_name="llama-3.3-70b-versatile",
+                          output_format=DEFAULT_FORMAT):
+    """
+    Prompt para responder una pregunta sobre los datos extraídos.
+    Las filas se ordenan por relevancia (BM25 sobre Contenido, sin llamadas a la API) y se incluyen
+    las más relevantes que caben en el límite de tokens del modelo.
+    Retorna (prompt, filas incluidas).
+    """
+    instructions = QUESTION_PROMPT.format(question=question.strip())
+    data_budget = analysis_token_budget(model, model_name) - estimate_tokens(instructions, model_name) - 2
+    order = rank_rows(data, question)
+    data_str, rows = encode_rows_within_budget(data, data_budget, model_name, output_format, order=order)
+    logger.info(f"Pregunta sobre los datos: {rows} de {len(data)} filas más relevantes, "
+                f"~{estimate_tokens(data_str, model_name)} tokens")
+    return f"{instructions}\n\n{data_str}", rows
+
+def ask_about_data(data, question, api_key, model="groq", model_name="llama-3.3-70b-versatile", use_cache=True,
+                   output_format=DEFAULT_FORMAT):
+    """Responde una pregunta sobre los datos extraídos con las filas más relevantes"""
+    if isinstance(data, pd.DataFrame) and data.empty:
+        return "No hay datos para analizar."
+    ask = _ask_function(model)
+    if ask is None:
         return "Modelo de IA no reconocido."
+    prompt, _ = build_question_prompt(data, question, model, model_name, output_format)
+    return ask(prompt, api_key, model_name, use_cache=use_cache)
@@ -1,67 +1,434 @@
+import copy
 import requests
 from bs4 import BeautifulSoup
+from bs4.element import Tag, NavigableString, CData
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urldefrag
+from dataclasses import dataclass, field
+from time import perf_counter
+from math import log1p
 import re
+import soupsieve
+from utils.selector_store import domain_key, load_domain_spec, save_domain_spec
+from utils.layout_cache import layout_cache, layout_fingerprint
+from utils.templates import get_all_templates
 
-def detect_page_type(soup):
-    """
-    Detecta el tipo de página basado en su estructura HTML
-    """
+# Presupuesto por defecto de la autodetección: bytes analizados, nodos recorridos y tiempo total
+DETECTION_MAX_BYTES = 2_000_000
+DETECTION_MAX_NODES = 150_000
+DETECTION_TIME_LIMIT = 10.0
+# Como máximo se descargan este múltiplo de max_bytes antes de muestrear
+DOWNLOAD_LIMIT_FACTOR = 4
+# Velocidad conservadora de parseo (bytes/s) para ajustar la muestra al tiempo que queda;
+# el parseo no se puede interrumpir, así que se le reserva la mitad del tiempo restante
+PARSE_BYTES_PER_SECOND = 2_000_000
+MIN_SAMPLE_BYTES = 64 * 1024
+
+# Validación de selectores: muestra para medir el contenido, umbrales de poda y de redundancia
+VALIDATION_SAMPLE_SIZE = 50
+MAX_SELECTOR_MATCHES = 10_000
+MAX_SELECTOR_SHARE = 0.25
+# La proporción máxima solo se aplica a partir de este número de coincidencias (documentos pequeños)
+MIN_EXCESSIVE_MATCHES = 100
+MIN_CONTENT_RATIO = 0.2
+REDUNDANT_JACCARD = 0.9
+
+# Peso en la puntuación de plantillas de un selector de solo etiqueta (table, li) frente a uno con clase o ID
+BARE_SELECTOR_WEIGHT = 0.25
+
+# Aprendizaje por dominio: páginas analizadas, hilos y fracción de páginas en que debe funcionar un selector
+LEARNING_SAMPLE_SIZE = 5
+LEARNING_WORKERS = 4
+STABLE_SELECTOR_SHARE = 0.6
+LINK_PATTERN = re.compile(rb'<a\b[^>]*?\bhref\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))', re.IGNORECASE)
+
+# Indicadores de palabras clave por tipo de página
+PAGE_TYPE_INDICATORS = {
     # Detección de e-commerce
-    ecommerce_indicators = [
+    "ecommerce": [
         'cart', 'basket', 'shop', 'product', 'price', 'checkout', 'add-to-cart',
         'buy', 'purchase', 'shopping', 'store', 'order', 'payment'
-    ]
-    
+    ],
     # Detección de blog/noticias
-    news_indicators = [
+    "news": [
         'article', 'blog', 'news', 'post', 'author', 'date', 'published',
         'editorial', 'journalist', 'reporter', 'story', 'opinion'
-    ]
-    
+    ],
     # Detección de páginas con tablas de datos
-    table_indicators = ['table', 'data', 'statistics', 'chart', 'dataset']
+    "data": ['table', 'data', 'statistics', 'chart', 'dataset']
+}
+
+class IndicatorMatcher:
+    """
+    Cuenta muchas palabras clave en una sola pasada sobre flujos de texto.
+    Usa una única alternancia compilada (en forma de trie) y produce los mismos conteos que
+    str.count por indicador sobre el texto concatenado, sin construir ese texto.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, indicators):
+        self.indicators = list(dict.fromkeys(indicators))
+        # Los más largos primero para que la alternancia elija la coincidencia más larga
+        self._pattern = re.compile(self._trie_pattern(self.indicators))
+        self._max_len = max(len(ind) for ind in self.indicators)
+        
+        # Indicadores que pueden solaparse consigo mismos (p. ej. "statistics" empieza y termina en "s");
+        # str.count no cuenta esos solapamientos, así que se controla la posición final de cada uno
+        self._self_overlapping = {
+            ind for ind in self.indicators
+            if any(ind[:k] == ind[-k:] for k in range(1, len(ind)))
+        }
+        
+        # Para cada texto que puede devolver la alternancia, las otras apariciones que empiezan dentro:
+        # - contenidas por completo y sin autosolapamiento: se suman al final según las coincidencias
+        # - el resto (continúan más allá del final o requieren controlar posiciones) se verifica en el recorrido
+        self._contained = {}
+        self._checks = {}
+        self._next_chars = {}
+        self._positional = set(self._self_overlapping)
+        for match in self.indicators:
+            contained = Counter()
+            checks = []
+            next_chars = set()
+            for k in range(len(match)):
+                for ind in self.indicators:
+                    if k == 0 and ind == match:
+                        continue
+                    if match.startswith(ind, k):
+                        if ind in self._self_overlapping:
+                            checks.append((k, ind, False))
+                            self._positional.add(match)
+                        else:
+                            contained[ind] += 1
+                    elif k > 0 and len(ind) > len(match) - k and ind.startswith(match[k:]):
+                        checks.append((k, ind, True))
+                        # Carácter que debe seguir a la coincidencia para que este indicador continúe
+                        next_chars.add(ind[len(match) - k])
+            self._contained[match] = contained
+            self._checks[match] = checks
+            self._next_chars[match] = next_chars
     
-    # Contadores de indicadores
-    ecommerce_count = 0
-    news_count = 0
-    table_count = 0
+    @staticmethod
+    def _trie_pattern(words):
+        """
+        Construye una alternancia factorizada por prefijos (trie) que siempre elige la palabra más larga.
+        En cada posición solo se explora la rama del primer carácter, lo que la hace mucho más rápida
+        que una alternancia plana.
+        """
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        
+        def build(node):
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            # Si una palabra termina aquí, el resto es opcional (y codicioso: prefiere la más larga)
+            return f"(?:{body})?" if "" in node else body
+        
+        return build(trie)
     
-    # Buscar en clases, IDs y texto
-    page_text = soup.text.lower()
-    all_attributes = []
+    def scanner(self):
+        """Crea un escaneo incremental al que se le van pasando fragmentos con feed()"""
+        return IndicatorScan(self)
     
-    for tag in soup.find_all():
-        if tag.attrs:
-            for attr, val in tag.attrs.items():
-                if isinstance(val, str):
-                    all_attributes.append(val.lower())
-                elif isinstance(val, list):
-                    all_attributes.extend([v.lower() for v in val if isinstance(v, str)])
+    def count(self, chunks):
+        """
+        Cuenta los indicadores en una secuencia de fragmentos tratados como texto continuo.
+        Retorna un Counter {indicador: apariciones}.
+        """
+        scan = self.scanner()
+        for chunk in chunks:
+            scan.feed(chunk)
+        return scan.finish()
+
+class IndicatorScan:
+    """
+    Estado de un escaneo incremental de IndicatorMatcher.
+    Los fragmentos se acumulan en búferes acotados; entre búferes se conserva una cola
+    para no perder coincidencias que crucen el límite.
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.counts = Counter()
+        self._hits = Counter()
+        self._last_end = {}
+        self._pending = []
+        self._pending_len = 0
+        self._carry = ""
+        self._base = 0
     
-    # Combinar todo el texto y atributos para análisis
-    all_text = " ".join(all_attributes) + " " + page_text
+    def feed(self, chunk):
+        """Añade un fragmento de texto contiguo al anterior"""
+        self._pending.append(chunk)
+        self._pending_len += len(chunk)
+        if self._pending_len >= self.matcher.CHUNK_SIZE:
+            buffer = self._carry + "".join(self._pending)
+            self._pending, self._pending_len = [], 0
+            consumed = self._scan(buffer, final=False)
+            self._carry = buffer[consumed:]
+            self._base += consumed
     
-    # Contar indicadores
-    for indicator in ecommerce_indicators:
-        ecommerce_count += all_text.count(indicator)
+    def finish(self):
+        """Procesa lo pendiente y retorna el Counter {indicador: apariciones}"""
+        self._scan(self._carry + "".join(self._pending), final=True)
+        self._pending, self._pending_len, self._carry = [], 0, ""
+        
+        # Sumar las coincidencias directas y los indicadores contenidos en ellas
+        matcher = self.matcher
+        for text, amount in self._hits.items():
+            if text not in matcher._self_overlapping:
+                self.counts[text] += amount
+            for ind, contained in matcher._contained[text].items():
+                self.counts[ind] += contained * amount
+        self._hits = Counter()
+        return self.counts
     
-    for indicator in news_indicators:
-        news_count += all_text.count(indicator)
+    def _record(self, ind, position):
+        # str.count no cuenta apariciones solapadas del mismo indicador
+        if ind not in self.matcher._self_overlapping:
+            self.counts[ind] += 1
+        elif position >= self._last_end.get(ind, 0):
+            self.counts[ind] += 1
+            self._last_end[ind] = position + len(ind)
+    
+    def _scan(self, buffer, final):
+        matcher = self.matcher
+        self_overlapping = matcher._self_overlapping
+        positional = matcher._positional
+        checks = matcher._checks
+        next_chars = matcher._next_chars
+        hits = self._hits
+        base = self._base
         
-    for indicator in table_indicators:
-        table_count += all_text.count(indicator)
+        # Margen para que toda coincidencia aceptada y sus verificaciones quepan en el búfer
+        cut = len(buffer) if final else len(buffer) - 2 * matcher._max_len
+        resume = 0
+        for m in matcher._pattern.finditer(buffer):
+            start = m.start()
+            if start >= cut:
+                break
+            text = m[0]
+            end = m.end()
+            hits[text] += 1
+            if text in positional:
+                if text in self_overlapping:
+                    self._record(text, base + start)
+                pending_checks = checks[text]
+            elif buffer[end:end + 1] in next_chars[text]:
+                pending_checks = checks[text]
+            else:
+                pending_checks = ()
+            for k, ind, partial in pending_checks:
+                if not partial or buffer.startswith(ind, start + k):
+                    self._record(ind, base + start + k)
+            resume = end
+        return max(cut, resume)
+
+_page_type_matcher = IndicatorMatcher(
+    [ind for indicators in PAGE_TYPE_INDICATORS.values() for ind in indicators]
+)
+
+# Patrones de clases que se buscan durante el recorrido único del documento
+CLASS_PATTERNS = {
+    "product": re.compile(r'product|item'),
+    "listing": re.compile(r'product|item|card'),
+    "price": re.compile(r'price|cost|amount')
+}
+
+# Parámetros de la detección de estructuras repetidas (listados)
+MIN_REPEATS = 3
+MIN_STRUCTURE_COVERAGE = 0.02
+FIELD_PRESENCE = 0.6
+MAX_STRUCTURE_FIELDS = 6
+STRUCTURE_SAMPLE_SIZE = 30
+# Etiquetas que no cuentan como elementos de un listado ni como campos
+IGNORED_ITEM_TAGS = {"script", "style", "noscript", "template", "br", "hr", "wbr", "meta", "link",
+                     "option", "optgroup", "source", "track", "param",
+                     "path", "g", "use", "circle", "rect", "polygon", "polyline", "line", "defs"}
+# Clases que cambian de un elemento a otro (item-3, product-1234) y no describen la estructura
+VOLATILE_CLASS = re.compile(r'\d')
+
+@dataclass
+class DocumentStats:
+    """Estadísticas del documento reunidas en un solo recorrido del árbol"""
+    node_count: int = 0
+    # Caracteres de texto visible (sin espacios de los extremos de cada cadena)
+    text_length: int = 0
+    # Apariciones de cada etiqueta
+    tag_counts: Counter = field(default_factory=Counter)
+    # Apariciones de "etiqueta.clase", en orden de documento para desempatar
+    class_counts: Counter = field(default_factory=Counter)
+    # Indicadores de palabras clave por tipo de página (atributos y texto)
+    indicator_counts: dict = field(default_factory=dict)
+    # Elementos cuya clase coincide con cada patrón de CLASS_PATTERNS: [(etiqueta, [clases]), ...]
+    class_hits: dict = field(default_factory=lambda: {name: [] for name in CLASS_PATTERNS})
+    # Hermanos que comparten firma estructural: {firma: [(elemento, longitud de texto, nodos), ...]}
+    repeated_groups: dict = field(default_factory=dict)
+    # True si el recorrido se detuvo por el presupuesto de nodos o de tiempo
+    truncated: bool = False
+
+def _string_types(soup):
+    """Tipos de cadenas que cuenta soup.text (texto visible, sin comentarios)"""
+    types = getattr(soup, "interesting_string_types", None)
+    return types or (NavigableString, CData)
+
+def _stable_classes(classes):
+    """Clases ordenadas que describen la estructura, sin las que llevan números"""
+    return tuple(sorted(cls for cls in classes if not VOLATILE_CLASS.search(cls)))
+
+def _record_repeated_siblings(children, repeated_groups):
+    """Agrupa los hijos de un elemento por firma y guarda los grupos que se repiten"""
+    by_signature = {}
+    for child in children:
+        by_signature.setdefault(child[1], []).append(child)
+    for signature, group in by_signature.items():
+        if len(group) >= MIN_REPEATS and group[0][0].name not in IGNORED_ITEM_TAGS:
+            repeated_groups.setdefault(signature, []).extend(
+                (elem, text_length, nodes) for elem, _, text_length, nodes in group
+            )
+
+def collect_document_stats(soup, max_nodes=None, deadline=None):
+    """
+    Recorre el árbol una sola vez y reúne todo lo que necesitan detect_page_type y suggest_selectors:
+    conteos de etiquetas y clases, indicadores de palabras clave, coincidencias de patrones de clase
+    y grupos de hermanos con la misma firma estructural.
+    
+    La firma de cada subárbol (etiqueta + clases + conjunto de firmas de sus hijos) se calcula
+    de abajo hacia arriba con una pila explícita, en tiempo lineal y sin recursión.
+    
+    Con max_nodes o deadline (instante de perf_counter) el recorrido se detiene al agotar el
+    presupuesto: los subárboles abiertos se cierran con lo visto hasta entonces y stats.truncated queda en True.
+    """
+    stats = DocumentStats()
+    tag_counts = stats.tag_counts
+    class_counts = stats.class_counts
+    class_hits = stats.class_hits
+    repeated_groups = stats.repeated_groups
+    string_types = _string_types(soup)
+    single_type = isinstance(string_types, type)
+    
+    # Los atributos y el texto son flujos independientes: ningún indicador contiene espacios,
+    # por lo que no puede haber coincidencias entre un atributo y el texto
+    attribute_scan = _page_type_matcher.scanner()
+    text_scan = _page_type_matcher.scanner()
+    
+    # Cada marco: [elemento, iterador de hijos, hijos ya cerrados, longitud de texto, nodos, clases estables]
+    # Los hijos cerrados se guardan como (elemento, firma, longitud de texto, nodos)
+    stack = [[soup, iter(soup.contents), [], 0, 0, ()]]
+    stopped = False
+    while stack:
+        frame = stack[-1]
+        # Agotado el presupuesto, los marcos restantes se cierran sin visitar más hijos
+        node = None if stopped else next(frame[1], None)
+        
+        if node is None:
+            # Todos los hijos procesados: cerrar el subárbol y calcular su firma
+            stack.pop()
+            elem, _, children, text_length, nodes, stable = frame
+            if len(children) >= MIN_REPEATS:
+                _record_repeated_siblings(children, repeated_groups)
+            if stack:
+                parent = stack[-1]
+                signature = hash((elem.name, stable, frozenset(child[1] for child in children)))
+                parent[2].append((elem, signature, text_length, nodes))
+                parent[3] += text_length
+                parent[4] += nodes
+            continue
+        
+        if isinstance(node, Tag):
+            stats.node_count += 1
+            # El reloj se consulta cada 1024 nodos para no penalizar el recorrido
+            if (max_nodes and stats.node_count >= max_nodes) or (
+                deadline and stats.node_count & 1023 == 0 and perf_counter() >= deadline
+            ):
+                stopped = stats.truncated = True
+            name = node.name
+            tag_counts[name] += 1
+            stable = ()
+            
+            if node.attrs:
+                values = []
+                for attr, val in node.attrs.items():
+                    if isinstance(val, str):
+                        values.append(val)
+                    elif isinstance(val, list):
+                        values.extend(v for v in val if isinstance(v, str))
+                if values:
+                    attribute_scan.feed(" ".join(values).lower() + " ")
+                
+                classes = node.attrs.get('class')
+                if classes:
+                    if isinstance(classes, str):
+                        classes = classes.split()
+                    for cls in classes:
+                        class_counts[f"{name}.{cls}"] += 1
+                    for pattern_name, pattern in CLASS_PATTERNS.items():
+                        if any(pattern.search(cls) for cls in classes):
+                            class_hits[pattern_name].append((name, classes))
+                    stable = _stable_classes(classes)
+            
+            stack.append([node, iter(node.contents), [], 0, 1, stable])
+        
+        elif type(node) is string_types if single_type else type(node) in string_types:
+            text_scan.feed(node.lower())
+            text_length = len(node.strip())
+            frame[3] += text_length
+            stats.text_length += text_length
+    
+    counts = attribute_scan.finish()
+    counts.update(text_scan.finish())
+    stats.indicator_counts = {
+        page_type: sum(counts[ind] for ind in indicators)
+        for page_type, indicators in PAGE_TYPE_INDICATORS.items()
+    }
+    return stats
+
+def count_indicators(soup):
+    """
+    Cuenta los indicadores de cada tipo de página en atributos y texto con una sola pasada.
+    Retorna {"ecommerce": n, "news": n, "data": n}.
+    """
+    return collect_document_stats(soup).indicator_counts
+
+def score_page_types(stats):
+    """Puntuación de cada tipo de página: indicadores más etiquetas y clases características con peso"""
+    # Contadores de indicadores en clases, IDs y texto
+    ecommerce_count = stats.indicator_counts["ecommerce"]
+    news_count = stats.indicator_counts["news"]
+    table_count = stats.indicator_counts["data"]
         
     # Contar etiquetas específicas
-    table_tags = len(soup.find_all('table'))
-    article_tags = len(soup.find_all('article'))
-    product_elements = len(soup.find_all(class_=re.compile(r'product|item')))
+    table_tags = stats.tag_counts['table']
+    article_tags = stats.tag_counts['article']
+    product_elements = len(stats.class_hits['product'])
     
     # Ajustar contadores con factores de peso
     table_count += table_tags * 5
     news_count += article_tags * 5
     ecommerce_count += product_elements * 5
     
+    return {"ecommerce": ecommerce_count, "news": news_count, "data": table_count}
+
+def detect_page_type(soup, stats=None):
+    """
+    Detecta el tipo de página basado en su estructura HTML
+    """
+    if stats is None:
+        stats = collect_document_stats(soup)
+    
+    scores = score_page_types(stats)
+    ecommerce_count = scores["ecommerce"]
+    news_count = scores["news"]
+    table_count = scores["data"]
+    
     # Determinar tipo de página
     if ecommerce_count > news_count and ecommerce_count > table_count:
         return "ecommerce"
@@ -72,46 +439,147 @@ def detect_page_type(soup):
     else:
         return "general"
 
-def suggest_selectors(soup, page_type="general"):
+def detection_confidence(stats, coverage=1.0):
+    """
+    Confianza de la detección (0-1): la ventaja del tipo ganador sobre el segundo,
+    multiplicada por la fracción del documento analizada.
+    Sin ningún indicador la página es claramente "general" y la ventaja cuenta como completa.
+    """
+    top, second = sorted(score_page_types(stats).values(), reverse=True)[:2]
+    margin = (top - second) / top if top else 1.0
+    return round(max(0.0, min(1.0, coverage)) * margin, 2)
+
+def _class_selector(tag_name, classes):
+    """Selector CSS etiqueta.clase1.clase2 a partir de la lista de clases"""
+    class_names = " ".join(classes)
+    return f"{tag_name}.{class_names.replace(' ', '.')}"
+
+def _item_selector(elem):
+    """Selector de un elemento de listado: sus clases estables o, si no tiene, su padre > etiqueta"""
+    stable = _stable_classes(elem.get('class') or [])
+    if stable:
+        return _class_selector(elem.name, stable)
+    parent = elem.parent
+    if parent is None or parent.name in ("[document]", "html", "body"):
+        return elem.name
+    parent_classes = _stable_classes(parent.get('class') or [])
+    parent_selector = _class_selector(parent.name, parent_classes) if parent_classes else parent.name
+    return f"{parent_selector} > {elem.name}"
+
+def _has_own_text(elem):
+    """Indica si el elemento tiene texto propio (no solo el de sus descendientes)"""
+    return any(isinstance(child, NavigableString) and child.strip() for child in elem.contents)
+
+def _structure_fields(items):
+    """
+    Campos de un listado: selectores relativos de los descendientes con texto, imagen o enlace
+    presentes en al menos FIELD_PRESENCE de una muestra de elementos, en orden de documento.
+    """
+    step = max(1, len(items) // STRUCTURE_SAMPLE_SIZE)
+    sample = items[::step][:STRUCTURE_SAMPLE_SIZE]
+    presence = Counter()
+    order = {}
+    for elem in sample:
+        seen = set()
+        for desc in elem.descendants:
+            if not isinstance(desc, Tag) or desc.name in IGNORED_ITEM_TAGS:
+                continue
+            if desc.name not in ("img", "a") and not _has_own_text(desc):
+                continue
+            stable = _stable_classes(desc.get('class') or [])
+            key = _class_selector(desc.name, stable) if stable else desc.name
+            if key not in seen:
+                seen.add(key)
+                presence[key] += 1
+                order.setdefault(key, len(order))
+    
+    minimum = FIELD_PRESENCE * len(sample)
+    fields = [key for key in sorted(presence, key=order.get) if presence[key] >= minimum]
+    return fields[:MAX_STRUCTURE_FIELDS]
+
+def find_repeated_structures(stats, limit=5):
+    """
+    Ordena los grupos de hermanos con la misma firma (elementos de listado) por cobertura:
+    la media de la fracción del texto y de los nodos del documento que ocupan.
+    Descarta los grupos anidados dentro de un listado ya elegido (celdas de una fila, etc.).
+    Retorna [{"container", "items", "coverage", "fields"}, ...].
+    """
+    total_text = max(stats.text_length, 1)
+    total_nodes = max(stats.node_count, 1)
+    
+    candidates = []
+    for items in stats.repeated_groups.values():
+        text_length = sum(item[1] for item in items)
+        nodes = sum(item[2] for item in items)
+        coverage = (text_length / total_text + nodes / total_nodes) / 2
+        if coverage >= MIN_STRUCTURE_COVERAGE:
+            candidates.append((coverage, nodes, [item[0] for item in items]))
+    candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+    
+    structures = []
+    chosen = set()
+    for coverage, _, elements in candidates:
+        if len(structures) >= limit:
+            break
+        if any(id(parent) in chosen for parent in elements[0].parents):
+            continue
+        chosen.update(id(elem) for elem in elements)
+        container = _item_selector(elements[0])
+        structures.append({
+            "container": container,
+            "items": len(elements),
+            "coverage": round(coverage, 3),
+            "fields": [f"{container} {field_selector}" for field_selector in _structure_fields(elements)]
+        })
+    return structures
+
+def _add_suggestion(suggested_tags, tag_name, selector):
+    """Añade un selector a la sugerencia de una etiqueta, combinándolo si ya existe"""
+    if tag_name in suggested_tags:
+        current = suggested_tags[tag_name]["selector"]
+        if selector not in current.split(", "):
+            suggested_tags[tag_name]["selector"] = f"{current}, {selector}"
+    else:
+        suggested_tags[tag_name] = {"class": "", "id": "", "selector": selector}
+
+def structure_selectors(structure, suggested_tags=None):
+    """Convierte una estructura repetida en selecciones {etiqueta: {...}} (contenedor y campos)"""
+    suggested_tags = {} if suggested_tags is None else suggested_tags
+    for selector in [structure["container"]] + structure["fields"]:
+        # La etiqueta es la del último paso del selector (li.product h3 -> h3)
+        tag_name = selector.split()[-1].split('.')[0]
+        _add_suggestion(suggested_tags, tag_name, selector)
+    return suggested_tags
+
+def suggest_selectors(soup, page_type="general", stats=None, structures=None):
     """
     Sugiere selectores CSS basados en el tipo de página
     """
-    suggested_tags = {}
+    if stats is None:
+        stats = collect_document_stats(soup)
+    if structures is None:
+        structures = find_repeated_structures(stats)
     
-    # Análisis de clases más comunes
-    class_counter = Counter()
-    for tag in soup.find_all(True):
-        if 'class' in tag.attrs:
-            for cls in tag.attrs['class']:
-                class_counter[f"{tag.name}.{cls}"] += 1
+    suggested_tags = {}
     
     # Obtener las 10 clases más comunes
-    common_classes = [cls for cls, _ in class_counter.most_common(10)]
+    common_classes = [cls for cls, _ in stats.class_counts.most_common(10)]
     
     # Sugerencias específicas según tipo de página
-    if page_type == "ecommerce":
-        # Buscar elementos que probablemente sean productos
-        product_selectors = []
-        price_selectors = []
-        
-        # Buscar elementos de producto
-        for tag in soup.find_all(class_=re.compile(r'product|item|card')):
-            if tag.name == 'div' or tag.name == 'article' or tag.name == 'li':
-                try:
-                    class_names = " ".join(tag.attrs.get('class', []))
-                    product_selectors.append(f"{tag.name}.{class_names.replace(' ', '.')}")
-                except Exception:
-                    continue
+    if page_type == "ecommerce" and structures:
+        # El listado con mayor cobertura da el contenedor de producto y sus campos
+        structure_selectors(structures[0], suggested_tags)
+    
+    elif page_type == "ecommerce":
+        # Sin listados repetidos: buscar elementos que probablemente sean productos
+        product_selectors = [
+            _class_selector(tag_name, classes)
+            for tag_name, classes in stats.class_hits['listing']
+            if tag_name in ('div', 'article', 'li')
+        ]
         
         # Buscar elementos de precio
-        price_elements = soup.find_all(class_=re.compile(r'price|cost|amount'))
-        for tag in price_elements:
-            try:
-                class_names = " ".join(tag.attrs.get('class', []))
-                selector = f"{tag.name}.{class_names.replace(' ', '.')}"
-                price_selectors.append(selector)
-            except Exception:
-                continue
+        price_selectors = [_class_selector(tag_name, classes) for tag_name, classes in stats.class_hits['price']]
                 
         # Limitar a los 5 más probables
         product_selectors = product_selectors[:5]
@@ -155,17 +623,18 @@ def suggest_selectors(soup, page_type="general"):
     
     else:
         # Para páginas generales, usar las etiquetas más comunes
-        header_tags = soup.find_all(['h1', 'h2', 'h3'])
-        if header_tags:
+        if stats.tag_counts['h1'] or stats.tag_counts['h2'] or stats.tag_counts['h3']:
             suggested_tags["h1"] = {"class": "", "id": "", "selector": "h1"}
         
-        paragraphs = soup.find_all('p')
-        if paragraphs:
+        if stats.tag_counts['p']:
             suggested_tags["p"] = {"class": "", "id": "", "selector": "p"}
             
-        links = soup.find_all('a')
-        if links:
+        if stats.tag_counts['a']:
             suggested_tags["a"] = {"class": "", "id": "", "selector": "a"}
+        
+        # Añadir el listado principal si la página lo tiene
+        if structures:
+            structure_selectors(structures[0], suggested_tags)
     
     # Agregar algunos selectores comunes basados en análisis de frecuencia
     for selector in common_classes[:3]:
@@ -175,33 +644,489 @@ def suggest_selectors(soup, page_type="general"):
     
     return suggested_tags
 
-def auto_detect_elements(url):
+def split_selector_list(selector):
+    """Separa una lista de selectores por las comas de primer nivel (respeta paréntesis, corchetes y comillas)"""
+    parts = []
+    depth = 0
+    quote = None
+    current = []
+    for char in selector:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    parts.append("".join(current).strip())
+    return [part for part in parts if part]
+
+def _selector_key(selector):
     """
-    Función principal para detectar automáticamente elementos relevantes
+    Clave del último paso del selector para probarlo solo contra los nodos que pueden coincidir:
+    ("tag", etiqueta), ("class", clase) si el paso empieza por una clase, o None si no se puede saber.
     """
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
+    if "(" in selector or "[" in selector:
+        return None
+    last_step = re.split(r'\s*[\s>+~]\s*', selector.strip())[-1]
+    match = re.match(r'^([a-zA-Z][\w-]*)', last_step)
+    if match:
+        return ("tag", match.group(1).lower())
+    match = re.match(r'^\.(-?[_a-zA-Z][\w-]*)', last_step)
+    if match:
+        return ("class", match.group(1))
+    return None
+
+def _has_content(elem):
+    """Indica si un elemento produce contenido al extraerlo (texto, o enlace/fuente en a e img)"""
+    if elem.name == "img":
+        return bool(elem.get("src"))
+    if elem.name == "a" and elem.get("href"):
+        return True
+    return bool(elem.get_text(strip=True))
+
+def match_selectors(soup, selectors, deadline=None):
+    """
+    Evalúa muchos selectores CSS en un único recorrido del documento.
+    Cada selector distinto se compila una vez y cada nodo se prueba solo contra los selectores
+    cuyo último paso es su etiqueta o una de sus clases, más los genéricos.
+    Retorna ({selector: [elementos] o None si es inválido}, nodos visitados, recorrido cortado por el plazo).
+    """
+    matches = {}
+    by_tag = {}
+    by_class = {}
+    wildcard = []
+    for selector in selectors:
+        if selector in matches:
+            continue
+        try:
+            compiled = soupsieve.compile(selector)
+        except Exception:
+            matches[selector] = None
+            continue
+        matches[selector] = []
+        key = _selector_key(selector)
+        if key is None:
+            wildcard.append((compiled, matches[selector]))
+        elif key[0] == "tag":
+            by_tag.setdefault(key[1], []).append((compiled, matches[selector]))
+        else:
+            by_class.setdefault(key[1], []).append((compiled, matches[selector]))
+    
+    visited = 0
+    truncated = False
+    for node in soup.descendants:
+        if not isinstance(node, Tag):
+            continue
+        visited += 1
+        if deadline and visited & 1023 == 0 and perf_counter() >= deadline:
+            truncated = True
+            break
+        for compiled, found in by_tag.get(node.name, ()):
+            if compiled.match(node):
+                found.append(node)
+        if by_class:
+            classes = node.get('class')
+            if classes:
+                if isinstance(classes, str):
+                    classes = classes.split()
+                tested = set()
+                for cls in classes:
+                    for compiled, found in by_class.get(cls, ()):
+                        # Un nodo con varias clases indexadas no debe contarse dos veces
+                        if id(found) not in tested:
+                            tested.add(id(found))
+                            if compiled.match(node):
+                                found.append(node)
+        for compiled, found in wildcard:
+            if compiled.match(node):
+                found.append(node)
+    return matches, visited, truncated
+
+def validate_selectors(soup, suggested_tags, stats=None, deadline=None):
+    """
+    Evalúa todos los selectores sugeridos contra el documento ya parseado en un único recorrido
+    y conserva el mejor conjunto no redundante.
+    
+    Cada selector de una lista separada por comas se valora por separado: número de coincidencias,
+    proporción de coincidencias con contenido y solapamiento (Jaccard) con los demás.
+    Se descartan los inválidos, los vacíos, los que abarcan una parte excesiva del documento,
+    los que no producen contenido y los redundantes con otro mejor valorado.
+    Retorna (selecciones validadas, informe [{etiqueta, selector, coincidencias, ..., estado}]).
+    """
+    node_count = stats.node_count if stats is not None else None
+    
+    candidates = []
+    report = []
+    for tag_name, info in suggested_tags.items():
+        for selector in split_selector_list(info.get("selector", "")):
+            candidates.append({"etiqueta": tag_name, "selector": selector})
+    
+    matches, visited, truncated = match_selectors(soup, [c["selector"] for c in candidates], deadline)
+    for candidate in list(candidates):
+        if matches[candidate["selector"]] is None:
+            candidates.remove(candidate)
+            report.append({"etiqueta": candidate["etiqueta"], "selector": candidate["selector"], "coincidencias": 0,
+                           "con_contenido": 0.0, "texto_medio": 0, "puntuacion": 0.0, "estado": "inválido"})
+        else:
+            candidate["matches"] = matches[candidate["selector"]]
+    if node_count is None or truncated:
+        node_count = max(visited, 1)
+    
+    # Valorar cada selector
+    for candidate in candidates:
+        matches = candidate["matches"]
+        count = len(matches)
+        step = max(1, count // VALIDATION_SAMPLE_SIZE)
+        sample = matches[::step][:VALIDATION_SAMPLE_SIZE]
+        content_ratio = sum(1 for elem in sample if _has_content(elem)) / len(sample) if sample else 0.0
+        text_mean = sum(len(elem.get_text(strip=True)) for elem in sample) / len(sample) if sample else 0
+        
+        if count == 0:
+            # Con el recorrido incompleto no se puede afirmar que no haya coincidencias
+            status = "sin validar" if truncated else "vacío"
+        elif count > MAX_SELECTOR_MATCHES or (count > MIN_EXCESSIVE_MATCHES and count > node_count * MAX_SELECTOR_SHARE):
+            status = "excesivo"
+        elif content_ratio < MIN_CONTENT_RATIO:
+            status = "sin contenido"
+        else:
+            status = "ok"
+        
+        candidate.update({
+            "coincidencias": count,
+            "con_contenido": round(content_ratio, 2),
+            "texto_medio": round(text_mean),
+            "puntuacion": round(content_ratio * log1p(count), 3) if status == "ok" else 0.0,
+            "estado": status
+        })
+    
+    # Podar los redundantes: de los que coinciden con los mismos nodos se queda el mejor valorado
+    kept = []
+    for candidate in sorted((c for c in candidates if c["estado"] == "ok"), key=lambda c: c["puntuacion"], reverse=True):
+        ids = {id(elem) for elem in candidate["matches"]}
+        for other in kept:
+            overlap = len(ids & other["ids"]) / len(ids | other["ids"])
+            if overlap >= REDUNDANT_JACCARD:
+                candidate["estado"] = "redundante"
+                break
+        else:
+            candidate["ids"] = ids
+            kept.append(candidate)
+    
+    # Reconstruir las selecciones con los selectores supervivientes, mejor valorados primero
+    surviving = {}
+    for candidate in kept:
+        surviving.setdefault(candidate["etiqueta"], []).append(candidate["selector"])
+    for candidate in candidates:
+        if candidate["estado"] == "sin validar":
+            surviving.setdefault(candidate["etiqueta"], []).append(candidate["selector"])
+    validated = {}
+    for tag_name, info in suggested_tags.items():
+        if not info.get("selector"):
+            validated[tag_name] = info
+        elif tag_name in surviving:
+            validated[tag_name] = {**info, "selector": ", ".join(surviving[tag_name])}
+    
+    report.extend(
+        {key: candidate[key] for key in ("etiqueta", "selector", "coincidencias", "con_contenido",
+                                          "texto_medio", "puntuacion", "estado")}
+        for candidate in candidates
+    )
+    report.sort(key=lambda row: row["puntuacion"], reverse=True)
+    return validated, report
+
+def _entry_selectors(tag_name, info):
+    """Selectores CSS de una entrada de tags_info (selector explícito o etiqueta con clase/ID)"""
+    if info.get("selector"):
+        return split_selector_list(info["selector"])
+    selector = tag_name
+    if info.get("class"):
+        selector += "." + ".".join(info["class"].split())
+    if info.get("id"):
+        selector += f"#{info['id']}"
+    return [selector]
+
+def _selector_weight(selector):
+    """Los selectores con clase, ID, atributos o pseudoclases son más específicos que una etiqueta sola"""
+    return 1.0 if any(char in selector for char in ".#[:") else BARE_SELECTOR_WEIGHT
+
+def rank_templates(soup, templates=None, deadline=None):
+    """
+    Puntúa todas las plantillas (predefinidas y personalizadas) según cómo encajan sus selectores
+    en la página ya parseada. Los selectores de todas las plantillas se evalúan en un único recorrido.
+    
+    Cada etiqueta de una plantilla aporta el peso de su mejor selector (1 si es específico,
+    BARE_SELECTOR_WEIGHT si es solo una etiqueta) multiplicado por la proporción de coincidencias con
+    contenido; la puntuación es la media sobre todas sus etiquetas.
+    Retorna [{"template_id", "name", "score", "matched", "total", "matches"}, ...] de mejor a peor.
+    """
+    if templates is None:
+        templates = get_all_templates()
+    
+    entries = {
+        template_id: {tag_name: _entry_selectors(tag_name, info) for tag_name, info in template.get("tags", {}).items()}
+        for template_id, template in templates.items()
+    }
+    all_selectors = [selector for tags in entries.values() for selectors in tags.values() for selector in selectors]
+    matches, _, _ = match_selectors(soup, all_selectors, deadline)
+    
+    # Proporción de coincidencias con contenido de cada selector (sobre una muestra)
+    content_ratio = {}
+    for selector, found in matches.items():
+        if not found:
+            content_ratio[selector] = 0.0
+            continue
+        step = max(1, len(found) // VALIDATION_SAMPLE_SIZE)
+        sample = found[::step][:VALIDATION_SAMPLE_SIZE]
+        content_ratio[selector] = sum(1 for elem in sample if _has_content(elem)) / len(sample)
+    
+    ranking = []
+    for template_id, tags in entries.items():
+        total_score = 0.0
+        matched = 0
+        counts = {}
+        for tag_name, selectors in tags.items():
+            counts[tag_name] = sum(len(matches[selector] or []) for selector in selectors)
+            best = max((_selector_weight(selector) * content_ratio.get(selector, 0.0) for selector in selectors), default=0.0)
+            if best > 0:
+                matched += 1
+                total_score += best
+        ranking.append({
+            "template_id": template_id,
+            "name": templates[template_id].get("name", template_id),
+            "score": round(total_score / len(tags), 3) if tags else 0.0,
+            "matched": matched,
+            "total": len(tags),
+            "matches": counts
+        })
+    ranking.sort(key=lambda item: item["score"], reverse=True)
+    return ranking
+
+def _align_to_tag(content, position):
+    """Avanza hasta el siguiente '<' para no cortar una etiqueta (ni un carácter multibyte)"""
+    found = content.find(b"<", position)
+    return found if found != -1 else len(content)
+
+def sample_document(content, max_bytes):
+    """
+    Reduce un documento grande a una muestra representativa de max_bytes:
+    el inicio (con <head>), una región central y el final, cortados en límites de etiqueta.
+    Retorna (muestra, muestreado).
+    """
+    if len(content) <= max_bytes:
+        return content, False
+    region = max_bytes // 3
+    head_end = content.rfind(b"<", 0, region)
+    head = content[:head_end if head_end > 0 else region]
+    middle_start = _align_to_tag(content, len(content) // 2 - region // 2)
+    middle = content[middle_start:_align_to_tag(content, middle_start + region)]
+    tail = content[_align_to_tag(content, len(content) - region):]
+    return head + b"\n" + middle + b"\n" + tail, True
+
+def fetch_for_detection(url, max_bytes, deadline):
+    """
+    Descarga la página en streaming hasta DOWNLOAD_LIMIT_FACTOR * max_bytes o hasta el plazo.
+    Retorna (bytes, codificación declarada, tamaño total conocido, descarga completa).
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+    timeout = max(1.0, min(10.0, deadline - perf_counter()))
+    limit = max_bytes * DOWNLOAD_LIMIT_FACTOR
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
         response.raise_for_status()
+        declared = response.headers.get('Content-Length', '')
+        chunks = []
+        size = 0
+        complete = True
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= limit or perf_counter() >= deadline:
+                complete = False
+                break
+        # Si la descarga se cortó, el tamaño total solo se conoce por Content-Length
+        total = int(declared) if declared.isdigit() else size
+        if complete:
+            total = size
+        return b"".join(chunks), response.encoding, max(total, size), complete
+
+def _stored_result(spec):
+    """Resultado de autodetección a partir de la especificación aprendida de un dominio"""
+    stability = spec.get("stability", {})
+    return {
+        "page_type": spec.get("page_type", "general"),
+        "suggested_selectors": copy.deepcopy(spec.get("suggested_selectors", {})),
+        "selector_report": [],
+        "template_ranking": [],
+        "repeated_structures": [],
+        "confidence": round(sum(stability.values()) / len(stability), 2) if stability else 0.0,
+        "sampled": False,
+        "learned": True
+    }
+
+def auto_detect_elements(url, max_bytes=DETECTION_MAX_BYTES, max_nodes=DETECTION_MAX_NODES,
+                         time_limit=DETECTION_TIME_LIMIT, use_store=True, use_cache=True):
+    """
+    Función principal para detectar automáticamente elementos relevantes.
+    
+    La detección está acotada: se analizan como mucho max_bytes (las páginas mayores se muestrean
+    por inicio, centro y final), se recorren como mucho max_nodes y todo termina en time_limit segundos.
+    El resultado incluye "confidence" (0-1) y "sampled" cuando se analizó solo una parte de la página.
+    Si el dominio tiene selectores aprendidos (learn_domain_selectors) se devuelven sin descargar nada.
+    Si otra página del mismo dominio con un diseño casi idéntico ya se analizó, se reutiliza su resultado
+    (marcado con "cached") y solo se paga la huella del diseño.
+    """
+    if use_store:
+        spec = load_domain_spec(domain_key(url))
+        if spec:
+            return _stored_result(spec)
+    
+    try:
+        deadline = perf_counter() + time_limit
+        content, encoding, total_bytes, complete = fetch_for_detection(url, max_bytes, deadline)
+        
+        parse_budget = int((deadline - perf_counter()) * PARSE_BYTES_PER_SECOND / 2)
+        sample, sampled = sample_document(content, max(MIN_SAMPLE_BYTES, min(max_bytes, parse_budget)))
+        sampled = sampled or not complete
+        
+        # Páginas con el mismo diseño comparten resultado: basta con la huella del HTML
+        domain = domain_key(url)
+        fingerprint = layout_fingerprint(sample)
+        if use_cache:
+            cached = layout_cache.get(domain, fingerprint)
+            if cached is not None:
+                cached["cached"] = True
+                return cached
+        
+        # Sin codificación declarada, BeautifulSoup la detecta a partir de los bytes
+        markup = sample.decode(encoding, errors="replace") if encoding else sample
+        soup = BeautifulSoup(markup, 'lxml')
         
-        soup = BeautifulSoup(response.text, 'lxml')
+        # Un solo recorrido del árbol alimenta la detección y las sugerencias
+        stats = collect_document_stats(soup, max_nodes=max_nodes, deadline=deadline)
+        
+        # Fracción del documento analizada: bytes muestreados y, si el recorrido se cortó,
+        # nodos visitados frente a los estimados por el número de etiquetas de apertura
+        coverage = len(sample) / total_bytes if total_bytes else 1.0
+        if stats.truncated:
+            estimated_nodes = sample.count(b"<") - sample.count(b"</")
+            coverage *= min(1.0, stats.node_count / max(estimated_nodes, 1))
+        sampled = sampled or stats.truncated
         
         # Detectar tipo de página
-        page_type = detect_page_type(soup)
+        page_type = detect_page_type(soup, stats)
         
-        # Sugerir selectores según el tipo
-        suggested_selectors = suggest_selectors(soup, page_type)
+        # Listados repetidos ordenados por cobertura
+        structures = find_repeated_structures(stats)
         
-        return {
+        # Sugerir selectores según el tipo y validarlos contra el propio documento
+        suggested_selectors = suggest_selectors(soup, page_type, stats, structures)
+        suggested_selectors, selector_report = validate_selectors(soup, suggested_selectors, stats, deadline)
+        
+        result = {
             "page_type": page_type,
-            "suggested_selectors": suggested_selectors
+            "suggested_selectors": suggested_selectors,
+            "selector_report": selector_report,
+            "template_ranking": rank_templates(soup, deadline=deadline),
+            "repeated_structures": structures,
+            "confidence": detection_confidence(stats, coverage),
+            "sampled": sampled
         }
+        layout_cache.put(domain, fingerprint, result)
+        return result
         
     except Exception as e:
         return {
             "page_type": "unknown",
             "suggested_selectors": {},
+            "selector_report": [],
+            "template_ranking": [],
+            "repeated_structures": [],
+            "confidence": 0.0,
+            "sampled": False,
             "error": str(e)
         }
+
+def same_domain_links(url, content):
+    """Enlaces del mismo dominio encontrados en el HTML, sin fragmentos ni repetidos, en orden de aparición"""
+    domain = domain_key(url)
+    base = urldefrag(url)[0]
+    links = []
+    seen = {base}
+    for match in LINK_PATTERN.finditer(content):
+        href = (match.group(1) or match.group(2) or match.group(3) or b"").decode("utf-8", errors="ignore").strip()
+        if not href or href.startswith(("#", "javascript:", "mailto:", "tel:")):
+            continue
+        link = urldefrag(urljoin(url, href))[0]
+        if link.startswith(("http://", "https://")) and domain_key(link) == domain and link not in seen:
+            seen.add(link)
+            links.append(link)
+    return links
+
+def learn_domain_selectors(url, sample_size=LEARNING_SAMPLE_SIZE, urls=None, workers=LEARNING_WORKERS,
+                           time_limit=DETECTION_TIME_LIMIT):
+    """
+    Aprende los selectores de un sitio analizando varias de sus páginas a la vez.
+    
+    Sin `urls`, se toman sample_size - 1 enlaces del mismo dominio repartidos por la página inicial.
+    Se conservan los selectores que funcionan en al menos STABLE_SELECTOR_SHARE de las páginas
+    y el resultado se guarda por dominio, de modo que auto_detect_elements lo devuelve al instante.
+    """
+    try:
+        if urls is None:
+            deadline = perf_counter() + time_limit
+            content, _, _, _ = fetch_for_detection(url, DETECTION_MAX_BYTES, deadline)
+            links = same_domain_links(url, content)
+            # Enlaces repartidos por toda la página, no solo los del menú superior
+            step = max(1, len(links) // max(sample_size - 1, 1))
+            urls = [url] + links[::step][:sample_size - 1]
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda page_url: auto_detect_elements(page_url, time_limit=time_limit, use_store=False, use_cache=False), urls
+            ))
+        
+        pages = [page_url for page_url, result in zip(urls, results) if "error" not in result]
+        errors = [(page_url, result["error"]) for page_url, result in zip(urls, results) if "error" in result]
+        valid = [result for result in results if "error" not in result]
+        if len(valid) < 2:
+            return {"page_type": "unknown", "suggested_selectors": {}, "pages": pages, "errors": errors,
+                    "error": "Se necesitan al menos dos páginas analizadas para aprender los selectores"}
+        
+        # Contar en cuántas páginas aparece cada selector validado
+        appearances = Counter()
+        for result in valid:
+            for tag_name, info in result["suggested_selectors"].items():
+                for selector in split_selector_list(info.get("selector", "")):
+                    appearances[(tag_name, selector)] += 1
+        
+        suggested_selectors = {}
+        stability = {}
+        for (tag_name, selector), count in appearances.items():
+            share = count / len(valid)
+            if share >= STABLE_SELECTOR_SHARE:
+                stability[selector] = round(share, 2)
+                _add_suggestion(suggested_selectors, tag_name, selector)
+        
+        page_type = Counter(result["page_type"] for result in valid).most_common(1)[0][0]
+        spec = {
+            "page_type": page_type,
+            "suggested_selectors": suggested_selectors,
+            "pages": pages,
+            "stability": stability
+        }
+        if suggested_selectors:
+            save_domain_spec(domain_key(url), spec)
+        # Copia propia para quien llama: la especificación guardada se comparte entre sesiones
+        return {**copy.deepcopy(spec), "errors": errors, "learned": True}
+        
+    except Exception as e:
+        return {"page_type": "unknown", "suggested_selectors": {}, "pages": [], "errors": [], "error": str(e)}
@@ -0,0 +1,128 @@
+import copy
+import re
+import threading
+from collections import Counter, OrderedDict
+from math import log
+
+# Etiquetas de apertura y atributo class leídos directamente de los bytes, sin construir el árbol
+OPEN_TAG_PATTERN = re.compile(rb'<([a-zA-Z][\w:-]*)([^>]*)>')
+CLASS_ATTR_PATTERN = re.compile(rb'\bclass\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))', re.IGNORECASE)
+# Clases con números (item-3, product-123) cambian entre páginas con el mismo diseño
+VOLATILE_CLASS = re.compile(rb'\d')
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+# Distancia de Hamming máxima para considerar que dos páginas comparten diseño
+DEFAULT_THRESHOLD = 4
+DEFAULT_CAPACITY = 256
+
+def _layout_tokens(content):
+    """Secuencia de "etiqueta.clase1.clase2" de las etiquetas de apertura del documento"""
+    tokens = []
+    for match in OPEN_TAG_PATTERN.finditer(content):
+        token = match.group(1).lower()
+        attrs = match.group(2)
+        if b"class" in attrs:
+            class_match = CLASS_ATTR_PATTERN.search(attrs)
+            if class_match:
+                classes = class_match.group(1) or class_match.group(2) or class_match.group(3) or b""
+                stable = sorted(cls for cls in classes.split() if not VOLATILE_CLASS.search(cls))
+                if stable:
+                    token = token + b"." + b".".join(stable)
+        tokens.append(token)
+    return tokens
+
+def layout_fingerprint(content):
+    """
+    SimHash de 64 bits sobre tejas (shingles) de SHINGLE_SIZE etiquetas consecutivas con sus clases.
+    Páginas con el mismo diseño y distinto contenido dan huellas a poca distancia de Hamming.
+    Acepta bytes o texto; el valor depende del proceso (usa hash()), así que no debe guardarse en disco.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8", errors="ignore")
+    tokens = _layout_tokens(content)
+    shingles = Counter(
+        b" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))
+    )
+
+    mask = (1 << FINGERPRINT_BITS) - 1
+    weights = [0.0] * FINGERPRINT_BITS
+    for shingle, count in shingles.items():
+        # Peso logarítmico para que un listado largo no anule el resto del diseño
+        weight = 1.0 + log(count)
+        value = hash(shingle) & mask
+        for bit in range(FINGERPRINT_BITS):
+            if value >> bit & 1:
+                weights[bit] += weight
+            else:
+                weights[bit] -= weight
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def hamming_distance(a, b):
+    """Número de bits distintos entre dos huellas"""
+    return bin(a ^ b).count("1")
+
+class LayoutCache:
+    """
+    Caché LRU de resultados indexada por huella de diseño y limitada a cada dominio.
+    Una consulta devuelve el resultado de la huella más cercana del mismo dominio
+    si está a una distancia de Hamming de `threshold` o menos. Es segura entre hilos.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, threshold=DEFAULT_THRESHOLD):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain, fingerprint):
+        """Resultado guardado para un diseño casi idéntico, o None"""
+        with self._lock:
+            best_key = None
+            best_distance = self.threshold + 1
+            for key in self._entries:
+                if key[0] != domain:
+                    continue
+                distance = hamming_distance(key[1], fingerprint)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+                    if distance == 0:
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            # Copia para que quien llama pueda modificar el resultado sin alterar la caché
+            return copy.deepcopy(self._entries[best_key])
+
+    def put(self, domain, fingerprint, value):
+        """Guarda un resultado y descarta el menos usado si se supera la capacidad"""
+        with self._lock:
+            key = (domain, fingerprint)
+            self._entries[key] = copy.deepcopy(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self, domain=None):
+        """Vacía la caché completa o solo las entradas de un dominio"""
+        with self._lock:
+            if domain is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == domain]:
+                    del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+# Caché compartida por la autodetección
+layout_cache = LayoutCache()
@@ -0,0 +1,303 @@
+"""
+Servidor local que imita la API de chat de OpenAI (también en la ruta /openai/v1 que usa Groq)
+para probar y medir el análisis sin conexión ni API keys reales.
+
+Uso:
+    python -m utils.mock_llm_server --port 8900 --latency 0.3 --tokens-per-second 40 --error-rate 0.1
+
+y después, según el camino que se quiera probar:
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1  (ChatGPT)
+    GROQ_BASE_URL=http://127.0.0.1:8900       (Groq)
+    LOCAL_LLM_URL=http://127.0.0.1:8900/v1    (proveedor "local")
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8900
+
+# Comportamiento por defecto del servidor simulado
+DEFAULT_CONFIG = {
+    "latency": 0.2,               # segundos hasta el primer token
+    "tokens_per_second": 50.0,    # velocidad de generación de la respuesta (0 = instantánea)
+    "response_tokens": 60,        # palabras de cada respuesta
+    "error_rate": 0.0,            # proporción de consultas que reciben un 429 aleatorio
+    "retry_after": 1.0,           # segundos indicados en Retry-After de los 429
+    "requests_per_minute": 0,     # límite por API key; al superarlo se responde 429 (0 = sin límite)
+    "context_limit": 32000,       # tokens de prompt admitidos; por encima se responde 400
+    "models": ["mock-llm"],       # modelos que devuelve /models (se acepta cualquiera)
+    "seed": None                  # semilla de los errores aleatorios, para pruebas reproducibles
+}
+
+# Estimación de tokens del servidor: no depende de tiktoken
+CHARS_PER_TOKEN = 4
+
+WORDS = ("dato", "precio", "producto", "categoría", "patrón", "resumen", "valor", "página", "registro", "tendencia",
+         "oferta", "título", "enlace", "media", "total", "filtro")
+
+def count_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+def fake_answer(prompt, words):
+    """Respuesta determinista para un prompt: la misma consulta devuelve siempre el mismo texto"""
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    return " ".join(WORDS[digest[i % len(digest)] % len(WORDS)] for i in range(words))
+
+class MockLLMServer:
+    """
+    Servidor HTTP en un hilo con las rutas /v1/models y /v1/chat/completions (con y sin streaming).
+    Simula latencia, velocidad de generación, límites de velocidad (429 con Retry-After) y
+    límite de contexto (400 context_length_exceeded). stats recoge lo ocurrido para los benchmarks.
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, **config):
+        unknown = set(config) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Opciones no reconocidas: {', '.join(sorted(unknown))}")
+        self.config = {**DEFAULT_CONFIG, **config}
+        self.host = host
+        self.port = port
+        self.stats = {"solicitudes": 0, "respuestas": 0, "errores_429": 0, "errores_400": 0,
+                      "en_curso": 0, "max_en_curso": 0, "tokens_prompt": 0, "tokens_respuesta": 0}
+        self._random = random.Random(self.config["seed"])
+        self._requests = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """URL base para OPENAI_BASE_URL o LOCAL_LLM_URL"""
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        """Arranca el servidor en segundo plano y devuelve su URL base"""
+        server = self
+
+        class Handler(MockLLMHandler):
+            mock = server
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-llm-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Servidor LLM simulado en {self.url}")
+        return self.url
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, field, amount=1):
+        with self._lock:
+            self.stats[field] += amount
+
+    def rate_limit_wait(self, api_key):
+        """Segundos que debe esperar la key por el límite por minuto (0 si puede continuar)"""
+        limit = self.config["requests_per_minute"]
+        now = time.monotonic()
+        with self._lock:
+            if self.config["error_rate"] and self._random.random() < self.config["error_rate"]:
+                return self.config["retry_after"]
+            if not limit:
+                return 0.0
+            window = self._requests[api_key]
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= limit:
+                return 60 - (now - window[0])
+            window.append(now)
+            return 0.0
+
+    def begin(self):
+        with self._lock:
+            self.stats["solicitudes"] += 1
+            self.stats["en_curso"] += 1
+            self.stats["max_en_curso"] = max(self.stats["max_en_curso"], self.stats["en_curso"])
+
+    def end(self):
+        self._count("en_curso", -1)
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock = None
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _path(self):
+        # Groq usa /openai/v1/...; el resto de clientes /v1/...
+        path = self.path.split("?")[0]
+        return path[len("/openai"):] if path.startswith("/openai/") else path
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, code, headers=None):
+        self._send_json(status, {"error": {"message": message, "type": code, "code": code}}, headers)
+
+    def _api_key(self):
+        auth = self.headers.get("Authorization", "")
+        return auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+
+    def do_GET(self):
+        if self._path() == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "mock"}
+                for model in self.mock.config["models"]]})
+        elif self._path() == "/stats":
+            with self.mock._lock:
+                self._send_json(200, dict(self.mock.stats))
+        else:
+            self._send_error(404, f"Ruta no encontrada: {self.path}", "not_found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "JSON no válido", "invalid_request_error")
+            return
+        if self._path() != "/v1/chat/completions":
+            self._send_error(404, f"Ruta no encontrada: {self.path}", "not_found")
+            return
+        if not self._api_key():
+            self._send_error(401, "Falta la API key", "invalid_api_key")
+            return
+
+        mock = self.mock
+        mock.begin()
+        try:
+            self._chat_completion(request)
+        finally:
+            mock.end()
+
+    def _chat_completion(self, request):
+        mock = self.mock
+        config = mock.config
+        wait = mock.rate_limit_wait(self._api_key())
+        if wait > 0:
+            mock._count("errores_429")
+            self._send_error(429, f"Rate limit reached for requests. Please try again in {wait:.2f}s.",
+                             "rate_limit_exceeded", {"Retry-After": f"{wait:.2f}"})
+            return
+
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        prompt_tokens = count_tokens(prompt)
+        if prompt_tokens > config["context_limit"]:
+            mock._count("errores_400")
+            self._send_error(400, f"This model's maximum context length is {config['context_limit']} tokens. "
+                                  f"However, your messages resulted in {prompt_tokens} tokens (token limit exceeded).",
+                             "context_length_exceeded")
+            return
+
+        words = config["response_tokens"]
+        if request.get("max_tokens"):
+            words = min(words, int(request["max_tokens"]))
+        answer = fake_answer(prompt, words)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": words, "total_tokens": prompt_tokens + words}
+        mock._count("tokens_prompt", prompt_tokens)
+        mock._count("tokens_respuesta", words)
+        model = request.get("model", config["models"][0])
+        token_delay = 1 / config["tokens_per_second"] if config["tokens_per_second"] else 0.0
+
+        time.sleep(config["latency"])
+        if not request.get("stream"):
+            time.sleep(token_delay * words)
+            try:
+                self._send_json(200, {
+                    "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                                 "finish_reason": "stop"}],
+                    "usage": usage
+                })
+            except (BrokenPipeError, ConnectionResetError):
+                # El cliente canceló la consulta antes de la respuesta
+                return
+            mock._count("respuestas")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, word in enumerate(answer.split(" ")):
+                self._send_event({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                                  "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                               "finish_reason": None}]})
+                time.sleep(token_delay)
+            self._send_event({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                              "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self._send_event({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0,
+                                  "model": model, "choices": [], "usage": usage})
+            self._send_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            mock._count("respuestas")
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cerró el stream antes del final
+            pass
+
+    def _send_event(self, data):
+        payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        event = f"data: {payload}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+        self.wfile.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local compatible con la API de chat de OpenAI para pruebas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=DEFAULT_CONFIG["latency"])
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_CONFIG["tokens_per_second"])
+    parser.add_argument("--response-tokens", type=int, default=DEFAULT_CONFIG["response_tokens"])
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_CONFIG["error_rate"])
+    parser.add_argument("--retry-after", type=float, default=DEFAULT_CONFIG["retry_after"])
+    parser.add_argument("--requests-per-minute", type=int, default=DEFAULT_CONFIG["requests_per_minute"])
+    parser.add_argument("--context-limit", type=int, default=DEFAULT_CONFIG["context_limit"])
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockLLMServer(
+        args.host, args.port, latency=args.latency, tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens, error_rate=args.error_rate, retry_after=args.retry_after,
+        requests_per_minute=args.requests_per_minute, context_limit=args.context_limit, seed=args.seed
+    )
+    server.start()
+    print(f"Servidor LLM simulado en {server.url} (Ctrl+C para detener)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
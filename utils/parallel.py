@@ -0,0 +1,236 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import requests
+import pyarrow as pa
+from bs4 import BeautifulSoup
+from utils.scraper import USER_AGENT, iter_element_rows
+
+logger = logging.getLogger(__name__)
+
+# Pool de procesos compartido entre ejecuciones para no pagar el arranque en cada lote
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+def default_workers():
+    """Número de procesos por defecto: uno por núcleo disponible"""
+    return max(1, os.cpu_count() or 1)
+
+def get_process_pool(workers=None):
+    """
+    Devuelve el pool de procesos compartido, recreándolo si cambia el número de workers.
+    Un pool roto por la caída de un worker se descarta con discard_process_pool.
+    Se usa el contexto 'spawn' para no duplicar los hilos del servidor de Streamlit con fork.
+    """
+    global _process_pool, _process_pool_workers
+    workers = workers or default_workers()
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            _process_pool_workers = workers
+        return _process_pool
+
+def discard_process_pool(pool):
+    """Olvida el pool compartido si es `pool` (roto), para que la próxima llamada cree uno nuevo"""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+            _process_pool_workers = 0
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_process_pool():
+    """Cierra el pool de procesos compartido"""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=True)
+            _process_pool = None
+            _process_pool_workers = 0
+
+def _column_array(values):
+    """Array de Arrow con el tipo inferido; las columnas con tipos mezclados se pasan a texto"""
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+def rows_to_table(rows):
+    """
+    Convierte filas en una tabla Arrow conservando los tipos (números como números,
+    atributos ausentes como nulos), para que el resultado coincida con el de la extracción en serie
+    """
+    columns = []
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+    return pa.Table.from_arrays([_column_array([row.get(c) for row in rows]) for c in columns], names=columns)
+
+def rows_to_arrow_ipc(rows):
+    """Serializa filas como un flujo IPC de Arrow"""
+    table = rows_to_table(rows)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def arrow_ipc_to_table(payload):
+    """Lee un flujo IPC de Arrow como tabla"""
+    return pa.ipc.open_stream(payload).read_all()
+
+def arrow_ipc_to_rows(payload):
+    """Convierte un flujo IPC de Arrow en una lista de diccionarios"""
+    return arrow_ipc_to_table(payload).to_pylist()
+
+def _as_text(column):
+    """Pasa una columna a texto con el mismo formato que str() en la extracción en serie"""
+    return pa.array([None if value is None else str(value) for value in column.to_pylist()], type=pa.string())
+
+def concat_tables(tables):
+    """
+    Une las tablas de varias páginas en una sola. Las columnas que faltan en una página se rellenan
+    con nulos y las que llegan con tipos distintos se pasan a texto, como en _column_array.
+    """
+    types = {}
+    for table in tables:
+        for field in table.schema:
+            if pa.types.is_null(field.type):
+                types.setdefault(field.name, None)
+            elif types.get(field.name) in (None, field.type):
+                types[field.name] = field.type
+            else:
+                types[field.name] = pa.string()
+
+    arrays = []
+    for name, target in types.items():
+        target = target or pa.null()
+        chunks = []
+        for table in tables:
+            if name not in table.column_names:
+                chunks.append(pa.nulls(table.num_rows, type=target))
+            elif table.schema.field(name).type == target:
+                chunks.extend(table.column(name).chunks)
+            elif pa.types.is_null(table.schema.field(name).type):
+                chunks.append(pa.nulls(table.num_rows, type=target))
+            else:
+                chunks.append(_as_text(table.column(name)))
+        arrays.append(pa.chunked_array(chunks, type=target))
+    return pa.Table.from_arrays(arrays, names=list(types))
+
+def parse_and_extract(url, content, encoding, tags_info):
+    """
+    Tarea del worker: parsea el HTML descargado y extrae las filas.
+    Retorna (url, bytes IPC de Arrow, número de filas); el árbol nunca sale del proceso.
+    """
+    # Sin codificación declarada, BeautifulSoup la detecta a partir de los bytes
+    markup = content.decode(encoding, errors="replace") if encoding else content
+    soup = BeautifulSoup(markup, "lxml")
+    rows = []
+    for row in iter_element_rows(soup, tags_info):
+        row["URL"] = url
+        rows.append(row)
+    soup.decompose()
+    return url, rows_to_arrow_ipc(rows) if rows else None, len(rows)
+
+def fetch_page_bytes(url):
+    """Descarga una página y devuelve (bytes, codificación declarada)"""
+    response = requests.get(url, timeout=10, headers={'User-Agent': USER_AGENT})
+    response.raise_for_status()
+    return response.content, response.encoding
+
+def iter_scrape_parallel(urls, tags_info, workers=None, fetch_threads=8, batch_size=500, errors=None):
+    """
+    Extrae varias URLs repartiendo el parseo y la extracción en un pool de procesos.
+    Los hilos de descarga siguen trabajando mientras los procesos convierten el HTML en filas;
+    las filas viajan entre procesos como lotes Arrow y se entregan sin convertir: genera tablas Arrow
+    de hasta `batch_size` filas en orden de finalización. utils.sinks.stream_to_sink las acepta igual que
+    los lotes de utils.scraper.iter_scrape_batches (Parquet las escribe directamente y CSV/JSONL las
+    convierten a filas por partes); para un DataFrame basta con table.to_pandas().
+    Si un worker muere y el pool queda roto, se crea otro y se reintenta una vez cada página afectada.
+    """
+    pool = get_process_pool(workers)
+    # Limitar las páginas en vuelo para acotar la memoria
+    max_pending = max(2, (workers or default_workers()) * 2)
+    pending_tables = []
+    pending_rows = 0
+
+    with ThreadPoolExecutor(max_workers=fetch_threads) as fetchers:
+        url_iter = iter(urls)
+        downloads = {}
+        # {futuro: (url, contenido, codificación, intentos, pool)}: el contenido se conserva para reintentar
+        parsing = {}
+
+        def submit_parse(url, content, encoding, attempts=0):
+            nonlocal pool
+            try:
+                future = pool.submit(parse_and_extract, url, content, encoding, tags_info)
+            except BrokenProcessPool:
+                discard_process_pool(pool)
+                pool = get_process_pool(workers)
+                future = pool.submit(parse_and_extract, url, content, encoding, tags_info)
+            parsing[future] = (url, content, encoding, attempts, pool)
+
+        def schedule_downloads():
+            while len(downloads) + len(parsing) < max_pending + fetch_threads:
+                url = next(url_iter, None)
+                if url is None:
+                    return
+                downloads[fetchers.submit(fetch_page_bytes, url)] = url
+
+        schedule_downloads()
+        while downloads or parsing:
+            done, _ = wait(list(downloads) + list(parsing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    url = downloads.pop(future)
+                    try:
+                        content, encoding = future.result()
+                        submit_parse(url, content, encoding)
+                    except Exception as e:
+                        logger.error(f"Error descargando {url}: {e}")
+                        if errors is not None:
+                            errors.append((url, str(e)))
+                else:
+                    url, content, encoding, attempts, used_pool = parsing.pop(future)
+                    try:
+                        _, payload, _ = future.result()
+                    except BrokenProcessPool as e:
+                        if used_pool is pool:
+                            logger.warning("El pool de procesos quedó roto; se crea uno nuevo")
+                            discard_process_pool(pool)
+                            pool = get_process_pool(workers)
+                        if attempts < 1:
+                            submit_parse(url, content, encoding, attempts + 1)
+                        else:
+                            logger.error(f"Error procesando {url}: {e}")
+                            if errors is not None:
+                                errors.append((url, str(e)))
+                        continue
+                    except Exception as e:
+                        logger.error(f"Error procesando {url}: {e}")
+                        if errors is not None:
+                            errors.append((url, str(e)))
+                        continue
+                    if payload is None:
+                        continue
+                    pending_tables.append(arrow_ipc_to_table(payload))
+                    pending_rows += pending_tables[-1].num_rows
+                    if pending_rows >= batch_size:
+                        batch = concat_tables(pending_tables)
+                        while batch.num_rows >= batch_size:
+                            yield batch.slice(0, batch_size)
+                            batch = batch.slice(batch_size)
+                        pending_tables = [batch] if batch.num_rows else []
+                        pending_rows = batch.num_rows
+            schedule_downloads()
+
+    if pending_rows:
+        yield concat_tables(pending_tables)
@@ -0,0 +1,121 @@
+import re
+from collections import Counter
+from bs4 import BeautifulSoup
+
+# El HTML de cada elemento ocupa la mayor parte de los tokens y no aporta al análisis;
+# solo se usa para resumir las filas que no tienen contenido de texto
+DROPPED_COLUMNS = ("HTML",)
+HTML_COLUMN = "HTML"
+TEXT_COLUMN = "Contenido"
+
+# Longitud máxima de una celda en el prompt
+MAX_CELL_CHARS = 300
+# Valores largos que se repiten se sustituyen por un alias (@1, @2...) definido una sola vez
+ALIAS_MIN_LENGTH = 24
+ALIAS_MIN_REPEATS = 3
+
+# Formatos de salida: valores separados por tabuladores o pares clave=valor por fila
+PROMPT_FORMATS = {
+    "tsv": "Tabla (TSV)",
+    "kv": "Clave=valor"
+}
+DEFAULT_FORMAT = "tsv"
+
+WHITESPACE = re.compile(r'\s+')
+
+def clean_cell(value, max_chars=MAX_CELL_CHARS):
+    """Texto de una celda en una sola línea, sin espacios sobrantes y recortado"""
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    text = WHITESPACE.sub(" ", str(value)).strip()
+    if len(text) > max_chars:
+        text = text[:max_chars - 1].rstrip() + "…"
+    return text
+
+def html_summary(html, max_chars=MAX_CELL_CHARS):
+    """Texto visible de un fragmento HTML"""
+    if not html or not isinstance(html, str):
+        return ""
+    return clean_cell(BeautifulSoup(html, "lxml").get_text(" ", strip=True), max_chars)
+
+def prompt_columns(data, drop_columns=DROPPED_COLUMNS):
+    """Columnas del DataFrame que se envían al modelo"""
+    return [str(column) for column in data.columns if column not in drop_columns]
+
+def iter_clean_rows(data, columns, drop_columns=DROPPED_COLUMNS, max_cell_chars=MAX_CELL_CHARS):
+    """
+    Genera las filas como listas de celdas limpias en el orden de columns.
+    Si una fila no tiene Contenido se resume su HTML (solo cuando el HTML no se envía).
+    """
+    source_columns = [str(column) for column in data.columns]
+    positions = [source_columns.index(column) for column in columns]
+    text_index = columns.index(TEXT_COLUMN) if TEXT_COLUMN in columns else None
+    html_position = source_columns.index(HTML_COLUMN) \
+        if HTML_COLUMN in source_columns and HTML_COLUMN in drop_columns and text_index is not None else None
+
+    for values in data.itertuples(index=False, name=None):
+        row = [clean_cell(values[position], max_cell_chars) for position in positions]
+        if html_position is not None and not row[text_index]:
+            row[text_index] = html_summary(values[html_position], max_cell_chars)
+        yield row
+
+def encode_rows(columns, rows, output_format=DEFAULT_FORMAT):
+    """
+    Serializa filas limpias en un formato compacto para prompts:
+    - Las columnas vacías se omiten y las constantes se indican una vez al principio.
+    - Las filas idénticas se agrupan con su número de repeticiones.
+    - Los valores largos repetidos se sustituyen por alias con su leyenda.
+    """
+    if not rows:
+        return ""
+
+    lines = []
+    varying = []
+    for i, column in enumerate(columns):
+        values = {row[i] for row in rows}
+        if values == {""}:
+            continue
+        if len(values) == 1 and len(rows) > 1:
+            lines.append(f"{column}: {next(iter(values))}")
+        else:
+            varying.append(i)
+
+    unique_rows = Counter(tuple(row[i] for i in varying) for row in rows)
+    has_repeats = any(count > 1 for count in unique_rows.values())
+
+    aliases = {}
+    value_counts = Counter()
+    for row, count in unique_rows.items():
+        for value in row:
+            if len(value) >= ALIAS_MIN_LENGTH:
+                value_counts[value] += count
+    for value, count in value_counts.most_common():
+        if count < ALIAS_MIN_REPEATS:
+            break
+        aliases[value] = f"@{len(aliases) + 1}"
+    for value, alias in aliases.items():
+        lines.append(f"{alias} = {value}")
+
+    header = [columns[i] for i in varying]
+    if has_repeats:
+        header.append("veces")
+    if output_format == "tsv":
+        lines.append("\t".join(header))
+
+    for row, count in unique_rows.items():
+        cells = [aliases.get(value, value) for value in row]
+        if has_repeats:
+            cells.append(str(count))
+        if output_format == "kv":
+            lines.append(" | ".join(f"{name}={value}" for name, value in zip(header, cells) if value))
+        else:
+            # clean_cell ya sustituyó tabuladores y saltos de línea por espacios
+            lines.append("\t".join(cells))
+    return "\n".join(lines)
+
+def encode_dataframe(data, output_format=DEFAULT_FORMAT, drop_columns=DROPPED_COLUMNS,
+                     max_cell_chars=MAX_CELL_CHARS):
+    """Representación compacta de un DataFrame completo para incluirlo en un prompt"""
+    columns = prompt_columns(data, drop_columns)
+    rows = list(iter_clean_rows(data, columns, drop_columns, max_cell_chars))
+    return encode_rows(columns, rows, output_format)
@@ -0,0 +1,304 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from utils.telemetry import increment
+
+# Límites por defecto de la capa gratuita de cada proveedor (ajustar según la cuenta).
+# "key" se aplica a cada API key y modelo; "provider" a todas las consultas de la aplicación al proveedor.
+RATE_LIMITS = {
+    "openai": {
+        "key": {"requests_per_minute": 500, "tokens_per_minute": 200_000},
+        "provider": {"requests_per_minute": 3_500, "tokens_per_minute": 2_000_000}
+    },
+    "groq": {
+        "key": {"requests_per_minute": 30, "tokens_per_minute": 6_000},
+        "provider": {"requests_per_minute": 120, "tokens_per_minute": 60_000}
+    },
+    "gemini": {
+        "key": {"requests_per_minute": 15, "tokens_per_minute": 1_000_000},
+        "provider": {"requests_per_minute": 60, "tokens_per_minute": 4_000_000}
+    },
+    # Servidor local (utils/mock_llm_server.py): sin límites; se pueden copiar los de otro proveedor para simularlo
+    "local": {}
+}
+
+# Reintentos ante límites de velocidad (429) y errores transitorios del servidor
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# Espera máxima que se acepta antes de una consulta; por encima se devuelve el error
+MAX_WAIT = 120.0
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# "Please try again in 1.5s" (OpenAI, Groq), "retry_delay { seconds: 12 }" (Gemini), "retry after 3"
+RETRY_DELAY_PATTERN = re.compile(r'(?:retry(?:_delay| in| after)|try again in)[^\d]{0,20}([\d.]+)\s*(ms|s)?', re.IGNORECASE)
+
+class TokenBucket:
+    """
+    Cubo de fichas que se rellena de forma continua hasta `capacity` a `rate` fichas por segundo.
+    reserve() descuenta las fichas aunque el saldo quede negativo y devuelve cuánto hay que
+    esperar, así las consultas concurrentes se reparten en el tiempo en orden de llegada.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """Descuenta `amount` fichas y devuelve los segundos de espera hasta que estén disponibles"""
+        # Una consulta mayor que el cubo completo se admite cuando el cubo está lleno
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def release(self, amount):
+        """Devuelve una reserva que no llegó a usarse"""
+        self.adjust(min(amount, self.capacity))
+
+    def adjust(self, amount):
+        """Devuelve (positivo) o descuenta (negativo) fichas tras conocer el consumo real"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def drain(self):
+        """Vacía el cubo (el proveedor indicó que se alcanzó el límite)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0)
+
+class RateLimiter:
+    """
+    Planificador de consultas por proveedor y por API key con límites de solicitudes y tokens por minuto.
+    Las esperas indicadas por el proveedor (Retry-After) bloquean la key para todos los hilos.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits or RATE_LIMITS
+        self.waited = 0.0
+        self.retries = 0
+        self._buckets = {}
+        self._blocked_until = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, name, limit_type, per_minute):
+        with self._lock:
+            key = (name, limit_type)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(per_minute, per_minute / 60.0)
+            return self._buckets[key]
+
+    def _scopes(self, provider, key_id, model_name):
+        """Ámbitos (nombre, límites) que afectan a una consulta"""
+        limits = self.limits.get(provider, {})
+        scopes = []
+        if "provider" in limits:
+            scopes.append(((provider,), limits["provider"]))
+        if "key" in limits:
+            scopes.append(((provider, key_id, model_name), limits["key"]))
+        return scopes
+
+    def reserve(self, provider, key_id, model_name, tokens, max_wait=None):
+        """
+        Reserva una solicitud y `tokens` en todos los ámbitos; devuelve la espera necesaria.
+        Si la espera supera max_wait la reserva se deshace, así las consultas rechazadas no consumen cupo.
+        """
+        wait = 0.0
+        reserved = []
+        for name, limits in self._scopes(provider, key_id, model_name):
+            if "requests_per_minute" in limits:
+                bucket = self._bucket(name, "requests", limits["requests_per_minute"])
+                wait = max(wait, bucket.reserve(1))
+                reserved.append((bucket, 1))
+            if "tokens_per_minute" in limits and tokens:
+                bucket = self._bucket(name, "tokens", limits["tokens_per_minute"])
+                wait = max(wait, bucket.reserve(tokens))
+                reserved.append((bucket, tokens))
+        with self._lock:
+            blocked_until = self._blocked_until.get((provider, key_id), 0.0)
+        wait = max(wait, blocked_until - time.monotonic())
+        if max_wait is not None and wait > max_wait:
+            for bucket, amount in reserved:
+                bucket.release(amount)
+        return wait
+
+    def settle(self, provider, key_id, model_name, reserved_tokens, actual_tokens):
+        """
+        Corrige la reserva de tokens con el consumo real informado por el proveedor
+        (0 si la consulta falló y no llegó a procesarse)
+        """
+        if actual_tokens is None:
+            return
+        for name, limits in self._scopes(provider, key_id, model_name):
+            if "tokens_per_minute" in limits:
+                self._bucket(name, "tokens", limits["tokens_per_minute"]).adjust(reserved_tokens - actual_tokens)
+
+    def block(self, provider, key_id, model_name, seconds):
+        """Bloquea la key durante `seconds` y vacía sus cubos tras un 429"""
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._blocked_until[(provider, key_id)] = max(self._blocked_until.get((provider, key_id), 0.0), until)
+        for name, limits in self._scopes(provider, key_id, model_name)[1:]:
+            for limit_type, per_minute_key in (("requests", "requests_per_minute"), ("tokens", "tokens_per_minute")):
+                if per_minute_key in limits:
+                    self._bucket(name, limit_type, limits[per_minute_key]).drain()
+
+def backoff_delay(attempt, retry_after=None, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """
+    Espera antes del reintento `attempt` (desde 0): la indicada por el proveedor más un pequeño
+    margen aleatorio o, si no la hay, backoff exponencial con jitter completo.
+    """
+    if retry_after is not None:
+        return min(cap, retry_after) + random.uniform(0, base / 2)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def error_status(error):
+    """Código HTTP de un error de los SDK de OpenAI, Groq o Google, si se conoce"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_rate_limit_error(error):
+    """Indica si el proveedor rechazó la consulta por límite de velocidad o de cuota por minuto"""
+    if error_status(error) == 429:
+        return True
+    error_msg = str(error).lower()
+    return "rate limit" in error_msg or "resource exhausted" in error_msg or "too many requests" in error_msg
+
+def is_retryable_error(error):
+    """Errores que conviene reintentar: límites de velocidad, errores 5xx y fallos de conexión"""
+    if is_rate_limit_error(error) or error_status(error) in RETRYABLE_STATUS:
+        return True
+    return type(error).__name__ in ("APIConnectionError", "ServiceUnavailable", "InternalServerError")
+
+def retry_after_seconds(error):
+    """Segundos de espera indicados por el proveedor (cabeceras Retry-After o el mensaje de error)"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    match = RETRY_DELAY_PATTERN.search(str(error))
+    if match:
+        seconds = float(match.group(1))
+        return seconds / 1000 if match.group(2) == "ms" else seconds
+    return None
+
+# Planificador compartido por todas las consultas a los modelos
+rate_limiter = RateLimiter()
+
+def _wait_before_request(limiter, provider, key_id, model_name, tokens, max_wait):
+    """Reserva la capacidad de un intento y devuelve los segundos que hay que esperar antes de enviarlo"""
+    wait = limiter.reserve(provider, key_id, model_name, tokens, max_wait)
+    if wait > max_wait:
+        raise TimeoutError(f"Límite de velocidad de {provider}: habría que esperar {wait:.0f} s")
+    if wait > 0:
+        limiter.waited += wait
+        increment("espera_s", wait)
+    return wait
+
+def _retry_delay(limiter, provider, key_id, model_name, tokens, error, attempt, max_retries, max_wait):
+    """
+    Tras un intento fallido devuelve los tokens reservados (no se consumieron) y decide si se reintenta:
+    retorna los segundos de espera antes del siguiente intento, o None si hay que lanzar el error
+    """
+    limiter.settle(provider, key_id, model_name, tokens, 0)
+    if attempt >= max_retries or not is_retryable_error(error):
+        return None
+    delay = backoff_delay(attempt, retry_after_seconds(error))
+    if delay > max_wait:
+        return None
+    limiter.retries += 1
+    increment("reintentos")
+    if is_rate_limit_error(error):
+        # La espera se aplica a todas las consultas de la key y la cobra la siguiente reserva
+        limiter.block(provider, key_id, model_name, delay)
+        return 0.0
+    increment("espera_s", delay)
+    return delay
+
+def _settle_usage(limiter, provider, key_id, model_name, tokens, response, usage_tokens):
+    if usage_tokens is not None:
+        try:
+            limiter.settle(provider, key_id, model_name, tokens, usage_tokens(response))
+        except Exception:
+            pass
+
+def call_with_rate_limit(provider, key_id, model_name, tokens, request, usage_tokens=None,
+                         max_retries=MAX_RETRIES, max_wait=MAX_WAIT, limiter=None):
+    """
+    Ejecuta request() respetando los límites del proveedor y de la key.
+    Espera lo necesario antes de cada intento y reintenta los errores transitorios con la espera
+    de Retry-After o backoff exponencial con jitter. usage_tokens(respuesta), si se indica,
+    devuelve los tokens reales consumidos para corregir la reserva.
+    Las esperas y los reintentos se suman a las métricas de la llamada en curso (utils.telemetry).
+    Lanza la última excepción si se agotan los reintentos o la espera supera max_wait.
+    """
+    limiter = limiter or rate_limiter
+    attempt = 0
+    while True:
+        wait = _wait_before_request(limiter, provider, key_id, model_name, tokens, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            response = request()
+        except Exception as e:
+            delay = _retry_delay(limiter, provider, key_id, model_name, tokens, e, attempt, max_retries, max_wait)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        _settle_usage(limiter, provider, key_id, model_name, tokens, response, usage_tokens)
+        return response
+
+async def call_with_rate_limit_async(provider, key_id, model_name, tokens, request, usage_tokens=None,
+                                     max_retries=MAX_RETRIES, max_wait=MAX_WAIT, limiter=None):
+    """
+    Versión de call_with_rate_limit para clientes asíncronos: request() devuelve una corrutina
+    y las esperas no bloquean el bucle de eventos. Si la tarea se cancela, la consulta en curso
+    se aborta y sus tokens reservados se devuelven.
+    """
+    limiter = limiter or rate_limiter
+    attempt = 0
+    while True:
+        wait = _wait_before_request(limiter, provider, key_id, model_name, tokens, max_wait)
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+            response = await request()
+        except asyncio.CancelledError:
+            limiter.settle(provider, key_id, model_name, tokens, 0)
+            raise
+        except Exception as e:
+            delay = _retry_delay(limiter, provider, key_id, model_name, tokens, e, attempt, max_retries, max_wait)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        _settle_usage(limiter, provider, key_id, model_name, tokens, response, usage_tokens)
+        return response
@@ -0,0 +1,109 @@
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+from math import log
+import pandas as pd
+
+# Parámetros habituales de BM25: saturación de la frecuencia y normalización por longitud
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Índices guardados en memoria (uno por conjunto de resultados)
+INDEX_CACHE_SIZE = 8
+
+TEXT_COLUMN = "Contenido"
+WORD_PATTERN = re.compile(r'\w+')
+
+# Palabras vacías frecuentes en español e inglés que no aportan a la relevancia
+STOPWORDS = {
+    "a", "al", "algo", "como", "con", "cual", "cuales", "cuando", "de", "del", "donde", "el", "en", "es", "esta",
+    "este", "esto", "hay", "la", "las", "lo", "los", "mas", "me", "mi", "muy", "no", "o", "para", "pero", "por",
+    "que", "quien", "se", "si", "sin", "sobre", "son", "su", "sus", "un", "una", "unos", "unas", "y", "ya",
+    "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of", "on", "or", "the",
+    "this", "to", "what", "which", "who", "with"
+}
+
+def _strip_accents(text):
+    return "".join(char for char in unicodedata.normalize("NFD", text) if unicodedata.category(char) != "Mn")
+
+def _normalize_term(word):
+    """Reduce el plural más común (zapatillas -> zapatilla) para que coincidan singular y plural"""
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+def tokenize(text):
+    """Términos de un texto en minúsculas, sin acentos, sin palabras vacías y en singular"""
+    if not isinstance(text, str):
+        text = "" if text is None else str(text)
+    return [_normalize_term(word) for word in WORD_PATTERN.findall(_strip_accents(text.lower()))
+            if word not in STOPWORDS]
+
+class BM25Index:
+    """Índice invertido BM25 sobre una lista de documentos (uno por fila)"""
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for position, document in enumerate(documents):
+            terms = tokenize(document)
+            self.doc_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self.postings[term].append((position, frequency))
+        self.doc_count = len(self.doc_lengths)
+        self.avg_length = (sum(self.doc_lengths) / self.doc_count) if self.doc_count else 0.0
+
+    def scores(self, query):
+        """Puntuación BM25 de cada documento que contiene algún término de la consulta: {posición: puntuación}"""
+        scores = defaultdict(float)
+        if not self.doc_count or not self.avg_length:
+            return scores
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = log(1 + (self.doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[position] / self.avg_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return scores
+
+    def rank(self, query):
+        """Posiciones ordenadas por relevancia; las filas sin coincidencias van después en su orden original"""
+        scores = self.scores(query)
+        ranked = sorted(scores, key=lambda position: (-scores[position], position))
+        matched = set(ranked)
+        return ranked + [position for position in range(self.doc_count) if position not in matched]
+
+def data_fingerprint(data, column=TEXT_COLUMN):
+    """Huella de la columna de texto de un conjunto de resultados"""
+    values = data[column] if column in data.columns else data.astype(str).agg(" ".join, axis=1)
+    return len(values), int(pd.util.hash_pandas_object(values.astype(str), index=False).sum())
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_index(data, column=TEXT_COLUMN):
+    """Índice BM25 del conjunto de resultados; se construye una vez y se reutiliza mientras no cambie"""
+    key = (column, data_fingerprint(data, column))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    if column in data.columns:
+        documents = data[column].tolist()
+    else:
+        documents = data.astype(str).agg(" ".join, axis=1).tolist()
+    index = BM25Index(documents)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+def rank_rows(data, query, column=TEXT_COLUMN):
+    """Posiciones de las filas ordenadas por relevancia para la consulta"""
+    if data.empty or not query or not query.strip():
+        return list(range(len(data)))
+    return get_index(data, column).rank(query)
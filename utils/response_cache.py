@@ -0,0 +1,126 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Base de datos con las respuestas de los modelos, junto a la caché de validación de keys
+RESPONSE_CACHE_FILE = Path(__file__).parent.parent / "cache" / "llm_responses.sqlite3"
+
+# Las respuestas caducan a la semana y se conservan como máximo MAX_ENTRIES (las menos usadas se descartan)
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 500
+
+def normalize_prompt(prompt):
+    """Unifica saltos de línea y espacios para que prompts equivalentes compartan entrada"""
+    text = str(prompt).replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r' ?\n ?', '\n', text)
+    return text.strip()
+
+def response_cache_key(provider, model_name, prompt, params=None):
+    """Hash de proveedor, modelo, prompt normalizado y parámetros de generación"""
+    payload = json.dumps(
+        [provider, model_name, normalize_prompt(prompt), params or {}],
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    Caché persistente (SQLite) de respuestas de los modelos con caducidad y descarte LRU.
+    Cada consulta acertada actualiza la fecha de último acceso; al superar `max_entries`
+    se eliminan las entradas menos usadas. Es segura entre hilos.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_FILE, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """Abre la base de datos la primera vez que se usa"""
+        if self._conn is None:
+            self.path.parent.mkdir(exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, provider TEXT, model TEXT, response TEXT, "
+                "created REAL, accessed REAL, hits INTEGER DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """Respuesta guardada y vigente para la clave, o None"""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.ttl:
+                    if row is not None:
+                        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        conn.commit()
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE responses SET accessed = ?, hits = hits + 1 WHERE key = ?", (now, key))
+                conn.commit()
+            except sqlite3.Error:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, provider, model_name, response):
+        """Guarda una respuesta y aplica la caducidad y el límite de entradas"""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, provider, model, response, created, accessed, hits) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                    (key, provider, model_name, response, now, now)
+                )
+                conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)",
+                    (self.max_entries,)
+                )
+                conn.commit()
+            except sqlite3.Error:
+                # La caché es una optimización: un fallo al escribir no debe romper la consulta
+                pass
+
+    def clear(self):
+        """Elimina todas las respuestas guardadas"""
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute("DELETE FROM responses")
+                conn.commit()
+                return True, "Caché de respuestas vaciada"
+            except sqlite3.Error as e:
+                return False, f"Error al vaciar la caché de respuestas: {str(e)}"
+
+    def __len__(self):
+        with self._lock:
+            try:
+                return self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            except sqlite3.Error:
+                return 0
+
+# Caché compartida por las consultas a los modelos
+response_cache = ResponseCache()
@@ -8,14 +8,19 @@ from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import time as wait_module  # Renombramos la importación para evitar problemas
+from time import perf_counter
+from functools import lru_cache
 import os
 import platform
 import logging
+from utils.structured_data import extract_structured_records, records_cover_fields
 
 # Configurar el logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
 # Ruta para navegadores basados en Chromium
 def find_chromium_based_browsers():
     """Busca navegadores basados en Chromium instalados en el sistema"""
@@ -91,186 +96,403 @@ def find_chromium_based_browsers():
     
     return browsers
 
-def extract_element_data(elem, tag):
-    """Extrae datos específicos basados en el tipo de etiqueta"""
-    data = {
-        "Contenido": elem.get_text(strip=True),
-        "HTML": str(elem)
-    }
-    
-    # Extraer atributos específicos según el tipo de etiqueta
-    if tag == 'a':
-        data["href"] = elem.get('href', '')
-        data["texto_enlace"] = elem.get_text(strip=True)
+# Especificaciones de campos por defecto según la etiqueta.
+# Cada especificación admite:
+# - "text": "strip" (por defecto), "raw", "spaced" o "none"
+# - "html": True/False para incluir el HTML del elemento
+# - "attrs": lista de atributos (["href", "data-price"]) o diccionario
+#   {"columna": "atributo"} para renombrar columnas
+# - "text_columns": columnas adicionales que reutilizan el texto ya calculado
+# - "position": "row" o "column" para elementos de tabla
+DEFAULT_FIELD_SPECS = {
+    'a': {"attrs": ["href"], "text_columns": ["texto_enlace"]},
+    'img': {"attrs": ["src", "alt"]},
+    'input': {"attrs": ["name", "value", "type"]},
+    'button': {"attrs": ["name", "value", "type"]},
+    'select': {"attrs": ["name", "value", "type"]},
+    'meta': {"attrs": ["name", "content"]},
+    'tr': {"position": "row"},
+    'th': {"position": "column"},
+    'td': {"position": "column"},
+}
+
+TEXT_MODES = ("strip", "raw", "spaced", "none")
+
+# Extractores compilados que se conservan (uno por etiqueta y especificación normalizada)
+COMPILED_EXTRACTORS_CACHE_SIZE = 256
+
+def parse_attribute_list(text):
+    """Convierte una lista de atributos separada por comas en una lista limpia"""
+    if not text:
+        return []
+    return [attr.strip() for attr in text.split(",") if attr.strip()]
+
+def resolve_field_spec(tag, fields=None):
+    """
+    Combina la especificación por defecto de la etiqueta con la del usuario.
+    Los atributos del usuario se añaden a los predeterminados.
+    """
+    spec = {"text": "strip", "html": True, "attrs": {}, "text_columns": [], "position": None}
     
-    elif tag == 'img':
-        data["src"] = elem.get('src', '')
-        data["alt"] = elem.get('alt', '')
-        
-    elif tag in ['input', 'button', 'select']:
-        data["name"] = elem.get('name', '')
-        data["value"] = elem.get('value', '')
-        data["type"] = elem.get('type', '')
+    default = DEFAULT_FIELD_SPECS.get(tag, {})
+    for source in (default, fields or {}):
+        if "text" in source:
+            spec["text"] = source["text"] or "none"
+        if "html" in source:
+            spec["html"] = bool(source["html"])
+        if "position" in source:
+            spec["position"] = source["position"]
+        if source.get("text_columns"):
+            spec["text_columns"] = spec["text_columns"] + list(source["text_columns"])
         
-    elif tag == 'meta':
-        data["name"] = elem.get('name', '')
-        data["content"] = elem.get('content', '')
+        attrs = source.get("attrs") or {}
+        if isinstance(attrs, str):
+            attrs = parse_attribute_list(attrs)
+        if isinstance(attrs, dict):
+            spec["attrs"].update(attrs)
+        else:
+            spec["attrs"].update({attr: attr for attr in attrs})
+    
+    if spec["text"] not in TEXT_MODES:
+        raise ValueError(f"Modo de texto no válido: {spec['text']}. Usa uno de {TEXT_MODES}")
+    
+    return spec
+
+def _attribute_value(elem, attr):
+    """Obtiene un atributo como texto (los atributos multivalor como class se unen)"""
+    value = elem.get(attr, '')
+    if isinstance(value, list):
+        return " ".join(value)
+    return value
+
+def compile_field_extractor(tag, fields=None):
+    """
+    Compila una especificación de campos en una función especializada.
+    La función resultante calcula cada valor una sola vez por elemento.
+    """
+    spec = resolve_field_spec(tag, fields)
+    return _compile_extractor(spec["text"], spec["html"], tuple(spec["attrs"].items()),
+                              tuple(spec["text_columns"]), spec["position"])
+
+@lru_cache(maxsize=COMPILED_EXTRACTORS_CACHE_SIZE)
+def _compile_extractor(text_mode, include_html, attr_columns, text_columns, position):
+    """Extractor de una especificación normalizada; se reutiliza mientras siga en la caché LRU"""
+    if text_mode == "strip":
+        get_text = lambda elem: elem.get_text(strip=True)
+    elif text_mode == "spaced":
+        get_text = lambda elem: elem.get_text(" ", strip=True)
+    elif text_mode == "raw":
+        get_text = lambda elem: elem.get_text()
+    else:
+        get_text = lambda elem: ""
+    
+    def extractor(elem):
+        text = get_text(elem)
+        data = {"Contenido": text}
+        if include_html:
+            data["HTML"] = str(elem)
+        for column, attr in attr_columns:
+            data[column] = _attribute_value(elem, attr)
+        for column in text_columns:
+            data[column] = text
         
-    elif tag in ['tr', 'th', 'td']:
         # Para elementos de tabla, intentar obtener la fila/columna
-        parent = elem.find_parent('table')
-        if parent:
-            if tag == 'tr':
+        if position and elem.find_parent('table'):
+            if position == "row":
                 data["fila_num"] = len(elem.find_previous_siblings('tr')) + 1
             else:
                 data["columna_num"] = len(elem.find_previous_siblings()) + 1
+        return data
     
-    return data
+    return extractor
 
-def scrape_website_static(url, tags_info):
-    """Scrape website using requests and BeautifulSoup (for static content)"""
-    try:
-        response = requests.get(url, timeout=10, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "lxml")
+def extract_element_data(elem, tag, fields=None):
+    """Extrae datos específicos basados en el tipo de etiqueta"""
+    return compile_field_extractor(tag, fields)(elem)
+
+def expected_columns(tags_info, include_url=False):
+    """
+    Calcula las columnas que producirán las etiquetas configuradas.
+    Útil para los destinos incrementales que necesitan un esquema fijo desde el inicio.
+    """
+    columns = ["Etiqueta", "Contenido"]
+    if include_url:
+        columns.append("URL")
+    
+    for tag, attrs in tags_info.items():
+        spec = resolve_field_spec(tag, attrs.get('fields'))
+        extra = (["HTML"] if spec["html"] else []) + list(spec["attrs"].keys()) + spec["text_columns"]
+        if spec["position"] == "row":
+            extra.append("fila_num")
+        elif spec["position"] == "column":
+            extra.append("columna_num")
+        for column in extra:
+            if column not in columns:
+                columns.append(column)
+    
+    return columns
+
+def select_elements(soup, tag, attrs):
+    """Selecciona los elementos de una etiqueta según su selector o clase/ID"""
+    if attrs['selector']:
+        return soup.select(attrs['selector'])
+    return soup.find_all(tag, class_=attrs['class'] or None, id=attrs['id'] or None)
+
+def describe_selector(tag, attrs):
+    """Descripción legible del criterio de selección de una etiqueta"""
+    if attrs['selector']:
+        return attrs['selector']
+    description = tag
+    if attrs['class']:
+        description += f".{attrs['class']}"
+    if attrs['id']:
+        description += f"#{attrs['id']}"
+    return description
+
+def iter_element_rows(soup, tags_info, profile=None):
+    """
+    Recorre las etiquetas configuradas y genera una fila por elemento encontrado.
+    Los errores de una etiqueta se registran y no detienen el resto.
+    Si se proporciona un diccionario `profile`, se añaden en profile["selectors"]
+    las coincidencias, tiempos de selección y extracción, y bytes generados por etiqueta.
+    """
+    for tag, attrs in tags_info.items():
+        stats = None
+        if profile is not None:
+            stats = {"etiqueta": tag, "selector": describe_selector(tag, attrs), "coincidencias": 0,
+                     "seleccion_s": 0.0, "extraccion_s": 0.0, "bytes": 0}
+            profile.setdefault("selectors", []).append(stats)
         
-        data = []
-        for tag, attrs in tags_info.items():
-            try:
-                if attrs['selector']:
-                    elements = soup.select(attrs['selector'])
-                else:
-                    elements = soup.find_all(tag, class_=attrs['class'] or None, id=attrs['id'] or None)
-                
+        try:
+            start = perf_counter()
+            elements = select_elements(soup, tag, attrs)
+            extractor = compile_field_extractor(tag, attrs.get('fields'))
+            
+            if stats is None:
                 for elem in elements:
-                    elem_data = extract_element_data(elem, tag)
+                    elem_data = extractor(elem)
                     elem_data["Etiqueta"] = tag
-                    data.append(elem_data)
-                    
-            except Exception as e:
-                print(f"Error processing tag '{tag}': {e}")
+                    yield elem_data
+                continue
+            
+            stats["seleccion_s"] = perf_counter() - start
+            stats["coincidencias"] = len(elements)
+            for elem in elements:
+                start = perf_counter()
+                elem_data = extractor(elem)
+                stats["extraccion_s"] += perf_counter() - start
+                stats["bytes"] += sum(len(str(value).encode("utf-8")) for value in elem_data.values())
+                elem_data["Etiqueta"] = tag
+                yield elem_data
+        except Exception as e:
+            logger.error(f"Error procesando etiqueta '{tag}': {e}")
+            if stats is not None:
+                stats["error"] = str(e)
+
+def build_results_dataframe(data):
+    """Construye el DataFrame de resultados con Etiqueta y Contenido como primeras columnas"""
+    df = pd.DataFrame(data) if data else pd.DataFrame(columns=["Etiqueta", "Contenido", "HTML"])
+    
+    # Reorganizar columnas para poner Etiqueta y Contenido primero
+    if not df.empty:
+        cols = df.columns.tolist()
+        cols = ['Etiqueta', 'Contenido'] + [c for c in cols if c not in ['Etiqueta', 'Contenido']]
+        df = df[cols]
+    
+    return df
+
+def fetch_static_html(url):
+    """Descarga el HTML de una página con requests"""
+    response = requests.get(url, timeout=10, headers={'User-Agent': USER_AGENT})
+    response.raise_for_status()
+    return response.text
+
+def structured_records_dataframe(records):
+    """Convierte registros de datos estructurados en el formato de resultados de la aplicación"""
+    data = []
+    for record in records:
+        row = {"Etiqueta": f"schema:{record['tipo']}",
+               "Contenido": record.get("name") or record.get("headline") or ""}
+        row.update({key: value for key, value in record.items() if key != "tipo"})
+        data.append(row)
+    return build_results_dataframe(data)
+
+def try_structured_data(html, structured_data):
+    """
+    Intenta resolver la extracción con los datos estructurados de la página.
+    structured_data es un diccionario {"types": [...], "fields": [...]};
+    retorna un DataFrame si los registros cubren los campos requeridos, o None.
+    """
+    records = extract_structured_records(html, structured_data.get("types"))
+    if not records_cover_fields(records, structured_data.get("fields", [])):
+        return None
+    logger.info(f"Datos estructurados encontrados: {len(records)} registros")
+    return structured_records_dataframe(records)
+
+def scrape_structured_data(url, structured_data):
+    """
+    Vía rápida: descarga la página sin navegador y lee JSON-LD, microdatos y OpenGraph.
+    Retorna un DataFrame si los datos estructurados cubren los campos requeridos, o None.
+    """
+    try:
+        return try_structured_data(fetch_static_html(url), structured_data)
+    except Exception as e:
+        logger.warning(f"No se pudieron leer datos estructurados de {url}: {e}")
+        return None
+
+def scrape_website_static(url, tags_info, profile=False, structured_data=None):
+    """
+    Scrape website using requests and BeautifulSoup (for static content)
+    Con profile=True, el perfil de tiempos queda en df.attrs["profile"].
+    Si se indica structured_data, primero se intenta la vía rápida de datos estructurados.
+    """
+    try:
+        timings = {} if profile else None
         
-        df = pd.DataFrame(data) if data else pd.DataFrame(columns=["Etiqueta", "Contenido", "HTML"])
+        start = perf_counter()
+        html = fetch_static_html(url)
+        fetched = perf_counter()
         
-        # Reorganizar columnas para poner Etiqueta y Contenido primero
-        if not df.empty:
-            cols = df.columns.tolist()
-            cols = ['Etiqueta', 'Contenido'] + [c for c in cols if c not in ['Etiqueta', 'Contenido']]
-            df = df[cols]
-            
+        if structured_data:
+            df = try_structured_data(html, structured_data)
+            if df is not None:
+                if profile:
+                    df.attrs["profile"] = {"fetch_s": fetched - start, "parse_s": 0.0,
+                                           "extract_s": perf_counter() - fetched, "dataframe_s": 0.0,
+                                           "html_bytes": len(html.encode("utf-8")), "selectors": []}
+                return df
+        
+        soup = BeautifulSoup(html, "lxml")
+        parsed = perf_counter()
+        data = list(iter_element_rows(soup, tags_info, timings))
+        extracted = perf_counter()
+        df = build_results_dataframe(data)
+        
+        if profile:
+            timings.update({"fetch_s": fetched - start, "parse_s": parsed - fetched,
+                            "extract_s": extracted - parsed, "dataframe_s": perf_counter() - extracted,
+                            "html_bytes": len(html.encode("utf-8"))})
+            df.attrs["profile"] = timings
         return df
     except requests.exceptions.RequestException as e:
         return f"Error de conexión: {e}"
     except Exception as e:
         return f"Error inesperado: {e}"
 
-def scrape_website_dynamic(url, tags_info, wait_time=3):
-    """Scrape website using Selenium with any available Chromium-based browser"""
+def create_chromium_driver():
+    """
+    Inicia un WebDriver con el primer navegador Chromium disponible.
+    Retorna (driver, None) o (None, mensaje de error).
+    """
+    # Opciones estándar para navegadores Chromium
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument(f"--user-agent={USER_AGENT}")
+    
+    # Encontrar navegadores disponibles
+    browsers = find_chromium_based_browsers()
+    if browsers:
+        browser_names = list(browsers.keys())
+        logger.info(f"Navegadores encontrados: {browser_names}")
+        
+        # Usar el primer navegador encontrado
+        first_browser = browser_names[0]
+        browser_path = browsers[first_browser]
+        logger.info(f"Usando navegador: {first_browser} en {browser_path}")
+        
+        # Establecer la ubicación del binario
+        chrome_options.binary_location = browser_path
+    else:
+        logger.warning("No se encontraron navegadores Chromium instalados. Usando configuración predeterminada.")
+    
+    # Intentar iniciar el WebDriver con diferentes enfoques
+    driver = None
+    error_messages = []
+
+    # Intentar con Chrome
     try:
-        # Opciones estándar para navegadores Chromium
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
+        logger.info("Intentando con ChromeDriver...")
+        service = Service(ChromeDriverManager().install())
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+        logger.info("ChromeDriver iniciado correctamente")
+    except Exception as e:
+        error_messages.append(f"Error con ChromeDriver: {e}")
         
-        # Encontrar navegadores disponibles
-        browsers = find_chromium_based_browsers()
-        if browsers:
-            browser_names = list(browsers.keys())
-            logger.info(f"Navegadores encontrados: {browser_names}")
-            
-            # Usar el primer navegador encontrado
-            first_browser = browser_names[0]
-            browser_path = browsers[first_browser]
-            logger.info(f"Usando navegador: {first_browser} en {browser_path}")
-            
-            # Establecer la ubicación del binario
-            chrome_options.binary_location = browser_path
-        else:
-            logger.warning("No se encontraron navegadores Chromium instalados. Usando configuración predeterminada.")
+        # Intentar con Edge si falló Chrome y está disponible
+        if "Edge" in browsers:
+            try:
+                logger.info("Intentando con EdgeDriver...")
+                from selenium.webdriver.edge.service import Service as EdgeService
+                from webdriver_manager.microsoft import EdgeChromiumDriverManager
+                
+                edge_service = EdgeService(EdgeChromiumDriverManager().install())
+                driver = webdriver.Edge(service=edge_service, options=chrome_options)
+                logger.info("EdgeDriver iniciado correctamente")
+            except Exception as edge_e:
+                error_messages.append(f"Error con EdgeDriver: {edge_e}")
+    
+    # Si no se pudo inicializar el driver
+    if not driver:
+        browsers_str = ", ".join(browsers.keys()) if browsers else "ninguno"
+        error_msg = f"No se pudo iniciar ningún navegador. Navegadores disponibles: {browsers_str}.\n"
+        error_msg += "Errores:\n" + "\n".join(error_messages)
+        error_msg += "\n\nSoluciones posibles:\n"
+        error_msg += "1. Instalar Google Chrome, Microsoft Edge u otro navegador basado en Chromium\n"
+        error_msg += "2. Usar el modo estático (sin usar Selenium)\n"
+        error_msg += "3. Verificar la instalación de los controladores WebDriver"
         
-        # Intentar iniciar el WebDriver con diferentes enfoques
-        driver = None
-        error_messages = []
+        logger.error(error_msg)
+        return None, error_msg
+    
+    return driver, None
 
-        # Intentar con Chrome
-        try:
-            logger.info("Intentando con ChromeDriver...")
-            service = Service(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-            logger.info("ChromeDriver iniciado correctamente")
-        except Exception as e:
-            error_messages.append(f"Error con ChromeDriver: {e}")
-            
-            # Intentar con Edge si falló Chrome y está disponible
-            if "Edge" in browsers:
-                try:
-                    logger.info("Intentando con EdgeDriver...")
-                    from selenium.webdriver.edge.service import Service as EdgeService
-                    from webdriver_manager.microsoft import EdgeChromiumDriverManager
-                    
-                    edge_service = EdgeService(EdgeChromiumDriverManager().install())
-                    driver = webdriver.Edge(service=edge_service, options=chrome_options)
-                    logger.info("EdgeDriver iniciado correctamente")
-                except Exception as edge_e:
-                    error_messages.append(f"Error con EdgeDriver: {edge_e}")
+def fetch_dynamic_html(driver, url, wait_time=3):
+    """Navega a la URL con el driver y devuelve el HTML ya renderizado"""
+    logger.info(f"Navegando a URL: {url}")
+    driver.get(url)
+    
+    # Esperar explícitamente para que cargue la página
+    logger.info(f"Esperando {wait_time} segundos para que la página cargue...")
+    wait_module.sleep(wait_time)
+    return driver.page_source
+
+def scrape_website_dynamic(url, tags_info, wait_time=3, profile=False):
+    """
+    Scrape website using Selenium with any available Chromium-based browser
+    Con profile=True, el perfil de tiempos queda en df.attrs["profile"].
+    """
+    try:
+        timings = {} if profile else None
         
-        # Si no se pudo inicializar el driver
+        start = perf_counter()
+        driver, error_msg = create_chromium_driver()
         if not driver:
-            browsers_str = ", ".join(browsers.keys()) if browsers else "ninguno"
-            error_msg = f"No se pudo iniciar ningún navegador. Navegadores disponibles: {browsers_str}.\n"
-            error_msg += "Errores:\n" + "\n".join(error_messages)
-            error_msg += "\n\nSoluciones posibles:\n"
-            error_msg += "1. Instalar Google Chrome, Microsoft Edge u otro navegador basado en Chromium\n"
-            error_msg += "2. Usar el modo estático (sin usar Selenium)\n"
-            error_msg += "3. Verificar la instalación de los controladores WebDriver"
-            
-            logger.error(error_msg)
             return error_msg
+        driver_ready = perf_counter()
         
         # Continuar con el scraping si tenemos un driver
         try:
-            logger.info(f"Navegando a URL: {url}")
-            driver.get(url)
-            
-            # Esperar explícitamente para que cargue la página
-            logger.info(f"Esperando {wait_time} segundos para que la página cargue...")
-            wait_module.sleep(wait_time)
-            
             # Obtener el código HTML y parsearlo con BeautifulSoup
-            soup = BeautifulSoup(driver.page_source, "lxml")
-            
-            data = []
-            for tag, attrs in tags_info.items():
-                try:
-                    if attrs['selector']:
-                        elements = soup.select(attrs['selector'])
-                    else:
-                        elements = soup.find_all(tag, class_=attrs['class'] or None, id=attrs['id'] or None)
-                    
-                    for elem in elements:
-                        elem_data = extract_element_data(elem, tag)
-                        elem_data["Etiqueta"] = tag
-                        data.append(elem_data)
-                        
-                except Exception as e:
-                    logger.error(f"Error procesando etiqueta '{tag}': {e}")
+            html = fetch_dynamic_html(driver, url, wait_time)
+            fetched = perf_counter()
+            soup = BeautifulSoup(html, "lxml")
+            parsed = perf_counter()
+            data = list(iter_element_rows(soup, tags_info, timings))
+            extracted = perf_counter()
             
             # Cerrar el navegador
             driver.quit()
             
-            df = pd.DataFrame(data) if data else pd.DataFrame(columns=["Etiqueta", "Contenido", "HTML"])
-            
-            # Reorganizar columnas para poner Etiqueta y Contenido primero
-            if not df.empty:
-                cols = df.columns.tolist()
-                cols = ['Etiqueta', 'Contenido'] + [c for c in cols if c not in ['Etiqueta', 'Contenido']]
-                df = df[cols]
-                
+            df = build_results_dataframe(data)
+            if profile:
+                timings.update({"driver_s": driver_ready - start, "fetch_s": fetched - driver_ready,
+                                "parse_s": parsed - fetched, "extract_s": extracted - parsed,
+                                "dataframe_s": perf_counter() - extracted,
+                                "html_bytes": len(html.encode("utf-8"))})
+                df.attrs["profile"] = timings
             return df
         
         except Exception as e:
@@ -285,3 +507,48 @@ def scrape_website_dynamic(url, tags_info, wait_time=3):
     except Exception as e:
         logger.error(f"Error general: {e}")
         return f"Error general: {e}"
+
+def iter_scrape_batches(urls, tags_info, batch_size=500, use_selenium=False, wait_time=3, errors=None):
+    """
+    Extrae varias URLs y genera lotes de filas (listas de diccionarios) a medida que avanza.
+    Cada fila incluye la columna URL. Solo se mantiene en memoria una página y un lote a la vez,
+    por lo que puede combinarse con los destinos incrementales de utils.sinks.
+    Los errores por URL se registran y, si se proporciona, se añaden a la lista `errors`.
+    """
+    driver = None
+    if use_selenium:
+        driver, error_msg = create_chromium_driver()
+        if not driver:
+            raise RuntimeError(error_msg)
+    
+    batch = []
+    try:
+        for url in urls:
+            try:
+                html = fetch_dynamic_html(driver, url, wait_time) if driver else fetch_static_html(url)
+                soup = BeautifulSoup(html, "lxml")
+                del html
+            except Exception as e:
+                logger.error(f"Error descargando {url}: {e}")
+                if errors is not None:
+                    errors.append((url, str(e)))
+                continue
+            
+            for row in iter_element_rows(soup, tags_info):
+                row["URL"] = url
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            
+            # Liberar el árbol de la página antes de pasar a la siguiente
+            soup.decompose()
+        
+        if batch:
+            yield batch
+    finally:
+        if driver:
+            try:
+                driver.quit()
+            except:
+                pass
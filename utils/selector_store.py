@@ -0,0 +1,102 @@
+import copy
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+# Directorio para guardar los selectores aprendidos por dominio
+SELECTORS_DIR = Path(__file__).parent.parent / "learned_selectors"
+
+# Asegurar que existe el directorio de selectores
+if not SELECTORS_DIR.exists():
+    SELECTORS_DIR.mkdir(exist_ok=True)
+
+# Las especificaciones leídas se conservan en memoria para responder sin tocar el disco.
+# Se guardan y entregan copias: las sesiones editan los selectores devueltos
+_specs_cache = {}
+_specs_lock = threading.Lock()
+
+def domain_key(url):
+    """Dominio normalizado de una URL (en minúsculas y sin "www.")"""
+    netloc = urlparse(url).netloc.lower()
+    return netloc[4:] if netloc.startswith("www.") else netloc
+
+def _spec_path(domain):
+    """Ruta del archivo de un dominio"""
+    safe_domain = "".join(char if char.isalnum() or char in ".-" else "_" for char in domain)
+    return SELECTORS_DIR / f"{safe_domain}.json"
+
+def save_domain_spec(domain, spec):
+    """
+    Guarda la especificación aprendida de un dominio
+
+    spec debe contener:
+    - page_type: Tipo de página más frecuente
+    - suggested_selectors: Selecciones estables entre páginas
+    - pages: URLs analizadas
+    - stability: Fracción de páginas en las que funcionó cada selector
+    """
+    try:
+        data = {
+            "domain": domain,
+            "page_type": spec.get("page_type", "general"),
+            "suggested_selectors": copy.deepcopy(spec.get("suggested_selectors", {})),
+            "pages": list(spec.get("pages", [])),
+            "stability": dict(spec.get("stability", {})),
+            "learned_at": datetime.now().isoformat()
+        }
+        with open(_spec_path(domain), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        with _specs_lock:
+            _specs_cache[domain] = data
+        return True, f"Selectores de {domain} guardados"
+    except Exception as e:
+        return False, f"Error al guardar los selectores: {str(e)}"
+
+def load_domain_spec(domain):
+    """Carga la especificación aprendida de un dominio, o None si no existe"""
+    with _specs_lock:
+        if domain in _specs_cache:
+            return copy.deepcopy(_specs_cache[domain])
+    path = _spec_path(domain)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return None
+    with _specs_lock:
+        _specs_cache[domain] = data
+    return copy.deepcopy(data)
+
+def list_domain_specs():
+    """Lista los dominios con selectores aprendidos"""
+    specs = []
+    for path in SELECTORS_DIR.glob("*.json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            specs.append({
+                "domain": data.get("domain", path.stem),
+                "page_type": data.get("page_type", ""),
+                "pages": len(data.get("pages", [])),
+                "learned_at": data.get("learned_at", "")
+            })
+        except Exception:
+            continue
+    return sorted(specs, key=lambda spec: spec["learned_at"], reverse=True)
+
+def delete_domain_spec(domain):
+    """Elimina los selectores aprendidos de un dominio"""
+    try:
+        with _specs_lock:
+            _specs_cache.pop(domain, None)
+        path = _spec_path(domain)
+        if not path.exists():
+            return False, "No hay selectores aprendidos para ese dominio"
+        path.unlink()
+        return True, f"Selectores de {domain} eliminados"
+    except Exception as e:
+        return False, f"Error al eliminar los selectores: {str(e)}"
@@ -0,0 +1,233 @@
+import csv
+from abc import ABC, abstractmethod
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Directorio para guardar las exportaciones incrementales
+EXPORTS_DIR = Path(__file__).parent.parent / "exports"
+
+# Formatos disponibles y su extensión de archivo
+SINK_FORMATS = {
+    "csv": ".csv",
+    "jsonl": ".jsonl",
+    "parquet": ".parquet"
+}
+
+class BaseSink(ABC):
+    """
+    Destino incremental de filas con un búfer acotado.
+    Las filas se acumulan hasta `buffer_size` y luego se escriben en disco,
+    de modo que la memoria se mantiene constante durante extracciones largas.
+    """
+
+    def __init__(self, path, columns=None, buffer_size=1000):
+        self.path = Path(path)
+        self.columns = list(columns) if columns else None
+        self.buffer_size = buffer_size
+        self.rows_written = 0
+        self._buffer = []
+        self._closed = False
+        self._ignored_columns = set()
+
+    def write_rows(self, rows):
+        """Añade filas al búfer y lo vacía cuando alcanza su tamaño máximo"""
+        for row in rows:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def write_table(self, table):
+        """
+        Añade una tabla Arrow (por ejemplo, un lote de utils.parallel.iter_scrape_parallel).
+        Se convierte a filas por partes del tamaño del búfer, sin materializar la tabla entera.
+        """
+        for record_batch in table.to_batches(max_chunksize=self.buffer_size):
+            self.write_rows(record_batch.to_pylist())
+
+    @property
+    def pending_rows(self):
+        """Filas en el búfer que aún no se han escrito"""
+        return len(self._buffer)
+
+    def flush(self):
+        """Escribe en disco las filas pendientes"""
+        if not self._buffer:
+            return
+        if self.columns is None:
+            self.columns = self._infer_columns(self._buffer)
+        self._check_columns(self._buffer)
+        self._write_buffer(self._buffer)
+        self.rows_written += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        """Vacía el búfer y cierra el archivo"""
+        if self._closed:
+            return
+        self.flush()
+        self._close()
+        self._closed = True
+
+    def _infer_columns(self, rows):
+        """Deduce las columnas a partir del primer lote (Etiqueta y Contenido primero)"""
+        columns = ["Etiqueta", "Contenido"]
+        for row in rows:
+            for key in row:
+                if key not in columns:
+                    columns.append(key)
+        return columns
+
+    def _check_columns(self, rows):
+        """Registra una sola vez las columnas que no forman parte del esquema"""
+        known = set(self.columns)
+        for row in rows:
+            for key in row:
+                if key not in known and key not in self._ignored_columns:
+                    self._ignored_columns.add(key)
+                    logger.warning(f"Columna '{key}' fuera del esquema de {self.path.name}; se omitirá")
+
+    @abstractmethod
+    def _write_buffer(self, rows):
+        """Escribe un lote de filas en el archivo (cada formato la implementa)"""
+
+    def _close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+class CSVSink(BaseSink):
+    """Escribe filas en un archivo CSV, añadiendo cada lote al final"""
+
+    def __init__(self, path, columns=None, buffer_size=1000):
+        super().__init__(path, columns, buffer_size)
+        self._file = open(self.path, "w", newline="", encoding="utf-8")
+        self._writer = None
+
+    def _write_buffer(self, rows):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction="ignore")
+            self._writer.writeheader()
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+class JSONLSink(BaseSink):
+    """Escribe una fila JSON por línea; no necesita un esquema fijo"""
+
+    def __init__(self, path, columns=None, buffer_size=1000):
+        super().__init__(path, columns, buffer_size)
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def _check_columns(self, rows):
+        # JSON Lines admite columnas distintas en cada fila
+        pass
+
+    def _write_buffer(self, rows):
+        self._file.writelines(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows)
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+class ParquetSink(BaseSink):
+    """Escribe cada lote como un grupo de filas (row group) de Parquet"""
+
+    def __init__(self, path, columns=None, buffer_size=1000):
+        super().__init__(path, columns, buffer_size)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Se necesita pyarrow para exportar en formato Parquet (pip install pyarrow)")
+        self._pa = pa
+        self._pq = pq
+        self._writer = None
+
+    def _schema(self):
+        # Todas las columnas se guardan como texto para mantener un esquema estable entre lotes
+        return self._pa.schema([(column, self._pa.string()) for column in self.columns])
+
+    def _write_buffer(self, rows):
+        pa = self._pa
+        arrays = [
+            pa.array([None if row.get(column) is None else str(row.get(column)) for row in rows], type=pa.string())
+            for column in self.columns
+        ]
+        self._write_arrow(pa.Table.from_arrays(arrays, schema=self._schema()))
+
+    def write_table(self, table):
+        """Escribe una tabla Arrow directamente, sin pasar por diccionarios de Python"""
+        pa = self._pa
+        # Las filas pendientes van antes para conservar el orden
+        self.flush()
+        if self.columns is None:
+            self.columns = self._infer_columns([dict.fromkeys(table.column_names)])
+        self._check_columns([dict.fromkeys(table.column_names)])
+        arrays = []
+        for column in self.columns:
+            if column not in table.column_names:
+                arrays.append(pa.nulls(table.num_rows, type=pa.string()))
+                continue
+            values = table.column(column)
+            if pa.types.is_string(values.type):
+                arrays.append(values)
+            elif pa.types.is_integer(values.type) or pa.types.is_null(values.type):
+                arrays.append(values.cast(pa.string()))
+            else:
+                # Decimales, booleanos o listas: el mismo texto que str() en el camino por filas
+                arrays.append(pa.array([None if v is None else str(v) for v in values.to_pylist()], type=pa.string()))
+        self._write_arrow(pa.Table.from_arrays(arrays, schema=self._schema()))
+        self.rows_written += table.num_rows
+
+    def _write_arrow(self, table):
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(str(self.path), table.schema)
+        self._writer.write_table(table, row_group_size=self.buffer_size)
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+SINK_CLASSES = {
+    "csv": CSVSink,
+    "jsonl": JSONLSink,
+    "parquet": ParquetSink
+}
+
+def export_path(prefix="scraping", fmt="csv"):
+    """Genera una ruta única en el directorio de exportaciones"""
+    EXPORTS_DIR.mkdir(exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return EXPORTS_DIR / f"{prefix}_{timestamp}{SINK_FORMATS[fmt]}"
+
+def open_sink(path, fmt="csv", columns=None, buffer_size=1000):
+    """Crea el destino incremental correspondiente al formato indicado"""
+    if fmt not in SINK_CLASSES:
+        raise ValueError(f"Formato no soportado: {fmt}. Usa uno de {list(SINK_CLASSES)}")
+    return SINK_CLASSES[fmt](path, columns=columns, buffer_size=buffer_size)
+
+def stream_to_sink(batches, sink, progress_callback=None):
+    """
+    Consume un generador de lotes (listas de filas o tablas Arrow) y los escribe en el destino.
+    Cierra el destino al terminar y retorna el total de filas escritas.
+    """
+    with sink:
+        for batch in batches:
+            if hasattr(batch, "to_batches"):
+                sink.write_table(batch)
+            else:
+                sink.write_rows(batch)
+            if progress_callback:
+                progress_callback(sink.rows_written + sink.pending_rows)
+    return sink.rows_written
@@ -0,0 +1,276 @@
+import json
+import re
+import logging
+from html import unescape
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+# Expresiones para leer JSON-LD y metaetiquetas directamente del HTML, sin construir el árbol DOM
+JSON_LD_PATTERN = re.compile(
+    r'<script\b[^>]*type\s*=\s*["\']?application/ld\+json["\']?[^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL
+)
+META_TAG_PATTERN = re.compile(r'<meta\b([^>]*)>', re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+
+# Tipos schema.org agrupados en los tipos de registro que manejamos
+PRODUCT_TYPES = {"Product", "ProductModel", "IndividualProduct", "Offer"}
+ARTICLE_TYPES = {"Article", "NewsArticle", "BlogPosting", "ReportageNews", "AnalysisNewsArticle",
+                 "OpinionNewsArticle", "TechArticle", "ScholarlyArticle", "Report", "LiveBlogPosting"}
+
+# Campos normalizados de cada tipo de registro
+RECORD_FIELDS = {
+    "Product": ["name", "price", "currency", "availability", "image", "url", "description", "sku", "brand", "rating"],
+    "Article": ["headline", "description", "author", "date_published", "date_modified", "image", "url", "section"]
+}
+
+def _first(value):
+    """Devuelve el primer elemento si el valor es una lista"""
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+def _text(value):
+    """Convierte valores schema.org (texto, objeto con name/url, lista) en texto"""
+    value = _first(value)
+    if isinstance(value, dict):
+        return _text(value.get("name") or value.get("url") or value.get("@id"))
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+def _number(value):
+    """Convierte un precio o valoración a número; None si el texto no es un número reconocible"""
+    value = _first(value)
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r'[^\d.,-]', '', str(value))
+    if "," in cleaned and "." in cleaned:
+        # Con los dos separadores, el último es el decimal y el otro agrupa miles (1.234,56 o 1,234.56)
+        decimal, group = (",", ".") if cleaned.rfind(",") > cleaned.rfind(".") else (".", ",")
+        if not re.fullmatch(rf'-?\d{{1,3}}(\{group}\d{{3}})*\{decimal}\d+', cleaned):
+            return None
+        cleaned = cleaned.replace(group, "").replace(decimal, ".")
+    elif "," in cleaned or "." in cleaned:
+        separator = "," if "," in cleaned else "."
+        if re.fullmatch(rf'-?[1-9]\d{{0,2}}(\{separator}\d{{3}})+', cleaned):
+            # Grupos de tres cifras: separador de miles (1,299 o 1.234.567)
+            cleaned = cleaned.replace(separator, "")
+        elif cleaned.count(separator) == 1:
+            # Un único separador sin grupos de miles: decimal (12,5 o 9.99)
+            cleaned = cleaned.replace(separator, ".")
+        else:
+            return None
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+def _types_of(item):
+    """Tipos declarados en un objeto JSON-LD o microdatos"""
+    item_type = item.get("@type", [])
+    if isinstance(item_type, str):
+        item_type = [item_type]
+    # Los tipos pueden venir como URL completa (https://schema.org/Product)
+    return {str(t).rstrip("/").split("/")[-1] for t in item_type}
+
+def _iter_json_ld_items(data):
+    """Recorre objetos JSON-LD, desplegando listas y @graph"""
+    if isinstance(data, list):
+        for item in data:
+            yield from _iter_json_ld_items(item)
+    elif isinstance(data, dict):
+        if "@graph" in data:
+            yield from _iter_json_ld_items(data["@graph"])
+        if "@type" in data:
+            yield data
+
+def extract_json_ld(html):
+    """Extrae los objetos JSON-LD de los bloques <script type="application/ld+json">"""
+    items = []
+    for match in JSON_LD_PATTERN.finditer(html):
+        raw = match.group(1).strip()
+        # Algunos sitios envuelven el JSON en comentarios o CDATA
+        raw = re.sub(r'^\s*(<!--|<!\[CDATA\[)', '', raw)
+        raw = re.sub(r'(-->|\]\]>)\s*$', '', raw)
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            try:
+                data = json.loads(unescape(raw), strict=False)
+            except ValueError as e:
+                logger.debug(f"Bloque JSON-LD inválido: {e}")
+                continue
+        items.extend(_iter_json_ld_items(data))
+    return items
+
+def extract_meta_properties(html):
+    """Lee las metaetiquetas property/name con content (OpenGraph, product:*, article:*, twitter:*)"""
+    properties = {}
+    for match in META_TAG_PATTERN.finditer(html):
+        attrs = {}
+        for attr_match in ATTRIBUTE_PATTERN.finditer(match.group(1)):
+            value = attr_match.group(2) or attr_match.group(3) or attr_match.group(4) or ""
+            attrs[attr_match.group(1).lower()] = unescape(value)
+        key = attrs.get("property") or attrs.get("name") or attrs.get("itemprop")
+        if key and "content" in attrs:
+            # Conservar el primer valor de cada propiedad
+            properties.setdefault(key.lower(), attrs["content"])
+    return properties
+
+def _microdata_value(elem):
+    """Valor de una propiedad de microdatos según la etiqueta"""
+    if elem.has_attr("content"):
+        return elem["content"]
+    if elem.name in ("a", "link", "area"):
+        return elem.get("href", "")
+    if elem.name in ("img", "audio", "video", "source", "iframe", "embed"):
+        return elem.get("src", "")
+    if elem.name == "time" and elem.has_attr("datetime"):
+        return elem["datetime"]
+    if elem.name in ("data", "meter") and elem.has_attr("value"):
+        return elem["value"]
+    return elem.get_text(" ", strip=True)
+
+def _microdata_item(scope):
+    """Convierte un elemento con itemscope en un diccionario similar a JSON-LD"""
+    item = {"@type": scope.get("itemtype", "").split()}
+    for prop in scope.find_all(attrs={"itemprop": True}):
+        # Solo las propiedades cuyo itemscope más cercano es este elemento
+        owner = prop.find_parent(attrs={"itemscope": True})
+        if owner is not scope:
+            continue
+        value = _microdata_item(prop) if prop.has_attr("itemscope") else _microdata_value(prop)
+        for name in prop["itemprop"].split() if isinstance(prop["itemprop"], str) else prop["itemprop"]:
+            item.setdefault(name, value)
+    return item
+
+def extract_microdata(html):
+    """
+    Extrae los elementos de microdatos de primer nivel.
+    Solo se construye el árbol si el documento declara itemscope.
+    """
+    if "itemscope" not in html.lower():
+        return []
+    soup = BeautifulSoup(html, "lxml")
+    return [_microdata_item(scope) for scope in soup.find_all(attrs={"itemscope": True})
+            if not scope.has_attr("itemprop")]
+
+def _product_record(item):
+    """Normaliza un Product (u Offer) de schema.org"""
+    offers = _first(item.get("offers")) or {}
+    if not isinstance(offers, dict):
+        offers = {}
+    if "Offer" in _types_of(item):
+        offers = item
+    rating = item.get("aggregateRating") or {}
+    return {
+        "name": _text(item.get("name")),
+        "price": _number(offers.get("price") or offers.get("lowPrice")),
+        "currency": _text(offers.get("priceCurrency")),
+        "availability": _text(offers.get("availability")),
+        "image": _text(item.get("image")),
+        "url": _text(item.get("url") or offers.get("url")),
+        "description": _text(item.get("description")),
+        "sku": _text(item.get("sku")),
+        "brand": _text(item.get("brand")),
+        "rating": _number(rating.get("ratingValue")) if isinstance(rating, dict) else None
+    }
+
+def _article_record(item):
+    """Normaliza un Article (o subtipo) de schema.org"""
+    return {
+        "headline": _text(item.get("headline") or item.get("name")),
+        "description": _text(item.get("description")),
+        "author": _text(item.get("author")),
+        "date_published": _text(item.get("datePublished")),
+        "date_modified": _text(item.get("dateModified")),
+        "image": _text(item.get("image")),
+        "url": _text(item.get("url") or item.get("mainEntityOfPage")),
+        "section": _text(item.get("articleSection"))
+    }
+
+def _opengraph_record(meta):
+    """Construye un registro a partir de OpenGraph y las propiedades product:/article:"""
+    og_type = meta.get("og:type", "").lower()
+    if og_type.startswith("product") or "product:price:amount" in meta:
+        return "Product", {
+            "name": meta.get("og:title"),
+            "price": _number(meta.get("product:price:amount") or meta.get("og:price:amount")),
+            "currency": meta.get("product:price:currency") or meta.get("og:price:currency"),
+            "availability": meta.get("product:availability") or meta.get("og:availability"),
+            "image": meta.get("og:image"),
+            "url": meta.get("og:url"),
+            "description": meta.get("og:description"),
+            "sku": meta.get("product:retailer_item_id"),
+            "brand": meta.get("product:brand"),
+            "rating": None
+        }
+    if og_type == "article" or "article:published_time" in meta:
+        return "Article", {
+            "headline": meta.get("og:title"),
+            "description": meta.get("og:description"),
+            "author": meta.get("article:author") or meta.get("author"),
+            "date_published": meta.get("article:published_time"),
+            "date_modified": meta.get("article:modified_time"),
+            "image": meta.get("og:image"),
+            "url": meta.get("og:url"),
+            "section": meta.get("article:section")
+        }
+    return None, None
+
+def _record_type(item):
+    """Tipo de registro normalizado (Product/Article) de un objeto schema.org"""
+    types = _types_of(item)
+    if types & PRODUCT_TYPES:
+        return "Product"
+    if types & ARTICLE_TYPES:
+        return "Article"
+    return None
+
+def extract_structured_records(html, record_types=None):
+    """
+    Extrae registros tipados de JSON-LD, microdatos y OpenGraph (en ese orden de prioridad).
+    Cada registro incluye "tipo" (Product/Article), "fuente" y los campos de RECORD_FIELDS.
+    """
+    records = []
+    seen = set()
+
+    def add(record_type, source, fields):
+        if record_type is None or (record_types and record_type not in record_types):
+            return
+        key = (record_type, fields.get("url"), fields.get("name") or fields.get("headline"))
+        if key in seen:
+            return
+        seen.add(key)
+        records.append({"tipo": record_type, "fuente": source, **fields})
+
+    for item in extract_json_ld(html):
+        record_type = _record_type(item)
+        if record_type == "Product":
+            add(record_type, "json-ld", _product_record(item))
+        elif record_type == "Article":
+            add(record_type, "json-ld", _article_record(item))
+
+    for item in extract_microdata(html):
+        record_type = _record_type(item)
+        if record_type == "Product":
+            add(record_type, "microdata", _product_record(item))
+        elif record_type == "Article":
+            add(record_type, "microdata", _article_record(item))
+
+    record_type, fields = _opengraph_record(extract_meta_properties(html))
+    # OpenGraph solo describe la página principal: se usa si no hay otro registro de ese tipo
+    if record_type and not any(r["tipo"] == record_type for r in records):
+        add(record_type, "opengraph", fields)
+
+    return records
+
+def records_cover_fields(records, required_fields):
+    """Indica si algún registro tiene valor para todos los campos requeridos"""
+    if not records:
+        return False
+    return any(all(record.get(field) not in (None, "") for field in required_fields) for record in records)
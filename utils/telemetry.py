@@ -0,0 +1,270 @@
+import asyncio
+import contextvars
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import deque
+from functools import wraps
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Número máximo de llamadas que se conservan en memoria
+MAX_RECORDS = 2000
+
+# Nombre de proveedor según el argumento "model" de las funciones de análisis
+PROVIDER_ALIASES = {"chatgpt": "openai"}
+
+GROUP_COLUMNS = ["operacion", "proveedor", "modelo"]
+NUMERIC_COLUMNS = ["tokens_estimados", "tokens_prompt", "tokens_respuesta", "reintentos", "espera_s", "ttfb_s",
+                   "latencia_s"]
+
+class MetricsRegistry:
+    """Registro en memoria de las métricas de cada llamada a los modelos. Es seguro entre hilos."""
+
+    def __init__(self, max_records=MAX_RECORDS):
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    def records(self):
+        """Copia de las llamadas registradas, de la más antigua a la más reciente"""
+        with self._lock:
+            return [dict(record) for record in self._records]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def summary(self):
+        """
+        Resumen por operación, proveedor y modelo: llamadas, errores, aciertos de caché, latencias,
+        tiempo hasta el primer byte, tokens, rendimiento (tokens de respuesta por segundo),
+        truncados, reintentos y espera por límites de velocidad.
+        El tiempo hasta el primer byte solo se mide en las respuestas por streaming.
+        """
+        records = self.records()
+        if not records:
+            return pd.DataFrame()
+        df = pd.DataFrame(records)
+        for column in NUMERIC_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+        df["truncado"] = df["truncado"].astype(bool)
+        grouped = df.groupby(GROUP_COLUMNS, dropna=False)
+        summary = grouped.agg(
+            llamadas=("estado", "size"),
+            errores=("estado", lambda s: int((s == "error").sum())),
+            desde_cache=("estado", lambda s: int((s == "caché").sum())),
+            latencia_media_s=("latencia_s", "mean"),
+            latencia_p95_s=("latencia_s", lambda s: s.quantile(0.95)),
+            ttfb_medio_s=("ttfb_s", "mean"),
+            tokens_prompt=("tokens_prompt", lambda s: s.sum(min_count=1)),
+            tokens_respuesta=("tokens_respuesta", lambda s: s.sum(min_count=1)),
+            truncados=("truncado", "sum"),
+            reintentos=("reintentos", "sum"),
+            espera_s=("espera_s", "sum")
+        ).reset_index()
+        # Rendimiento medido solo con llamadas respondidas por el proveedor que informaron los tokens
+        remote = df[(df["estado"] == "ok") & df["tokens_respuesta"].notna()]
+        totals = remote.groupby(GROUP_COLUMNS, dropna=False)[["tokens_respuesta", "latencia_s"]].sum()
+        totals["tokens_por_s"] = totals["tokens_respuesta"] / totals["latencia_s"].where(totals["latencia_s"] > 0)
+        summary = summary.merge(totals[["tokens_por_s"]].reset_index(), on=GROUP_COLUMNS, how="left")
+        return summary.round(3)
+
+# Registro compartido por todas las llamadas
+metrics_registry = MetricsRegistry()
+
+# Pila de llamadas en curso de cada hilo o tarea de asyncio: las anotaciones van a la más reciente.
+# Es una tupla: las tareas heredan una copia del contexto y no deben modificar la pila de otra
+_calls = contextvars.ContextVar("llm_calls", default=())
+# Las llamadas de varios hilos (map-reduce) pueden sumar a la vez en el mismo registro exterior
+_parent_lock = threading.Lock()
+
+def _push(record):
+    return _calls.set(_calls.get() + (record,))
+
+def _pop(token):
+    _calls.reset(token)
+
+def current_call():
+    """Métricas de la llamada en curso en este hilo o tarea, o None"""
+    stack = _calls.get()
+    return stack[-1] if stack else None
+
+def annotate(**fields):
+    """Añade campos a la llamada en curso (sin efecto si no hay ninguna)"""
+    call = current_call()
+    if call is not None:
+        call.update(fields)
+
+def increment(field, amount=1):
+    """Suma a un campo numérico de la llamada en curso"""
+    call = current_call()
+    if call is not None:
+        call[field] = (call.get(field) or 0) + amount
+
+def bind_current_call(function):
+    """
+    Envuelve function para que, ejecutada en otro hilo, sus llamadas se sumen a la llamada
+    en curso en el hilo actual (por ejemplo las consultas en paralelo de un map-reduce)
+    """
+    parent = current_call()
+    if parent is None:
+        return function
+
+    @wraps(function)
+    def bound(*args, **kwargs):
+        token = _push(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _pop(token)
+    return bound
+
+def _new_record(operation, provider, model_name, function_name):
+    return {
+        "inicio": time.time(),
+        "operacion": operation,
+        "proveedor": provider,
+        "modelo": model_name,
+        "funcion": function_name,
+        "estado": "ok",
+        "tokens_estimados": None,
+        "tokens_prompt": None,
+        "tokens_respuesta": None,
+        "truncado": False,
+        "reintentos": 0,
+        "espera_s": 0.0,
+        "ttfb_s": None,
+        "latencia_s": None,
+        "_llamadas": 0,
+        "_llamadas_cache": 0
+    }
+
+def _finish(record, started, is_error, answer):
+    # ttfb_s queda en None salvo en streaming: en una respuesta completa coincidiría con la latencia
+    record["latencia_s"] = time.perf_counter() - started
+    record.pop("funcion", None)
+    with _parent_lock:
+        calls = record.pop("_llamadas")
+        cached_calls = record.pop("_llamadas_cache")
+    if record["estado"] == "ok" and calls and cached_calls == calls:
+        # Todas las consultas internas se sirvieron desde la caché
+        record["estado"] = "caché"
+    if record["estado"] != "caché" and is_error is not None and isinstance(answer, str) and is_error(answer):
+        record["estado"] = "error"
+    metrics_registry.add(record)
+    # Una llamada dentro de otra (ask_* dentro de analyze_scraped_data) suma sus tokens y reintentos a la exterior
+    parent = current_call()
+    if parent is not None:
+        with _parent_lock:
+            for field in ("tokens_prompt", "tokens_respuesta"):
+                if record[field] is not None:
+                    parent[field] = (parent.get(field) or 0) + record[field]
+            parent["reintentos"] += record["reintentos"]
+            parent["espera_s"] += record["espera_s"]
+            parent["truncado"] = parent["truncado"] or record["truncado"]
+            parent["_llamadas"] += 1
+            parent["_llamadas_cache"] += record["estado"] == "caché"
+    logger.info(f"Métricas IA: {json.dumps(record, ensure_ascii=False, default=str)}")
+
+def instrumented(operation, provider=None, is_error=None):
+    """
+    Decorador que registra las métricas de cada llamada a la función decorada.
+    provider fija el proveedor; si es None se toma del argumento "model" (analyze_scraped_data).
+    El modelo se lee del argumento "model_name". Una llamada recursiva a la misma función
+    (reintento con un prompt más corto) se cuenta en el mismo registro como reintento.
+    Las funciones generadoras registran además el tiempo hasta el primer fragmento; las corrutinas
+    canceladas quedan con estado "cancelado".
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        def describe(args, kwargs):
+            bound = signature.bind_partial(*args, **kwargs)
+            bound.apply_defaults()
+            name = provider or bound.arguments.get("model")
+            return PROVIDER_ALIASES.get(name, name), bound.arguments.get("model_name")
+
+        def enter(args, kwargs):
+            """Devuelve (registro, True) si es una llamada nueva o (registro, False) si es un reintento"""
+            call = current_call()
+            if call is not None and call.get("funcion") == function.__name__:
+                call["reintentos"] += 1
+                call["truncado"] = True
+                return call, False
+            record = _new_record(operation, *describe(args, kwargs), function.__name__)
+            return record, True
+
+        if inspect.isgeneratorfunction(function):
+            @wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                record, owner = enter(args, kwargs)
+                started = time.perf_counter()
+                first_chunk = None
+                finished = False
+                inner = function(*args, **kwargs)
+                try:
+                    while True:
+                        # El registro solo está activo mientras se ejecuta el generador, no entre fragmentos
+                        token = _push(record)
+                        try:
+                            chunk = next(inner)
+                        except StopIteration:
+                            finished = True
+                            break
+                        finally:
+                            _pop(token)
+                        if first_chunk is None:
+                            first_chunk = chunk
+                            if owner:
+                                record["ttfb_s"] = time.perf_counter() - started
+                        yield chunk
+                finally:
+                    if owner:
+                        if not finished and record["estado"] == "ok":
+                            # El consumidor dejó de leer la respuesta antes del final
+                            record["estado"] = "interrumpido"
+                        _finish(record, started, is_error, first_chunk)
+            return generator_wrapper
+
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def coroutine_wrapper(*args, **kwargs):
+                record, owner = enter(args, kwargs)
+                started = time.perf_counter()
+                token = _push(record)
+                try:
+                    answer = await function(*args, **kwargs)
+                except asyncio.CancelledError:
+                    # La consulta se abortó antes de responder (consultas simultáneas)
+                    record["estado"] = "cancelado"
+                    raise
+                finally:
+                    _pop(token)
+                    if owner and record["estado"] == "cancelado":
+                        _finish(record, started, None, None)
+                if owner:
+                    _finish(record, started, is_error, answer)
+                return answer
+            return coroutine_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            record, owner = enter(args, kwargs)
+            started = time.perf_counter()
+            token = _push(record)
+            try:
+                answer = function(*args, **kwargs)
+            finally:
+                _pop(token)
+            if owner:
+                _finish(record, started, is_error, answer)
+            return answer
+        return wrapper
+    return decorator
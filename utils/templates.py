@@ -22,6 +22,8 @@ DEFAULT_TEMPLATES = {
             "img": {"class": "", "id": "", "selector": "img.product-image"},
             "a": {"class": "", "id": "", "selector": "a.product-link"}
         },
+        # Vía rápida: si la página publica JSON-LD, microdatos u OpenGraph con estos campos
+        "structured_data": {"types": ["Product"], "fields": ["name", "price"]},
         "use_selenium": True,
         "wait_time": 3
     },
@@ -37,6 +39,7 @@ DEFAULT_TEMPLATES = {
             "img": {"class": "", "id": "", "selector": "img.featured-image"},
             "a": {"class": "", "id": "", "selector": "a.author-link"}
         },
+        "structured_data": {"types": ["Article"], "fields": ["headline", "date_published"]},
         "use_selenium": False,
         "wait_time": 2
     },